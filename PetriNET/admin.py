@@ -13,7 +13,8 @@ from django.shortcuts import redirect
 from django.urls import path
 from django.utils.html import format_html
 
-from .models import TC, BusStop, City, District, PassengerFlow, PassengerFlowEntry, Route, Simulation
+from .models import (TC, BusStop, CalculationJob, City, District, PassengerFlow, PassengerFlowEntry, Route,
+                     Simulation)
 from .petri_net_utils import CreateResponseFile
 
 
@@ -310,12 +311,12 @@ class SimulationAdmin(admin.ModelAdmin):
     list_display = ('id', 'created_at', 'download_report_action')
     list_filter = ('created_at',)
     search_fields = ('description',)
-    readonly_fields = ('id', 'created_at', 'download_report_action')
+    readonly_fields = ('id', 'created_at', 'input_hash', 'download_report_action')
     ordering = ('-created_at',)
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('id', 'created_at', 'description')
+            'fields': ('id', 'created_at', 'description', 'input_hash')
         }),
         ('Данные расчёта', {
             'fields': ('input_data', 'report_data'),
@@ -392,4 +393,20 @@ class SimulationAdmin(admin.ModelAdmin):
         return redirect('admin:PetriNET_simulation_change', simulation_id)
 
 
+@admin.register(CalculationJob)
+class CalculationJobAdmin(admin.ModelAdmin):
+    """Админ-панель задач расчёта (только просмотр, задачи создаются через API)"""
+    list_display = ('id', 'status', 'stage', 'progress', 'user', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('user__username', 'error_message')
+    ordering = ('-created_at',)
+    raw_id_fields = ('user', 'simulation')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 # admin.site.register(EI)
@@ -0,0 +1,257 @@
+"""
+Бенчмарки движка расчёта на синтетической транспортной сети.
+
+Сеть строится детерминированно (по seed) сразу в виде снимка PetriNet.NetworkSnapshot,
+поэтому расчёт, отчёт и выгрузка в Excel замеряются без базы данных и PostGIS
+"""
+from __future__ import annotations
+
+import math
+import platform
+import random
+import statistics
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+from .mesoscopic_utils import MesoscopicNet
+from .petri_net_utils import (CALCULATION_ENGINE_DISCRETE, CALCULATION_ENGINE_MESOSCOPIC, TIMELINE_FORMAT_DELTA,
+                              TIMELINE_FORMAT_FULL, CreateResponseFile, PetriNet)
+
+# Расположение остановок синтетического города
+LAYOUT_GRID = 'grid'
+LAYOUT_RADIAL = 'radial'
+LAYOUTS = (LAYOUT_GRID, LAYOUT_RADIAL)
+
+# Шаг между соседними остановками (градусов, ~300-450 м)
+SYNTHETIC_STOP_STEP = 0.004
+SYNTHETIC_CENTER = (55.75, 37.62)
+# Доля пассажиров без направления (поедут на случайную достижимую остановку)
+SYNTHETIC_RANDOM_DIRECTION_SHARE = 0.2
+
+
+def CreateSyntheticNetwork(layout: str = LAYOUT_GRID, stops_count: int = 400, routes_count: int = 20,
+                           stops_per_route: int = 20, passengers_count: int = 10000, seed: int = 1,
+                           capacity: int = 80, interval: int = 10, amount: int = 3) -> dict:
+    """
+    Детерминированный синтетический город в формате результата GetDataToCalculate:
+    {'city_id': 0, 'network': PetriNet.NetworkSnapshot, 'busstops_directions': [...]}
+
+    grid - остановки на квадратной сетке, маршруты идут по отрезкам строк и столбцов;
+    radial - остановки на лучах из центра, маршрут идёт по одному лучу к центру и по другому от центра
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Неизвестное расположение остановок: {layout}")
+    rng = random.Random(seed)
+    if layout == LAYOUT_GRID:
+        coordinates, routes_stops = get_grid_layout(rng, stops_count, routes_count, stops_per_route)
+    else:
+        coordinates, routes_stops = get_radial_layout(rng, stops_count, routes_count, stops_per_route)
+
+    bus_stops_route_ids: dict[int, list[int]] = {bus_stop_id: [] for bus_stop_id in coordinates}
+    routes = {}
+    for route_id, route_stops in enumerate(routes_stops, 1):
+        bus_stop_ids = tuple(dict.fromkeys(route_stops))
+        for bus_stop_id in bus_stop_ids:
+            bus_stops_route_ids[bus_stop_id].append(route_id)
+        routes[route_id] = PetriNet.RouteData(
+            id=route_id,
+            name=f'Маршрут {route_id}',
+            tc_name='Автобус',
+            capacity=capacity,
+            interval=interval,
+            amount=amount,
+            list_coord=[list(coordinates[bus_stop_id]) for bus_stop_id in route_stops],
+            bus_stop_ids=bus_stop_ids,
+        )
+    # В расчёт попадают только остановки маршрутов
+    bus_stops = {
+        bus_stop_id: PetriNet.BusStopData(bus_stop_id, f'Остановка {bus_stop_id}', latitude, longitude,
+                                          tuple(bus_stops_route_ids[bus_stop_id]))
+        for bus_stop_id, (latitude, longitude) in coordinates.items() if bus_stops_route_ids[bus_stop_id]
+    }
+    network = PetriNet.NetworkSnapshot(
+        city_id=0,
+        city_name=f'Синтетический город {layout} {seed}',
+        routes=routes,
+        bus_stops=bus_stops,
+        routes_bus_stop_ids={route.id: route.bus_stop_ids for route in routes.values()},
+    )
+    return {
+        'city_id': 0,
+        'network': network,
+        'busstops_directions': get_synthetic_demand(rng, network, passengers_count),
+    }
+
+
+def get_grid_layout(rng: random.Random, stops_count: int, routes_count: int,
+                    stops_per_route: int) -> tuple[dict[int, tuple[float, float]], list[list[int]]]:
+    """Остановки на сетке side x side, маршруты - отрезки строк и столбцов"""
+    side = max(math.ceil(math.sqrt(stops_count)), 2)
+    stops_per_route = min(max(stops_per_route, 2), side)
+    coordinates = {}
+    for row in range(side):
+        for column in range(side):
+            coordinates[row * side + column + 1] = (round(SYNTHETIC_CENTER[0] + row * SYNTHETIC_STOP_STEP, 5),
+                                                    round(SYNTHETIC_CENTER[1] + column * SYNTHETIC_STOP_STEP, 5))
+    routes_stops = []
+    for route_number in range(routes_count):
+        line = rng.randrange(side)
+        start = rng.randrange(side - stops_per_route + 1)
+        if route_number % 2 == 0:
+            route_stops = [line * side + column + 1 for column in range(start, start + stops_per_route)]
+        else:
+            route_stops = [row * side + line + 1 for row in range(start, start + stops_per_route)]
+        routes_stops.append(route_stops)
+    return coordinates, routes_stops
+
+
+def get_radial_layout(rng: random.Random, stops_count: int, routes_count: int,
+                      stops_per_route: int) -> tuple[dict[int, tuple[float, float]], list[list[int]]]:
+    """Центральная остановка и лучи из неё, маршрут - луч к центру и другой луч от центра"""
+    spokes_count = max(min(routes_count, 16), 2)
+    rings_count = max(math.ceil((stops_count - 1) / spokes_count), 1)
+    coordinates = {1: SYNTHETIC_CENTER}
+    spokes = []
+    for spoke in range(spokes_count):
+        angle = 2 * math.pi * spoke / spokes_count
+        spoke_stops = []
+        for ring in range(1, rings_count + 1):
+            bus_stop_id = len(coordinates) + 1
+            coordinates[bus_stop_id] = (
+                round(SYNTHETIC_CENTER[0] + ring * SYNTHETIC_STOP_STEP * math.cos(angle), 5),
+                round(SYNTHETIC_CENTER[1] + ring * SYNTHETIC_STOP_STEP * math.sin(angle), 5),
+            )
+            spoke_stops.append(bus_stop_id)
+        spokes.append(spoke_stops)
+    half_route_length = min(max(stops_per_route // 2, 1), rings_count)
+    routes_stops = []
+    for _ in range(routes_count):
+        spoke_in, spoke_out = rng.sample(range(spokes_count), 2)
+        routes_stops.append(list(reversed(spokes[spoke_in][:half_route_length])) + [1] +
+                            spokes[spoke_out][:half_route_length])
+    return coordinates, routes_stops
+
+
+def get_synthetic_demand(rng: random.Random, network: PetriNet.NetworkSnapshot,
+                         passengers_count: int) -> list[dict]:
+    """Пассажиропоток: случайные пары остановок одного маршрута и часть пассажиров без направления"""
+    routes = list(network.routes.values())
+    directions: dict[int, dict[int, int]] = {}
+    for _ in range(passengers_count):
+        route = rng.choice(routes)
+        start, end = rng.sample(route.bus_stop_ids, 2)
+        if rng.random() < SYNTHETIC_RANDOM_DIRECTION_SHARE:
+            end = 0
+        bus_stop_directions = directions.setdefault(start, {})
+        bus_stop_directions[end] = bus_stop_directions.get(end, 0) + 1
+    return [{'busstop': bus_stop_id, 'directions': directions[bus_stop_id]} for bus_stop_id in sorted(directions)]
+
+
+def measure_stage(function, *args, trace_memory: bool = False, **kwargs) -> tuple[object, float, int | None]:
+    """Выполняет функцию и возвращает (результат, время в секундах, пиковая память в байтах или None)"""
+    if trace_memory:
+        tracemalloc.start()
+    started_at = perf_counter()
+    try:
+        result = function(*args, **kwargs)
+        elapsed = perf_counter() - started_at
+        peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, elapsed, peak_memory
+
+
+def RunEngineBenchmark(data_to_calculate: dict, repeat: int = 3,
+                       timeline_format: str = TIMELINE_FORMAT_FULL, seed: int = 1,
+                       engine: str = CALCULATION_ENGINE_DISCRETE) -> dict:
+    """
+    Замеряет этапы расчёта: init (PetriNet.__init__ или MesoscopicNet.__init__), calculation,
+    report (CreateDataToReport), timeline (combining_steps или get_delta_response для delta)
+    и response_file (CreateResponseFile).
+
+    Время - по repeat запускам без трассировки памяти, пиковая память - по отдельному запуску с tracemalloc
+    """
+    stages = ('init', 'calculation', 'report', 'timeline', 'response_file')
+    engine_class = MesoscopicNet if engine == CALCULATION_ENGINE_MESOSCOPIC else PetriNet
+    times: dict[str, list[float]] = {stage: [] for stage in stages}
+    peak_memory: dict[str, int] = {}
+    engine_stats = {}
+    events_count = 0
+    for run in range(repeat + 1):
+        # Последний запуск только для замера памяти, tracemalloc замедляет расчёт
+        trace_memory = run == repeat
+        stats_collector = PetriNet.StatsCollector()
+
+        def run_stage(stage: str, function, *args, **kwargs):
+            result, elapsed, memory = measure_stage(function, *args, trace_memory=trace_memory, **kwargs)
+            if trace_memory:
+                peak_memory[stage] = memory
+            else:
+                times[stage].append(elapsed)
+            return result
+
+        petri_net = run_stage('init', engine_class, data_to_calculate, timeline_format,
+                              observer=stats_collector, seed=seed)
+        calculate_result = run_stage('calculation', petri_net.Calculation)
+        data_to_report = run_stage('report', petri_net.CreateDataToReport)
+        if timeline_format == TIMELINE_FORMAT_DELTA:
+            run_stage('timeline', petri_net.timeline.get_delta_response)
+        else:
+            run_stage('timeline', petri_net.combining_steps)
+        with tempfile.TemporaryDirectory() as reports_path:
+            run_stage('response_file', CreateResponseFile, data_to_report, reports_path)
+        if not trace_memory:
+            engine_stats = stats_collector.summary()
+            events_count = len(calculate_result)
+
+    network = data_to_calculate['network']
+    return {
+        'python': platform.python_version(),
+        'calculation_engine': engine,
+        'timeline_format': timeline_format,
+        'repeat': repeat,
+        'seed': seed,
+        'network': {
+            'routes_count': len(network.routes),
+            'bus_stops_count': len(network.bus_stops),
+            'passengers_count': sum(sum(item['directions'].values())
+                                    for item in data_to_calculate['busstops_directions']),
+            'buses_count': sum(route.amount for route in network.routes.values()),
+        },
+        'timeline_steps_count': events_count,
+        'stages': {
+            stage: {
+                'time_min': round(min(times[stage]), 6) if times[stage] else None,
+                'time_median': round(statistics.median(times[stage]), 6) if times[stage] else None,
+                'peak_memory_kb': round(peak_memory[stage] / 1024, 1) if stage in peak_memory else None,
+            } for stage in stages
+        },
+        'engine_stats': engine_stats,
+    }
+
+
+def RunDataPreparationBenchmark(request_data_to_calculate: dict, repeat: int = 3) -> dict:
+    """Замеряет GetDataToCalculate на данных из БД (нужна база с маршрутами города)"""
+    # Импорт здесь: бенчмарк движка не должен требовать обращения к БД
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from .petri_net_utils import GetDataToCalculate
+
+    times = []
+    queries_count = 0
+    for _ in range(repeat):
+        # GetDataToCalculate изменяет переданные остановки, каждый запуск получает свою копию
+        request_data = {**request_data_to_calculate,
+                        'busstops': dict(request_data_to_calculate['busstops'])}
+        with CaptureQueriesContext(connection) as queries:
+            _, elapsed, _ = measure_stage(GetDataToCalculate, request_data)
+        times.append(elapsed)
+        queries_count = len(queries)
+    return {
+        'time_min': round(min(times), 6),
+        'time_median': round(statistics.median(times), 6),
+        'queries_count': queries_count,
+    }
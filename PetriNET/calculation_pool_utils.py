@@ -0,0 +1,455 @@
+"""
+Ограниченный пул процессов для синхронных расчётов.
+
+PetriNet.Calculation нагружает процессор и в потоке gthread-обработчика gunicorn конкурирует за GIL
+с потоками, которые отдают карту и API. Поэтому синхронный расчёт выполняется в отдельном пуле процессов
+(свой пул у каждого процесса веб-сервера, ограничения общие), а поток запроса только ждёт результат.
+Данные из БД и готовый отчёт (кэш, сохранённая симуляция) поток запроса получает сам до занятия места в пуле
+и сам сохраняет отчёт нового расчёта в кэш: кэш процесса пула не виден веб-серверу и пропадает
+при перезапуске процесса.
+
+Допуск расчётов:
+- расчёт считает части сети и репликации в CALCULATION_POOL_INNER_WORKERS процессах, поэтому на всём сервере
+  выполняется не больше CALCULATION_POOL_MAX_CONCURRENCY // CALCULATION_POOL_INNER_WORKERS расчётов
+  (но не меньше одного) и ждёт в очереди не больше CALCULATION_POOL_QUEUE_LENGTH, остальные запросы получают
+  503 с Retry-After. Места выполнения и очереди - строки CalculationPoolSlot в БД, общие для всех процессов
+  gunicorn: место занимается одним update, поток запроса отмечает его, пока ждёт расчёт, а место без отметки
+  дольше CALCULATION_POOL_SLOT_TIMEOUT освобождается. Расчёт из очереди ждёт места выполнения в потоке запроса
+  и только затем передаётся в пул процессов;
+- у пользователя не больше CALCULATION_POOL_USER_LIMIT расчётов одновременно, иначе 429 с Retry-After.
+  Счётчик пользователя хранится в БД (CalculationUserState) и меняется одним update, поэтому ограничение
+  действует на все процессы веб-сервера.
+
+Отмена: поток запроса, ожидая результат, проверяет причину отмены (закрытое клиентом соединение, новый расчёт
+или запрос отмены пользователя - номер отмены в CalculationUserState, поэтому отмена из любого процесса
+веб-сервера видна всем) и выставляет флаг места пула в общей памяти. Процесс пула видит его через
+PoolCancellationToken и останавливает расчёт, а расчёт, ещё ждущий в очереди, снимается сразу
+"""
+from __future__ import annotations
+
+import logging
+import math
+import multiprocessing
+import os
+import socket
+import threading
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import timedelta
+from time import perf_counter, sleep
+from typing import Callable, Iterator
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .calculation_utils import (CALCULATION_STAGE_CALCULATION, CALCULATION_STAGE_CANCELLED, CALCULATION_STAGE_QUEUED,
+                                CacheCalculationResponse, CalculationCancelled, CalculationProgress,
+                                CancellationToken, PrepareCalculation, RunPreparedCalculation,
+                                get_cancelled_response, get_cancelled_result, get_passengers_count)
+from .models import CalculationPoolSlot, CalculationUserState
+from .parallel_utils import init_django
+from .sweep_utils import RunSweep
+
+logger = logging.getLogger('PetriNetAPI')
+
+# После стольких расчётов процесс пула перезапускается и возвращает память системе
+CALCULATION_POOL_MAX_TASKS_PER_PROCESS = 20
+# Счётчик расчётов пользователя, не менявшийся дольше таймаута gunicorn, сбрасывается:
+# его не уменьшили аварийно завершившиеся процессы веб-сервера (секунд)
+CALCULATION_USER_SLOT_TIMEOUT = 60 * 60
+# Вес последнего расчёта в средней длительности, по которой считается Retry-After
+CALCULATION_DURATION_WEIGHT = 0.2
+# Как часто поток запроса отмечает место пула в БД и через сколько секунд без отметки место считается
+# оставшимся от аварийно завершившегося процесса веб-сервера
+CALCULATION_POOL_SLOT_HEARTBEAT_INTERVAL = 10
+CALCULATION_POOL_SLOT_TIMEOUT = 60
+# Как часто поток запроса проверяет причину отмены расчёта (секунд)
+CALCULATION_CANCEL_POLL_INTERVAL = 0.5
+# Сколько новый расчёт ждёт, пока остановятся отменённые им расчёты пользователя (секунд)
+CALCULATION_CANCEL_WAIT_SECONDS = 5
+
+# Флаги отмены по местам пула в общей памяти (заполняется в процессе пула, см. init_pool_worker)
+cancel_flags = None
+
+
+class CalculationRejected(Exception):
+    """Расчёт не принят: пул расчётов занят (503) или у пользователя много расчётов (429)"""
+    def __init__(self, message: str, status: int, retry_after: int) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def acquire_user_slot(username: str, user_limit: int) -> bool:
+    """Увеличивает счётчик расчётов пользователя, если он меньше user_limit (0 - без ограничения)"""
+    if not user_limit:
+        return True
+    try:
+        CalculationUserState.objects.get_or_create(username=username)
+        stale_before = timezone.now() - timedelta(seconds=CALCULATION_USER_SLOT_TIMEOUT)
+        # Проверка и увеличение - один update: процессы веб-сервера не займут лишние места одновременно
+        return bool(CalculationUserState.objects.filter(
+            Q(active_count__lt=user_limit) | Q(updated_at__lt=stale_before), username=username
+        ).update(active_count=Case(When(updated_at__lt=stale_before, then=Value(1)),
+                                   default=F('active_count') + 1),
+                 updated_at=timezone.now()))
+    except Exception:
+        # Недоступная БД не должна мешать расчёту
+        logger.exception("Ошибка при проверке количества расчётов пользователя")
+    return True
+
+
+def release_user_slot(username: str, user_limit: int) -> None:
+    if not user_limit:
+        return
+    try:
+        # Счётчик уже сброшен как устаревший, если он нулевой
+        CalculationUserState.objects.filter(username=username, active_count__gt=0).update(
+            active_count=F('active_count') - 1, updated_at=timezone.now())
+    except Exception:
+        logger.exception("Ошибка при уменьшении количества расчётов пользователя")
+
+
+def get_slot_owner() -> str:
+    """Владелец места пула в БД: хост, процесс и поток веб-сервера (поток ждёт один расчёт)"""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def create_server_slots(kind: str, count: int) -> None:
+    """Места пула вида kind в БД. Лишние места (настройку уменьшили) остаются, но не занимаются"""
+    CalculationPoolSlot.objects.bulk_create([CalculationPoolSlot(kind=kind, number=number) for number in range(count)],
+                                            ignore_conflicts=True)
+
+
+def acquire_server_slot(kind: str, count: int, owner: str) -> int | None:
+    """Занимает свободное место пула вида kind: id места или None, если свободных мест нет"""
+    stale_before = timezone.now() - timedelta(seconds=CALCULATION_POOL_SLOT_TIMEOUT)
+    is_free = Q(owner='') | Q(heartbeat_at__lt=stale_before)
+    for slot_id in CalculationPoolSlot.objects.filter(is_free, kind=kind, number__lt=count).order_by(
+            'number').values_list('pk', flat=True):
+        # Место могли занять после выборки: update занимает его, только если оно ещё свободно
+        if CalculationPoolSlot.objects.filter(is_free, pk=slot_id).update(owner=owner, heartbeat_at=timezone.now()):
+            return slot_id
+    return None
+
+
+def release_server_slot(slot_id: int, owner: str) -> None:
+    try:
+        # Место, сброшенное как устаревшее, могло достаться другому расчёту
+        CalculationPoolSlot.objects.filter(pk=slot_id, owner=owner).update(owner='', heartbeat_at=None)
+    except Exception:
+        logger.exception("Ошибка при освобождении места пула расчётов")
+
+
+def GetUserCancelGeneration(username: str) -> int | None:
+    """
+    Номер отмены расчётов пользователя: расчёт отменяется, если номер изменился после его начала.
+    Номер хранится в БД и общий для всех процессов веб-сервера, None - если БД недоступна
+    """
+    try:
+        return CalculationUserState.objects.filter(username=username).values_list(
+            'cancel_generation', flat=True).first() or 0
+    except Exception:
+        logger.exception("Ошибка при получении признака отмены расчётов пользователя")
+        return None
+
+
+def CancelUserCalculations(username: str) -> None:
+    """Отменяет синхронные расчёты пользователя, начатые до вызова, во всех процессах веб-сервера"""
+    try:
+        CalculationUserState.objects.get_or_create(username=username)
+        CalculationUserState.objects.filter(username=username).update(
+            cancel_generation=F('cancel_generation') + 1)
+    except Exception:
+        logger.exception("Ошибка при отмене расчётов пользователя")
+
+
+def init_pool_worker(flags) -> None:
+    """Инициализация процесса пула: флаги отмены и настройка Django"""
+    global cancel_flags
+    cancel_flags = flags
+    init_django()
+
+
+class PoolCancellationToken(CancellationToken):
+    """Признак отмены расчёта в процессе пула: флаг его места пула в общей памяти"""
+    def __init__(self, slot_number: int) -> None:
+        super().__init__()
+        self.slot_number = slot_number
+
+    def is_cancelled(self) -> bool:
+        return self.cancelled or bool(cancel_flags[self.slot_number])
+
+
+def run_pooled_calculation(validated_data: dict, calculation_input: dict, username: str,
+                           slot_number: int, inner_workers: int) -> tuple[dict, int]:
+    """Задача пула: RunPreparedCalculation в процессе пула, части сети и репликации - в inner_workers процессах"""
+    # Процесс пула живёт долго: закрываем подключения к БД с истёкшим сроком жизни
+    close_old_connections()
+    return RunPreparedCalculation(validated_data, calculation_input, username,
+                                  CalculationProgress(PoolCancellationToken(slot_number)), inner_workers)
+
+
+class PoolSlot():
+    """Место расчёта: флаг отмены в общей памяти процесса и место пула в БД, общее для процессов веб-сервера"""
+    def __init__(self, number: int, owner: str) -> None:
+        self.number = number
+        self.owner = owner
+        # Место в БД (None - БД недоступна) и его вид: выполнение или очередь
+        self.slot_id: int | None = None
+        self.kind = CalculationPoolSlot.KIND_RUNNING
+        self.touched_at = perf_counter()
+
+
+def run_pooled_sweep(data_to_calculate: dict, variants: list[dict[int, dict]], seed: int | None, username: str,
+                     slot_number: int, inner_workers: int) -> tuple[dict, int]:
+    """Задача пула: перебор параметров маршрутов, варианты - в inner_workers процессах"""
+    progress = CalculationProgress(PoolCancellationToken(slot_number))
+    progress.passengers_count = get_passengers_count(data_to_calculate)
+    progress.set_stage(CALCULATION_STAGE_CALCULATION)
+    try:
+        variants_results = RunSweep(data_to_calculate, variants, seed, inner_workers, observer=progress)
+    except CalculationCancelled:
+        return get_cancelled_result(progress, username)
+    except Exception as e:
+        logger.exception("Ошибка при выполнении перебора", extra={'user': username})
+        return {
+            'error': 2,
+            'error_message': f'Ошибка при выполнении перебора: {str(e)}',
+            'details': str(e),
+            'stage': 'calculation'
+        }, 500
+    return {'error': 0, 'seed': seed, 'variants': variants_results}, 200
+
+
+class CalculationPool():
+    """
+    Пул процессов синхронных расчётов процесса веб-сервера. Количество выполняющихся и ожидающих расчётов
+    ограничено местами в БД на весь сервер, количество расчётов пользователя - счётчиком в БД
+    """
+    def __init__(self, max_concurrency: int, queue_length: int, user_limit: int, retry_after: int,
+                 inner_workers: int = 1) -> None:
+        # Расчёт занимает inner_workers процессов: всего процессов расчётов не больше max_concurrency
+        self.inner_workers = max(inner_workers, 1)
+        self.max_concurrency = max(max_concurrency // self.inner_workers, 1)
+        self.queue_length = max(queue_length, 0)
+        self.user_limit = max(user_limit, 0)
+        self.lock = threading.Lock()
+        self.executor: ProcessPoolExecutor | None = None
+        self.mp_context = multiprocessing.get_context('spawn')
+        # Флаги отмены расчётов процесса: места сервера могут оказаться в одном процессе
+        slots_count = self.max_concurrency + self.queue_length
+        self.cancel_flags = self.mp_context.RawArray('b', slots_count)
+        self.free_slots = list(range(slots_count))
+        self.server_slots_created = False
+        # Средняя длительность расчёта без ожидания в очереди (секунд), начальное значение - из настроек
+        self.average_duration = float(retry_after)
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """Пул создаётся при первом расчёте: процессы запускаются через spawn, а не копией потоков веб-сервера"""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_concurrency,
+                                                    mp_context=self.mp_context,
+                                                    initializer=init_pool_worker,
+                                                    initargs=(self.cancel_flags,),
+                                                    max_tasks_per_child=CALCULATION_POOL_MAX_TASKS_PER_PROCESS)
+            return self.executor
+
+    def reset_executor(self, executor: ProcessPoolExecutor) -> None:
+        """Сломанный пул (процесс завершился аварийно) заменяется новым при следующем расчёте"""
+        with self.lock:
+            if self.executor is executor:
+                self.executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_retry_after(self, waiting_count: int = 0) -> int:
+        """Через сколько секунд освободится место: расчёты в очереди выполняются по max_concurrency за раз"""
+        return max(math.ceil(self.average_duration * (waiting_count // self.max_concurrency + 1)), 1)
+
+    def reserve_server_slot(self, pool_slot: PoolSlot) -> bool:
+        """Занимает место выполнения или, если их нет, место очереди в БД. False - все места заняты"""
+        try:
+            if not self.server_slots_created:
+                create_server_slots(CalculationPoolSlot.KIND_RUNNING, self.max_concurrency)
+                create_server_slots(CalculationPoolSlot.KIND_QUEUED, self.queue_length)
+                self.server_slots_created = True
+            for kind, count in ((CalculationPoolSlot.KIND_RUNNING, self.max_concurrency),
+                                (CalculationPoolSlot.KIND_QUEUED, self.queue_length)):
+                slot_id = acquire_server_slot(kind, count, pool_slot.owner)
+                if slot_id is not None:
+                    pool_slot.slot_id, pool_slot.kind = slot_id, kind
+                    return True
+            return False
+        except Exception:
+            # Недоступная БД не должна мешать расчёту: расчёты ограничивает только пул процесса
+            logger.exception("Ошибка при занятии места пула расчётов")
+        return True
+
+    def touch_server_slot(self, pool_slot: PoolSlot) -> None:
+        """Отметка места в БД не чаще CALCULATION_POOL_SLOT_HEARTBEAT_INTERVAL секунд"""
+        touched_at = perf_counter()
+        if pool_slot.slot_id is None or touched_at - pool_slot.touched_at < CALCULATION_POOL_SLOT_HEARTBEAT_INTERVAL:
+            return
+        pool_slot.touched_at = touched_at
+        try:
+            CalculationPoolSlot.objects.filter(pk=pool_slot.slot_id, owner=pool_slot.owner).update(
+                heartbeat_at=timezone.now())
+        except Exception:
+            logger.exception("Ошибка при отметке места пула расчётов")
+
+    @contextmanager
+    def slot(self, username: str, wait_seconds: float = 0) -> Iterator[PoolSlot]:
+        """
+        Место расчёта в пуле, CalculationRejected - если места нет.
+        wait_seconds - сколько ждать, пока у пользователя освободится место (после отмены его расчётов)
+        """
+        deadline = perf_counter() + wait_seconds
+        while not acquire_user_slot(username, self.user_limit):
+            if perf_counter() >= deadline:
+                raise CalculationRejected(
+                    f'Превышено количество одновременных расчётов пользователя ({self.user_limit}). '
+                    f'Дождитесь завершения предыдущего расчёта', 429, self.get_retry_after())
+            sleep(CALCULATION_CANCEL_POLL_INTERVAL / 5)
+        try:
+            with self.lock:
+                if not self.free_slots:
+                    raise CalculationRejected('Сервер занят другими расчётами, повторите запрос позже', 503,
+                                              self.get_retry_after(self.queue_length))
+                pool_slot = PoolSlot(self.free_slots.pop(), get_slot_owner())
+                self.cancel_flags[pool_slot.number] = 0
+            try:
+                if not self.reserve_server_slot(pool_slot):
+                    raise CalculationRejected('Сервер занят другими расчётами, повторите запрос позже', 503,
+                                              self.get_retry_after(self.queue_length))
+                yield pool_slot
+            finally:
+                if pool_slot.slot_id is not None:
+                    release_server_slot(pool_slot.slot_id, pool_slot.owner)
+                with self.lock:
+                    self.free_slots.append(pool_slot.number)
+        finally:
+            release_user_slot(username, self.user_limit)
+
+    def wait_running(self, pool_slot: PoolSlot, username: str,
+                     get_cancel_reason: Callable[[], str | None] | None) -> bool:
+        """
+        Ожидание места выполнения расчётом из очереди: каждые CALCULATION_CANCEL_POLL_INTERVAL секунд
+        проверяются свободные места и причина отмены. False - расчёт отменён в очереди
+        """
+        while pool_slot.kind == CalculationPoolSlot.KIND_QUEUED:
+            try:
+                slot_id = acquire_server_slot(CalculationPoolSlot.KIND_RUNNING, self.max_concurrency,
+                                              pool_slot.owner)
+            except Exception:
+                logger.exception("Ошибка при занятии места пула расчётов")
+                slot_id = None
+            if slot_id is not None:
+                release_server_slot(pool_slot.slot_id, pool_slot.owner)
+                pool_slot.slot_id, pool_slot.kind = slot_id, CalculationPoolSlot.KIND_RUNNING
+                break
+            self.touch_server_slot(pool_slot)
+            reason = get_cancel_reason() if get_cancel_reason is not None else None
+            if reason:
+                logger.info(f"Отмена расчёта в очереди: {reason}", extra={'user': username})
+                return False
+            sleep(CALCULATION_CANCEL_POLL_INTERVAL)
+        return True
+
+    def wait_result(self, future: Future, pool_slot: PoolSlot, username: str,
+                    get_cancel_reason: Callable[[], str | None] | None) -> tuple[dict, int]:
+        """Результат расчёта, пока его нет - проверка причины отмены каждые CALCULATION_CANCEL_POLL_INTERVAL секунд"""
+        while True:
+            try:
+                return future.result(timeout=CALCULATION_CANCEL_POLL_INTERVAL)
+            except TimeoutError:
+                self.touch_server_slot(pool_slot)
+                if get_cancel_reason is None or self.cancel_flags[pool_slot.number]:
+                    continue
+                reason = get_cancel_reason()
+                if reason:
+                    logger.info(f"Отмена расчёта: {reason}", extra={'user': username})
+                    self.cancel_flags[pool_slot.number] = 1
+                    # Расчёт, который ещё ждёт процесс пула, снимается с очереди
+                    future.cancel()
+
+    def run_task(self, function: Callable[..., tuple[dict, int]], args: tuple, username: str,
+                 get_cancel_reason: Callable[[], str | None] | None = None,
+                 wait_seconds: float = 0) -> tuple[dict, int]:
+        """
+        Задача function(*args, slot_number, inner_workers) в процессе пула: тело ответа и HTTP-статус.
+        get_cancel_reason - причина отмены расчёта или None, проверяется, пока поток запроса ждёт результат
+        """
+        with self.slot(username, wait_seconds) as pool_slot:
+            if not self.wait_running(pool_slot, username, get_cancel_reason):
+                return get_cancelled_response(CALCULATION_STAGE_QUEUED), 409
+            started_at = perf_counter()
+            executor = self.get_executor()
+            try:
+                future = executor.submit(function, *args, pool_slot.number, self.inner_workers)
+                response, status = self.wait_result(future, pool_slot, username, get_cancel_reason)
+            except CancelledError:
+                logger.info("Расчёт отменён до начала выполнения", extra={'user': username})
+                return get_cancelled_response(CALCULATION_STAGE_QUEUED), 409
+            except BrokenProcessPool as e:
+                logger.exception("Процесс пула расчётов завершился аварийно", extra={'user': username})
+                self.reset_executor(executor)
+                return {
+                    'error': 2,
+                    'error_message': 'Процесс расчёта завершился аварийно (возможно, не хватило памяти)',
+                    'details': str(e),
+                    'stage': 'calculation'
+                }, 500
+            except Exception as e:
+                logger.exception("Ошибка при выполнении расчёта в пуле процессов", extra={'user': username})
+                return {
+                    'error': 2,
+                    'error_message': f'Ошибка при выполнении расчёта: {str(e)}',
+                    'details': str(e),
+                    'stage': 'calculation'
+                }, 500
+            # Отменённые расчёты не учитываются в средней длительности
+            if response.get('stage') != CALCULATION_STAGE_CANCELLED:
+                duration = perf_counter() - started_at
+                with self.lock:
+                    self.average_duration += CALCULATION_DURATION_WEIGHT * (duration - self.average_duration)
+            return response, status
+
+    def run(self, validated_data: dict, username: str, get_cancel_reason: Callable[[], str | None] | None = None,
+            wait_seconds: float = 0) -> tuple[dict, int]:
+        """Расчёт в процессе пула: тело ответа и HTTP-статус, как у RunCalculation"""
+        # Ошибка в данных и готовый отчёт не занимают место в пуле
+        calculation_input, ready_response = PrepareCalculation(validated_data, username, CalculationProgress())
+        if ready_response is not None:
+            return ready_response
+        response, status = self.run_task(run_pooled_calculation, (validated_data, calculation_input, username),
+                                         username, get_cancel_reason, wait_seconds)
+        CacheCalculationResponse(calculation_input['input_hash'], response)
+        return response, status
+
+    def run_sweep(self, data_to_calculate: dict, variants: list[dict[int, dict]], seed: int | None, username: str,
+                  get_cancel_reason: Callable[[], str | None] | None = None) -> tuple[dict, int]:
+        """Перебор параметров маршрутов в процессе пула: варианты считаются в inner_workers процессах"""
+        return self.run_task(run_pooled_sweep, (data_to_calculate, variants, seed, username), username,
+                             get_cancel_reason)
+
+
+# Пул текущего процесса веб-сервера (создаётся после запуска процесса, см. GetCalculationPool)
+calculation_pool: CalculationPool | None = None
+calculation_pool_lock = threading.Lock()
+
+
+def GetCalculationPool() -> CalculationPool:
+    """Пул расчётов текущего процесса с параметрами из настроек"""
+    global calculation_pool
+    with calculation_pool_lock:
+        if calculation_pool is None:
+            calculation_pool = CalculationPool(settings.CALCULATION_POOL_MAX_CONCURRENCY,
+                                               settings.CALCULATION_POOL_QUEUE_LENGTH,
+                                               settings.CALCULATION_POOL_USER_LIMIT,
+                                               settings.CALCULATION_POOL_RETRY_AFTER,
+                                               settings.CALCULATION_POOL_INNER_WORKERS)
+        return calculation_pool
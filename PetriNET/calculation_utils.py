@@ -0,0 +1,560 @@
+"""
+Расчёт нагрузки по проверенным данным запроса (CalculationRequestSerializer).
+
+Используется и синхронным endpoint расчёта, и обработчиком задач (run_calculation_worker):
+результат - тело ответа и HTTP-статус, этапы расчёта передаются в CalculationProgress.
+Расчёт можно отменить через CancellationToken: признак проверяется в начале этапов и каждые
+CALCULATION_CANCEL_CHECK_EVENTS событий движка
+"""
+from __future__ import annotations
+
+import gc
+import logging
+import pickle
+from time import perf_counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Simulation
+from .partition_utils import CreatePetriNet
+from .petri_net_utils import (CALCULATION_ENGINE_DISCRETE, TIMELINE_FORMAT_DELTA, GetCalculationHash,
+                              GetDataToCalculate, PetriNet)
+from .replication_utils import RunReplications
+
+logger = logging.getLogger('PetriNetAPI')
+
+# Этапы расчёта и доля выполнения в начале этапа
+CALCULATION_STAGE_QUEUED = 'queued'
+CALCULATION_STAGE_DATA_PREPARATION = 'data_preparation'
+CALCULATION_STAGE_CALCULATION = 'calculation'
+CALCULATION_STAGE_REPORT = 'report_generation'
+CALCULATION_STAGE_SAVING = 'saving'
+CALCULATION_STAGE_DONE = 'done'
+CALCULATION_STAGE_CANCELLED = 'cancelled'
+CALCULATION_STAGES_PROGRESS = {
+    CALCULATION_STAGE_QUEUED: 0.0,
+    CALCULATION_STAGE_DATA_PREPARATION: 0.0,
+    CALCULATION_STAGE_CALCULATION: 0.1,
+    CALCULATION_STAGE_REPORT: 0.9,
+    CALCULATION_STAGE_SAVING: 0.95,
+    CALCULATION_STAGE_DONE: 1.0,
+}
+# Как часто движок проверяет признак отмены (событий расчёта)
+CALCULATION_CANCEL_CHECK_EVENTS = 100
+
+
+def get_calculation_cache_key(input_hash: str) -> str:
+    """Ключ отчёта расчёта в кэше"""
+    return f"calculation:{input_hash}:report"
+
+
+def get_timeline_cache_key(input_hash: str, timeline_format: str) -> str:
+    """Ключ временной шкалы расчёта в кэше, отчёт к ней - по get_calculation_cache_key"""
+    return f"calculation:{input_hash}:timeline:{timeline_format}"
+
+
+def get_cached_response(response: dict) -> dict:
+    """Отчёт для кэша: временная шкала кэшируется отдельно (см. CacheCalculationResponse)"""
+    return {key: value for key, value in response.items() if key not in ('calculate', 'timeline_format', 'cached')}
+
+
+def get_cached_timeline_response(input_hash: str, timeline_format: str) -> dict | None:
+    """Отчёт с временной шкалой из кэша, None - если в кэше нет отчёта или шкалы"""
+    report_key = get_calculation_cache_key(input_hash)
+    timeline_key = get_timeline_cache_key(input_hash, timeline_format)
+    cached = cache.get_many([report_key, timeline_key])
+    if len(cached) < 2:
+        return None
+    return {**cached[report_key], **pickle.loads(cached[timeline_key])}
+
+
+def get_passengers_count(data_to_calculate: dict) -> int:
+    return sum(sum(busstops_direction['directions'].values())
+               for busstops_direction in data_to_calculate['busstops_directions'])
+
+
+def get_cancelled_response(stage: str) -> dict:
+    return {
+        'error': 4,
+        'error_message': 'Расчёт отменён',
+        'details': f'Расчёт остановлен на этапе {stage}',
+        'stage': CALCULATION_STAGE_CANCELLED
+    }
+
+
+class CalculationCancelled(Exception):
+    """Расчёт остановлен по признаку отмены"""
+
+
+class CancellationToken():
+    """Признак отмены расчёта. Подклассы получают его из источника, общего с веб-сервером (память пула, БД)"""
+    def __init__(self) -> None:
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def is_cancelled(self) -> bool:
+        return self.cancelled
+
+    def check(self) -> None:
+        if self.is_cancelled():
+            raise CalculationCancelled('Расчёт отменён')
+
+
+class CalculationProgress(PetriNet.StatsCollector):
+    """
+    Счётчики расчёта с текущим этапом и долей выполнения.
+    На этапе расчёта доля растёт с количеством севших пассажиров (каждый пассажир садится один раз),
+    при расчёте по частям - с количеством, которое передают процессы частей.
+    С cancellation_token расчёт останавливается исключением CalculationCancelled
+    """
+    def __init__(self, cancellation_token: CancellationToken | None = None) -> None:
+        super().__init__()
+        self.stage = CALCULATION_STAGE_QUEUED
+        self.passengers_count = 0
+        self.parts_boarded_passengers_count = 0
+        self.cancellation_token = cancellation_token
+
+    def set_stage(self, stage: str) -> None:
+        # Сохранение готового результата не прерывается
+        if self.cancellation_token is not None and stage != CALCULATION_STAGE_SAVING:
+            self.cancellation_token.check()
+        self.stage = stage
+
+    def on_event(self, seconds_from_start: int, buses_count: int, queue_depth: int) -> None:
+        super().on_event(seconds_from_start, buses_count, queue_depth)
+        if self.cancellation_token is not None and not self.events_count % CALCULATION_CANCEL_CHECK_EVENTS:
+            self.cancellation_token.check()
+
+    def on_parts_progress(self, boarded_passengers_count: int) -> None:
+        self.parts_boarded_passengers_count = boarded_passengers_count
+        # Расчёт по частям и репликации отменяются здесь: события частей этот наблюдатель не получает
+        if self.cancellation_token is not None:
+            self.cancellation_token.check()
+
+    def get_progress(self) -> float:
+        progress = CALCULATION_STAGES_PROGRESS[self.stage]
+        if self.stage == CALCULATION_STAGE_CALCULATION and self.passengers_count:
+            calculation_share = CALCULATION_STAGES_PROGRESS[CALCULATION_STAGE_REPORT] - progress
+            boarded_passengers_count = max(self.boarded_passengers_count, self.parts_boarded_passengers_count)
+            progress += calculation_share * min(boarded_passengers_count / self.passengers_count, 1)
+        return round(progress, 3)
+
+
+def RunCalculation(validated_data: dict, username: str = '',
+                   progress: CalculationProgress | None = None) -> tuple[dict, int]:
+    """
+    Расчёт по данным CalculationRequestSerializer: тело ответа и HTTP-статус (409 - расчёт отменён).
+    Готовый отчёт берётся из кэша или сохранённой симуляции, отчёт нового расчёта сохраняется в кэш
+    """
+    if progress is None:
+        progress = CalculationProgress()
+    try:
+        calculation_input, ready_response = PrepareCalculation(validated_data, username, progress)
+        if ready_response is not None:
+            return ready_response
+        response, status = run_calculation(validated_data, calculation_input, username, progress,
+                                           settings.CALCULATION_MAX_WORKERS or None)
+    except CalculationCancelled:
+        return get_cancelled_result(progress, username)
+    CacheCalculationResponse(calculation_input['input_hash'], response)
+    return response, status
+
+
+def RunPreparedCalculation(validated_data: dict, calculation_input: dict, username: str = '',
+                           progress: CalculationProgress | None = None,
+                           max_workers: int | None = None) -> tuple[dict, int]:
+    """
+    Этапы 3-5 расчёта по данным PrepareCalculation, например в процессе пула.
+    max_workers - процессов для частей сети и репликаций (None - по количеству ядер).
+    Ответ не кэшируется: кэш процесса пула не виден процессу, который отдаёт ответ (см. CacheCalculationResponse)
+    """
+    if progress is None:
+        progress = CalculationProgress()
+    try:
+        return run_calculation(validated_data, calculation_input, username, progress, max_workers)
+    except CalculationCancelled:
+        return get_cancelled_result(progress, username)
+
+
+def get_cancelled_result(progress: CalculationProgress, username: str) -> tuple[dict, int]:
+    logger.info(f"Расчёт отменён на этапе {progress.stage}", extra={'user': username})
+    response = get_cancelled_response(progress.stage)
+    # Сеть Петри отменённого расчёта больше не нужна: освобождаем память сразу, а не при следующей сборке мусора
+    gc.collect()
+    return response, 409
+
+
+def CacheCalculationResponse(input_hash: str, response: dict) -> None:
+    """
+    Сохраняет отчёт успешного расчёта в кэш текущего процесса (или общий кэш). Временная шкала сохраняется
+    отдельной записью, если занимает не больше CALCULATION_CACHE_MAX_TIMELINE_SIZE байт: шкала большой сети
+    занимает десятки мегабайт
+    """
+    if response['error'] or response.get('cached'):
+        return
+    try:
+        cache.set(get_calculation_cache_key(input_hash), get_cached_response(response),
+                  settings.CALCULATION_CACHE_TIMEOUT)
+        if 'calculate' in response:
+            # Шкала сериализуется один раз: по размеру решается, сохранять ли её, а кэш хранит готовые байты
+            timeline = pickle.dumps({'calculate': response['calculate'],
+                                     'timeline_format': response['timeline_format']},
+                                    protocol=pickle.HIGHEST_PROTOCOL)
+            if len(timeline) <= settings.CALCULATION_CACHE_MAX_TIMELINE_SIZE:
+                cache.set(get_timeline_cache_key(input_hash, response['timeline_format']), timeline,
+                          settings.CALCULATION_CACHE_TIMEOUT)
+            else:
+                logger.info(f"Временная шкала расчёта не сохранена в кэш: {len(timeline)} байт")
+    except Exception:
+        logger.exception("Ошибка при сохранении результата расчёта в кэш")
+
+
+def PrepareCalculation(validated_data: dict, username: str,
+                       progress: CalculationProgress) -> tuple[dict | None, tuple[dict, int] | None]:
+    """
+    Этап 2 расчёта: данные из БД и их хэш, затем готовый отчёт из кэша или сохранённой симуляции.
+    Возвращает данные для run_calculation или готовый ответ со статусом (ошибка данных, отчёт без расчёта)
+    """
+    # Этап 2: Получение и обработка данных из базы данных
+    progress.set_stage(CALCULATION_STAGE_DATA_PREPARATION)
+    try:
+        processed_data = validated_data['data_to_calculate']
+        city_id = processed_data.get('city_id')
+        routes_count = len(processed_data.get('routes', []))
+        busstops_count = len(processed_data.get('busstops', {}))
+
+        logger.info(
+            f"Обработка данных: город ID={city_id}, маршрутов={routes_count}, остановок={busstops_count}"
+        )
+
+        data_to_calculate = GetDataToCalculate(processed_data)
+
+        logger.info(
+            f"Данные успешно получены из БД: "
+            f"маршрутов={len(data_to_calculate['network'].routes)}, "
+            f"остановок={len(data_to_calculate['network'].bus_stops)}, "
+            f"направлений={len(data_to_calculate.get('busstops_directions', []))}"
+        )
+
+    except ValueError as e:
+        logger.exception(
+            "Ошибка в структуре данных при получении данных для расчёта",
+            extra={'user': username, 'city_id': city_id}
+        )
+        return None, ({
+            'error': 1,
+            'error_message': 'Ошибка в структуре данных для расчёта',
+            'details': str(e),
+            'stage': 'data_preparation',
+            'hint': 'Проверьте корректность указанных ID маршрутов и остановок'
+        }, 400)
+
+    except KeyError as e:
+        logger.exception(
+            "Отсутствует обязательное поле в данных",
+            extra={'user': username}
+        )
+        return None, ({
+            'error': 1,
+            'error_message': f'Отсутствует обязательное поле: {str(e)}',
+            'details': f'Не найдено поле {str(e)} в данных для расчёта',
+            'stage': 'data_preparation'
+        }, 400)
+
+    except Exception as e:
+        error_message = str(e)
+        logger.exception(
+            "Непредвиденная ошибка при подготовке данных для расчёта",
+            extra={'user': username, 'city_id': city_id}
+        )
+
+        # Определяем специфичные ошибки для пользователя
+        user_message = error_message
+        hint = None
+
+        if 'Отсутствуют маршруты' in error_message:
+            hint = 'Убедитесь, что выбранные маршруты существуют в базе данных для указанного города'
+        elif 'Отсутствуют остановки' in error_message:
+            hint = 'Добавьте хотя бы одну остановку с пассажирами для начала расчёта'
+        elif 'Отсутствуют пассажиры' in error_message:
+            hint = 'Укажите направления движения и количество пассажиров на остановках'
+
+        return None, ({
+            'error': 1,
+            'error_message': f'Ошибка подготовки данных: {user_message}',
+            'details': error_message,
+            'stage': 'data_preparation',
+            'hint': hint
+        }, 400)
+
+    # Повторный расчёт тех же данных с тем же seed: отчёт из кэша или сохранённой симуляции,
+    # отчёт с временной шкалой - из кэша, если шкала в него поместилась, иначе повторным расчётом
+    seed = validated_data['seed']
+    replications = validated_data['replications']
+    engine = validated_data['engine']
+    # Репликации и мезоскопический движок возвращают только отчёт
+    get_timeline = validated_data['get_timeline'] and replications == 1 and \
+        engine == CALCULATION_ENGINE_DISCRETE
+    input_hash = GetCalculationHash(data_to_calculate, seed, replications, engine)
+    cache_key = get_calculation_cache_key(input_hash)
+    if get_timeline:
+        try:
+            response = get_cached_timeline_response(input_hash, validated_data['timeline_format'])
+            if response is not None:
+                logger.info(f"Результат расчёта с временной шкалой получен из кэша: хэш={input_hash}")
+                return None, ({**response, 'cached': True}, 200)
+        except Exception:
+            logger.exception("Ошибка при получении результата расчёта из кэша")
+    else:
+        try:
+            response = cache.get(cache_key)
+            if response is None:
+                simulation = Simulation.objects.filter(input_hash=input_hash).only('id', 'report_data').first()
+                if simulation is not None:
+                    response = {
+                        'error': 0,
+                        'data_to_report': simulation.report_data,
+                        'simulation_id': simulation.pk,
+                        'seed': seed,
+                    }
+                    cache.set(cache_key, response, settings.CALCULATION_CACHE_TIMEOUT)
+            if response is not None:
+                logger.info(f"Результат расчёта получен без повторного расчёта: хэш={input_hash}")
+                return None, ({**response, 'cached': True}, 200)
+        except Exception:
+            # Недоступный кэш не должен мешать расчёту
+            logger.exception("Ошибка при получении результата расчёта из кэша")
+
+    return {'data_to_calculate': data_to_calculate, 'input_hash': input_hash, 'get_timeline': get_timeline}, None
+
+
+def run_calculation(validated_data: dict, calculation_input: dict, username: str,
+                    progress: CalculationProgress, max_workers: int | None) -> tuple[dict, int]:
+    """Этапы 3-5 расчёта, CalculationCancelled - если расчёт отменён"""
+    data_to_calculate = calculation_input['data_to_calculate']
+    input_hash = calculation_input['input_hash']
+    get_timeline = calculation_input['get_timeline']
+    seed = validated_data['seed']
+    engine = validated_data['engine']
+    if validated_data['replications'] > 1:
+        return run_replications(validated_data, data_to_calculate, input_hash, username, progress, max_workers)
+
+    # Этап 3: Инициализация сети Петри и выполнение расчёта
+    progress.passengers_count = get_passengers_count(data_to_calculate)
+    progress.set_stage(CALCULATION_STAGE_CALCULATION)
+    try:
+        logger.info("Инициализация сети Петри")
+        # Без временной шкалы шаги для отрисовки не сохраняются, отчёт строится по статистике расчёта
+        stats_collector = progress
+        # Независимые части сети (маршруты без общих остановок) считаются параллельно в пуле процессов
+        petri_net = CreatePetriNet(data_to_calculate, validated_data['timeline_format'],
+                                   record_timeline=get_timeline, observer=stats_collector, seed=seed,
+                                   max_workers=max_workers, engine=engine)
+
+        logger.info("Запуск расчёта нагрузки")
+        calculate_result = petri_net.Calculation()
+
+        logger.info(
+            f"Расчёт успешно завершён, временных точек: {len(calculate_result) if calculate_result else 0}"
+        )
+
+    except CalculationCancelled:
+        raise
+
+    except ValueError as e:
+        logger.exception(
+            "Ошибка валидации данных при инициализации сети Петри",
+            extra={'user': username}
+        )
+        return {
+            'error': 2,
+            'error_message': 'Ошибка в данных маршрутов или остановок',
+            'details': str(e),
+            'stage': 'petri_net_initialization',
+            'hint': 'Проверьте корректность координат остановок и структуры маршрутов'
+        }, 400
+
+    except AttributeError as e:
+        logger.exception(
+            "Ошибка доступа к атрибутам объектов при расчёте",
+            extra={'user': username}
+        )
+        return {
+            'error': 2,
+            'error_message': 'Ошибка в структуре данных маршрутов',
+            'details': str(e),
+            'stage': 'calculation',
+            'hint': 'Убедитесь, что для всех маршрутов указаны типы транспорта и количество автобусов'
+        }, 400
+
+    except ZeroDivisionError:
+        logger.exception(
+            "Ошибка деления на ноль при расчёте (вероятно, отсутствуют данные)",
+            extra={'user': username}
+        )
+        return {
+            'error': 2,
+            'error_message': 'Недостаточно данных для расчёта',
+            'details': 'Отсутствуют данные для вычисления средних показателей',
+            'stage': 'calculation',
+            'hint': 'Убедитесь, что на маршрутах есть автобусы и пассажиры'
+        }, 400
+
+    except Exception as e:
+        error_message = str(e)
+        logger.exception(
+            f"Критическая ошибка при выполнении расчёта: {error_message}",
+            extra={'user': username}
+        )
+
+        # Определяем специфичные ошибки
+        user_message = error_message
+        hint = None
+
+        if 'Отсутствуют автобусы на маршрутах' in error_message:
+            hint = 'Укажите количество автобусов и тип транспорта для каждого маршрута'
+        elif 'Не удалось найти остановку для точки маршрута' in error_message:
+            hint = 'Возможно, координаты остановок на маршруте не совпадают с координатами в базе данных'
+        elif 'Неправильное получение длительности пути пассажира' in error_message:
+            hint = 'Проверьте, что конечная остановка пассажира находится после начальной на маршруте'
+
+        return {
+            'error': 2,
+            'error_message': f'Ошибка при выполнении расчёта: {user_message}',
+            'details': error_message,
+            'stage': 'calculation',
+            'hint': hint
+        }, 500
+
+    # Этап 4: Формирование данных для отчёта
+    progress.set_stage(CALCULATION_STAGE_REPORT)
+    try:
+        logger.info("Формирование данных для отчёта")
+        data_to_report = petri_net.CreateDataToReport()
+        # Счётчики движка: по ним видно, какие сценарии считаются долго и на каком этапе
+        data_to_report['engine_stats'] = stats_collector.summary()
+
+        logger.info(f"Статистика расчёта: {data_to_report['engine_stats']}")
+        logger.info(
+            f"Данные для отчёта сформированы: "
+            f"остановок={len(data_to_report.get('bus_stops', []))}, "
+            f"маршрутов={len(data_to_report.get('routes', []))}"
+        )
+
+    except CalculationCancelled:
+        raise
+
+    except Exception:
+        logger.exception(
+            "Ошибка при формировании данных для отчёта",
+            extra={'user': username}
+        )
+        return {
+            'error': 2,
+            'error_message': 'Ошибка при формировании данных для отчёта',
+            'stage': 'report_generation',
+            'hint': 'Расчёт выполнен, но не удалось сформировать отчёт'
+        }, 500
+
+    # Формирование успешного ответа
+    response = {'error': 0}
+
+    if get_timeline:
+        timeline_format = validated_data['timeline_format']
+        if timeline_format == TIMELINE_FORMAT_DELTA:
+            response['calculate'] = petri_net.timeline.get_delta_response()
+            logger.debug(f"Включены данные временной шкалы в формате delta (точек: {len(calculate_result)})")
+        else:
+            # Если больше одного маршрута - используем сжатую версию timeline
+            combined_timeline = petri_net.combining_steps()
+            response['calculate'] = combined_timeline
+            logger.debug(
+                f"Включены данные временной шкалы "
+                f"(исходных точек: {len(calculate_result)}, после объединения: {len(combined_timeline)})"
+            )
+        response['timeline_format'] = timeline_format
+
+    response.update({
+        'data_to_report': data_to_report,
+        'seed': seed,
+        'cached': False,
+    })
+
+    # Этап 5: Сохранение симуляции в базу данных
+    progress.set_stage(CALCULATION_STAGE_SAVING)
+    try:
+        logger.info("Сохранение результатов симуляции в БД")
+
+        simulation = Simulation.objects.create(
+            input_data=validated_data,
+            report_data=data_to_report,
+            input_hash=input_hash
+        )
+
+        response['simulation_id'] = simulation.pk
+
+        logger.info(f"Симуляция успешно сохранена с ID={simulation.pk}")
+
+    except Exception:
+        logger.exception(
+            "Ошибка при сохранении симуляции в БД",
+            extra={'user': username}
+        )
+        # Не прерываем выполнение, если не удалось сохранить симуляцию
+        # Расчёт всё равно был успешным
+        logger.warning("Продолжаем выполнение без сохранения симуляции")
+
+    return response, 200
+
+
+def run_replications(validated_data: dict, data_to_calculate: dict, input_hash: str, username: str,
+                     progress: CalculationProgress, max_workers: int | None) -> tuple[dict, int]:
+    """Репликации сценария в пуле процессов: отчёт со средними значениями и доверительными интервалами"""
+    seed = validated_data['seed']
+    replications = validated_data['replications']
+    progress.passengers_count = get_passengers_count(data_to_calculate)
+    progress.set_stage(CALCULATION_STAGE_CALCULATION)
+    logger.info(f"Запуск репликаций: количество={replications}, seed={seed}")
+    started_at = perf_counter()
+    try:
+        data_to_report = RunReplications(data_to_calculate, seed, replications, max_workers,
+                                         validated_data['engine'], observer=progress)
+    except CalculationCancelled:
+        raise
+    except Exception as e:
+        logger.exception(
+            "Ошибка при выполнении репликаций",
+            extra={'user': username}
+        )
+        return {
+            'error': 2,
+            'error_message': f'Ошибка при выполнении расчёта: {str(e)}',
+            'details': str(e),
+            'stage': 'calculation'
+        }, 500
+    logger.info(f"Репликации завершены за {round(perf_counter() - started_at, 3)} с")
+
+    progress.set_stage(CALCULATION_STAGE_SAVING)
+    response = {
+        'error': 0,
+        'data_to_report': data_to_report,
+        'seed': seed,
+        'cached': False,
+    }
+    try:
+        simulation = Simulation.objects.create(
+            input_data=validated_data,
+            report_data=data_to_report,
+            input_hash=input_hash
+        )
+        response['simulation_id'] = simulation.pk
+        logger.info(f"Симуляция успешно сохранена с ID={simulation.pk}")
+    except Exception:
+        logger.exception(
+            "Ошибка при сохранении симуляции в БД",
+            extra={'user': username}
+        )
+    return response, 200
@@ -0,0 +1,203 @@
+"""
+Быстрая оценка нагрузки сети без расчёта (в замкнутой форме).
+
+Используются только вместимость автобусов маршрута (вместимость ТС × количество), интервал движения,
+протяжённость маршрута и пассажиропоток из GetDataToCalculate. Пассажиры распределяются между маршрутами,
+соединяющими остановки без пересадок, пропорционально частоте движения. Для каждого направления маршрута
+строится профиль загрузки по перегонам: наибольшая загрузка перегона определяет нужное количество рейсов,
+ожидание считается по интервалу между автобусами, а насыщение - по вместимости рейсов за горизонт оценки.
+
+Оценка не заменяет расчёт PetriNet: она нужна, чтобы быстро отсеять перегруженные варианты
+"""
+from __future__ import annotations
+
+import math
+from time import perf_counter
+
+import numpy as np
+
+from .petri_net_utils import PetriNet
+
+# Горизонт оценки насыщения по умолчанию: вместимость рейсов за это время сравнивается с загрузкой перегона
+ESTIMATE_HORIZON_MINUTES = 60
+# Пороги насыщения: warning - близко к вместимости, overloaded - пассажиров больше вместимости рейсов за горизонт
+ESTIMATE_WARNING_SATURATION = 0.85
+ESTIMATE_OVERLOADED_SATURATION = 1.0
+ESTIMATE_STATUS_OK = 'ok'
+ESTIMATE_STATUS_WARNING = 'warning'
+ESTIMATE_STATUS_OVERLOADED = 'overloaded'
+
+
+def get_saturation_status(saturation: float) -> str:
+    if saturation > ESTIMATE_OVERLOADED_SATURATION:
+        return ESTIMATE_STATUS_OVERLOADED
+    if saturation > ESTIMATE_WARNING_SATURATION:
+        return ESTIMATE_STATUS_WARNING
+    return ESTIMATE_STATUS_OK
+
+
+class RouteEstimate():
+    """Параметры маршрута для оценки и накопление профиля загрузки по направлениям"""
+    def __init__(self, route: PetriNet.RouteData, route_index: PetriNet.RouteIndex) -> None:
+        self.route = route
+        self.route_index = route_index
+        # Время в одну сторону (секунд) без учёта посадки и высадки
+        self.one_way_time = route_index.cumulative_travel_times[0][-1]
+        # Автобусы отправляются не чаще интервала, а на длинном маршруте - не чаще оборота на автобус.
+        # По этому интервалу пассажиры распределяются между маршрутами, задержки на посадку учитываются в get_estimate
+        self.headway = self.get_headway(0)
+        self.frequency = 1 / self.headway
+        self.last_position = route_index.last_position
+        # Разностные массивы загрузки перегонов: +n на позиции посадки, -n на позиции высадки
+        self.load_differences = np.zeros((2, self.last_position + 1))
+        self.passengers_count = 0.0
+
+    def get_headway(self, dwell_time: float) -> float:
+        """Интервал между автобусами одного направления (секунд) при задержке dwell_time на рейс"""
+        route = self.route
+        return max(route.interval * 60, 2 * (self.one_way_time + dwell_time) / route.amount, 1)
+
+    def add_passengers(self, bus_stop_id: int, destination: int, passengers_count: float) -> None:
+        """
+        Пассажиры с остановки до остановки назначения: в прямом направлении, если назначение
+        есть дальше по маршруту, иначе в обратном (как при посадке в PetriNet)
+        """
+        route_index = self.route_index
+        start_position = route_index.positions[0][bus_stop_id][0]
+        end_positions = [position for position in route_index.positions[0][destination] if position > start_position]
+        if end_positions:
+            direction, end_position = 0, end_positions[0]
+        else:
+            direction = 1
+            start_position = route_index.positions[1][bus_stop_id][0]
+            end_position = next(position for position in route_index.positions[1][destination]
+                                if position > start_position)
+        self.load_differences[direction, start_position] += passengers_count
+        self.load_differences[direction, end_position] -= passengers_count
+        self.passengers_count += passengers_count
+
+    def get_estimate(self, horizon_minutes: int) -> dict:
+        """Показатели маршрута по профилю загрузки"""
+        route = self.route
+        max_load = float(np.cumsum(self.load_differences, axis=1).max(initial=0))
+        # Рейсов в одном направлении нужно столько, чтобы провезти загрузку самого загруженного перегона
+        trips_needed = math.ceil(round(max_load, 6) / route.capacity) if max_load else 0
+        # Каждая посадка и высадка задерживает автобус: пассажиры делятся поровну между нужными рейсами
+        # обоих направлений, задержки удлиняют оборот и интервал между автобусами
+        dwell_time = 2 * PetriNet.passenger_time * self.passengers_count / (2 * trips_needed) if trips_needed else 0
+        headway = self.get_headway(dwell_time)
+        # Пассажиры ждут от прихода первого автобуса до последнего нужного рейса, в среднем - половину этого времени
+        waiting_trips = max(trips_needed, 1)
+        saturation = max_load * headway / (route.capacity * horizon_minutes * 60)
+        return {
+            'route_id': route.id,
+            'name': route.name,
+            'passengers_count': round(self.passengers_count),
+            'total_capacity': route.capacity * route.amount,
+            'headway': round(headway / 60, 1),
+            'one_way_time': round(self.one_way_time / 60, 1),
+            'route_length': round(self.route_index.route_length, 2),
+            'max_load': round(max_load),
+            'capacity_per_hour': round(route.capacity * 3600 / headway),
+            'trips_needed': trips_needed,
+            'dwell_time': round(dwell_time / 60, 1),
+            'expected_waiting_time': round(waiting_trips * headway / 2 / 60, 1),
+            'max_waiting_time': round(waiting_trips * headway / 60, 1),
+            'clearing_time': round((trips_needed * headway + self.one_way_time + dwell_time) / 60, 1),
+            'saturation': round(saturation, 2),
+            'status': get_saturation_status(saturation),
+        }
+
+
+def GetCalculationEstimate(data_to_calculate: dict, horizon_minutes: int = ESTIMATE_HORIZON_MINUTES) -> dict:
+    """
+    Оценка нагрузки по данным GetDataToCalculate: показатели маршрутов, остановок и итоги.
+    Время в минутах, passengers_count маршрута - ожидаемое количество его пассажиров
+    """
+    started_at = perf_counter()
+    network: PetriNet.NetworkSnapshot = data_to_calculate['network']
+    routes_estimates: dict[int, RouteEstimate] = {}
+    bus_stops_routes: dict[int, list[RouteEstimate]] = {}
+    for route in network.routes.values():
+        if not route.amount or not route.capacity:
+            continue
+        route_estimate = routes_estimates[route.id] = RouteEstimate(
+            route, PetriNet.RouteIndex.from_route(route, network.bus_stops))
+        for bus_stop_id in route_estimate.route_index.positions[0]:
+            bus_stops_routes.setdefault(bus_stop_id, []).append(route_estimate)
+
+    bus_stops_passengers = []
+    for busstops_direction in data_to_calculate['busstops_directions']:
+        bus_stop_id = busstops_direction['busstop']
+        stop_routes = bus_stops_routes.get(bus_stop_id, [])
+        # Остановка назначения -> количество пассажиров (без направления - поровну на достижимые остановки)
+        destinations: dict[int, float] = {}
+        for direction, count in sorted(busstops_direction['directions'].items()):
+            if direction == 0:
+                reachable_count = len(network.get_reachable_bus_stop_ids(bus_stop_id))
+                if not reachable_count:
+                    continue
+                for destination in {destination for route_estimate in stop_routes
+                                    for destination in route_estimate.route_index.positions[0]}:
+                    if destination != bus_stop_id:
+                        destinations[destination] = destinations.get(destination, 0) + count / reachable_count
+            elif direction != bus_stop_id:
+                destinations[direction] = destinations.get(direction, 0) + count
+
+        passengers_count = sum(busstops_direction['directions'].values())
+        served_count = 0.0
+        # Ожидаемое ожидание пассажиров остановки: по маршрутам, на которые они распределены
+        routes_passengers: dict[int, float] = {}
+        for destination, count in destinations.items():
+            serving_routes = [route_estimate for route_estimate in stop_routes
+                              if destination in route_estimate.route_index.positions[0]]
+            if not serving_routes:
+                continue
+            # Пассажир садится в первый подошедший автобус: доли маршрутов пропорциональны частоте движения
+            frequency = sum(route_estimate.frequency for route_estimate in serving_routes)
+            for route_estimate in serving_routes:
+                route_count = count * route_estimate.frequency / frequency
+                route_estimate.add_passengers(bus_stop_id, destination, route_count)
+                routes_passengers[route_estimate.route.id] = routes_passengers.get(route_estimate.route.id, 0) + \
+                    route_count
+            served_count += count
+        bus_stops_passengers.append((bus_stop_id, passengers_count, served_count, routes_passengers))
+
+    routes = [route_estimate.get_estimate(horizon_minutes) for route_estimate in routes_estimates.values()]
+    routes_by_id = {route['route_id']: route for route in routes}
+
+    bus_stops = []
+    waiting_time_sum = 0.0
+    for bus_stop_id, passengers_count, served_count, routes_passengers in bus_stops_passengers:
+        stop_waiting_time_sum = sum(routes_by_id[route_id]['expected_waiting_time'] * count
+                                    for route_id, count in routes_passengers.items())
+        waiting_time_sum += stop_waiting_time_sum
+        expected_waiting_time = stop_waiting_time_sum / served_count if served_count else None
+        bus_stops.append({
+            'bus_stop_id': bus_stop_id,
+            'name': network.bus_stops[bus_stop_id].name,
+            'passengers_count': passengers_count,
+            'unserved_passengers_count': round(passengers_count - served_count),
+            'routes_count': len(routes_passengers),
+            'expected_waiting_time': round(expected_waiting_time, 1) if expected_waiting_time is not None else None,
+            'saturated': any(routes_by_id[route_id]['status'] == ESTIMATE_STATUS_OVERLOADED
+                             for route_id in routes_passengers),
+        })
+
+    passengers_count = sum(bus_stop['passengers_count'] for bus_stop in bus_stops)
+    served_count = sum(served for _, _, served, _ in bus_stops_passengers)
+    return {
+        'city_name': network.city_name,
+        'horizon_minutes': horizon_minutes,
+        'routes': routes,
+        'bus_stops': bus_stops,
+        'totals': {
+            'passengers_count': passengers_count,
+            'unserved_passengers_count': round(passengers_count - served_count),
+            'expected_waiting_time': round(waiting_time_sum / served_count, 1) if served_count else None,
+            'max_saturation': max((route['saturation'] for route in routes), default=0),
+            'warning_routes_count': sum(route['status'] == ESTIMATE_STATUS_WARNING for route in routes),
+            'overloaded_routes_count': sum(route['status'] == ESTIMATE_STATUS_OVERLOADED for route in routes),
+        },
+        'estimate_time_ms': round((perf_counter() - started_at) * 1000, 2),
+    }
@@ -0,0 +1,231 @@
+"""
+Асинхронные задачи расчёта с очередью в БД (без внешнего брокера).
+
+Endpoint расчёта с run_async создаёт CalculationJob и сразу возвращает её id.
+Команда run_calculation_worker забирает задачи из таблицы (select_for_update с skip_locked,
+поэтому обработчиков может быть несколько) и выполняет RunCalculation вне процессов веб-сервера.
+Пока задача выполняется, обработчик периодически отмечается в updated_at: задачи остановившихся
+обработчиков возвращаются в работу через CALCULATION_JOB_STALE_TIMEOUT секунд.
+Задача в очереди отменяется сразу, у выполняющейся выставляется cancel_requested: обработчик проверяет
+его во время расчёта (JobCancellationToken), останавливает расчёт и сохраняет задачу отменённой
+"""
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+from time import perf_counter
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .calculation_utils import (CALCULATION_STAGE_CANCELLED, CALCULATION_STAGE_DONE, CalculationProgress,
+                                CancellationToken, RunCalculation)
+from .models import CalculationJob
+from .serializers import CalculationRequestSerializer
+
+logger = logging.getLogger('PetriNetManager')
+
+# Как часто сохраняется доля выполнения во время расчёта (секунд)
+JOB_PROGRESS_SAVE_INTERVAL = 1.0
+# Как часто во время расчёта проверяется запрос отмены задачи (секунд)
+JOB_CANCEL_CHECK_INTERVAL = 1.0
+
+
+def get_worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobCancellationToken(CancellationToken):
+    """Признак отмены задачи: cancel_requested в БД, запрашивается не чаще JOB_CANCEL_CHECK_INTERVAL секунд"""
+    def __init__(self, job_id: int) -> None:
+        super().__init__()
+        self.job_id = job_id
+        self.checked_at = 0.0
+
+    def is_cancelled(self) -> bool:
+        if not self.cancelled:
+            checked_at = perf_counter()
+            if checked_at - self.checked_at >= JOB_CANCEL_CHECK_INTERVAL:
+                self.checked_at = checked_at
+                self.cancelled = CalculationJob.objects.filter(pk=self.job_id, cancel_requested=True).exists()
+        return self.cancelled
+
+
+class JobProgress(CalculationProgress):
+    """Прогресс задачи: этап сохраняется сразу, доля выполнения - не чаще JOB_PROGRESS_SAVE_INTERVAL секунд"""
+    def __init__(self, job: CalculationJob) -> None:
+        super().__init__(JobCancellationToken(job.pk))
+        self.job = job
+        self.saved_at = 0.0
+
+    def save(self, force: bool = False) -> None:
+        saved_at = perf_counter()
+        if not force and saved_at - self.saved_at < JOB_PROGRESS_SAVE_INTERVAL:
+            return
+        self.saved_at = saved_at
+        # update не заполняет auto_now: сохранение прогресса тоже отмечает, что обработчик работает
+        CalculationJob.objects.filter(pk=self.job.pk).update(stage=self.stage, progress=self.get_progress(),
+                                                             updated_at=timezone.now())
+
+    def set_stage(self, stage: str) -> None:
+        super().set_stage(stage)
+        self.save(force=True)
+
+    def on_boarding(self, passengers_count: int) -> None:
+        super().on_boarding(passengers_count)
+        self.save()
+
+    def on_parts_progress(self, boarded_passengers_count: int) -> None:
+        super().on_parts_progress(boarded_passengers_count)
+        self.save()
+
+
+class JobHeartbeat(threading.Thread):
+    """Отметка обработчика в updated_at задачи каждые CALCULATION_JOB_HEARTBEAT_INTERVAL секунд, пока идёт расчёт"""
+    def __init__(self, job_id: int) -> None:
+        super().__init__(name=f'calculation-job-{job_id}-heartbeat', daemon=True)
+        self.job_id = job_id
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        try:
+            while not self.stopped.wait(settings.CALCULATION_JOB_HEARTBEAT_INTERVAL):
+                CalculationJob.objects.filter(pk=self.job_id).update(updated_at=timezone.now())
+        except Exception:
+            logger.exception(f"Ошибка при обновлении отметки задачи расчёта {self.job_id}")
+        finally:
+            # У потока своё подключение к БД
+            connection.close()
+
+    def __enter__(self) -> JobHeartbeat:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stopped.set()
+        self.join()
+
+
+def ClaimCalculationJob(worker_name: str) -> CalculationJob | None:
+    """Забирает самую раннюю задачу из очереди (или задачу остановившегося обработчика) и отмечает её выполняемой"""
+    stale_before = timezone.now() - timedelta(seconds=settings.CALCULATION_JOB_STALE_TIMEOUT)
+    # Отменённые задачи остановившихся обработчиков не перезапускаются
+    CalculationJob.objects.filter(status=CalculationJob.STATUS_RUNNING, cancel_requested=True,
+                                  updated_at__lt=stale_before).update(status=CalculationJob.STATUS_CANCELLED,
+                                                                      finished_at=timezone.now())
+    with transaction.atomic():
+        job = CalculationJob.objects.select_for_update(skip_locked=True).filter(
+            Q(status=CalculationJob.STATUS_QUEUED) |
+            Q(status=CalculationJob.STATUS_RUNNING, cancel_requested=False, updated_at__lt=stale_before)
+        ).order_by('created_at').first()
+        if job is None:
+            return None
+        if job.status == CalculationJob.STATUS_RUNNING:
+            logger.warning(f"Задача расчёта {job.pk} обработчика {job.worker} не обновлялась с {job.updated_at}, "
+                           f"повторный запуск")
+        job.status = CalculationJob.STATUS_RUNNING
+        job.progress = 0
+        job.worker = worker_name
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'progress', 'worker', 'started_at', 'updated_at'])
+    return job
+
+
+def CancelCalculationJob(job: CalculationJob) -> bool:
+    """Отмена задачи: в очереди - сразу, выполняющейся - через cancel_requested. False - задача уже завершена"""
+    if CalculationJob.objects.filter(pk=job.pk, status=CalculationJob.STATUS_QUEUED).update(
+            status=CalculationJob.STATUS_CANCELLED, cancel_requested=True, finished_at=timezone.now()):
+        return True
+    return bool(CalculationJob.objects.filter(pk=job.pk, status=CalculationJob.STATUS_RUNNING).update(
+        cancel_requested=True))
+
+
+def FinishCalculationJob(job: CalculationJob, response: dict, status: int) -> None:
+    """
+    Сохраняет результат задачи. Отчёт успешного расчёта хранится в симуляции,
+    в задаче ответ сохраняется, только если в нём есть временная шкала или симуляцию не удалось сохранить
+    """
+    job.response_status = status
+    job.finished_at = timezone.now()
+    if response.get('stage') == CALCULATION_STAGE_CANCELLED:
+        job.status = CalculationJob.STATUS_CANCELLED
+        job.error_message = response['error_message']
+        job.result = response
+    elif response['error']:
+        job.status = CalculationJob.STATUS_FAILED
+        job.error_message = response.get('error_message', '')
+        job.result = response
+    else:
+        job.status = CalculationJob.STATUS_DONE
+        job.stage = CALCULATION_STAGE_DONE
+        job.progress = 1
+        job.simulation_id = response.get('simulation_id')
+        job.result = response if job.simulation_id is None or 'calculate' in response else None
+    # cancel_requested не перезаписывается: его выставляет запрос отмены
+    job.save(update_fields=['status', 'stage', 'progress', 'result', 'response_status', 'simulation',
+                            'error_message', 'finished_at', 'updated_at'])
+
+
+def RunCalculationJob(job: CalculationJob) -> None:
+    """Выполняет задачу расчёта в текущем процессе"""
+    serializer = CalculationRequestSerializer(data=job.request_data)
+    if not serializer.is_valid():
+        FinishCalculationJob(job, {
+            'error': 1,
+            'error_message': 'Ошибка валидации входных данных. Проверьте корректность отправленных данных.',
+            'details': serializer.errors,
+            'stage': 'validation'
+        }, 400)
+        return
+
+    progress = JobProgress(job)
+    started_at = perf_counter()
+    logger.info(f"Запуск задачи расчёта {job.pk}")
+    try:
+        with JobHeartbeat(job.pk):
+            response, status = RunCalculation(serializer.validated_data,
+                                              job.user.username if job.user else '', progress)
+    except Exception as e:
+        logger.exception(f"Ошибка при выполнении задачи расчёта {job.pk}")
+        response, status = {
+            'error': 2,
+            'error_message': f'Ошибка при выполнении расчёта: {str(e)}',
+            'details': str(e),
+            'stage': progress.stage
+        }, 500
+    # Этап и доля выполнения сохранялись отдельными запросами: при ошибке или отмене по ним видно,
+    # где остановился расчёт
+    job.stage = progress.stage
+    job.progress = progress.get_progress()
+    FinishCalculationJob(job, response, status)
+    logger.info(f"Задача расчёта {job.pk} завершена со статусом {job.status} "
+                f"за {round(perf_counter() - started_at, 3)} с")
+
+
+def RunCalculationWorker(poll_interval: float, once: bool = False, stop_event: threading.Event | None = None) -> int:
+    """
+    Цикл обработчика: задачи выполняются по одной, при пустой очереди - ожидание poll_interval секунд.
+    once - выполнить задачи из очереди и завершиться. Возвращает количество выполненных задач
+    """
+    stop_event = stop_event or threading.Event()
+    worker_name = get_worker_name()
+    jobs_count = 0
+    logger.info(f"Обработчик задач расчёта {worker_name} запущен")
+    while not stop_event.is_set():
+        # Долгоживущий процесс: закрываем подключения к БД с истёкшим сроком жизни
+        close_old_connections()
+        job = ClaimCalculationJob(worker_name)
+        if job is None:
+            if once:
+                break
+            stop_event.wait(poll_interval)
+            continue
+        RunCalculationJob(job)
+        jobs_count += 1
+    logger.info(f"Обработчик задач расчёта {worker_name} остановлен, выполнено задач: {jobs_count}")
+    return jobs_count
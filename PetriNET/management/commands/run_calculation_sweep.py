@@ -0,0 +1,65 @@
+import json
+import logging
+from time import perf_counter
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from PetriNET.petri_net_utils import GetDataToCalculate
+from PetriNET.serializers import SweepRequestSerializer
+from PetriNET.sweep_utils import GetSweepVariants, RunSweep
+
+logger = logging.getLogger('PetriNetManager')
+
+
+class Command(BaseCommand):
+    help = 'Перебор количества автобусов и интервала движения маршрутов по базовому сценарию в пуле процессов'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('input', type=str,
+                            help='JSON-файл в формате запроса /api/calculations/sweep/ '
+                                 '(data_to_calculate, seed, routes с диапазонами amount и interval)')
+        parser.add_argument('--max_workers', type=int, default=None,
+                            help='Количество процессов (по умолчанию CALCULATION_MAX_WORKERS или по количеству ядер)')
+        parser.add_argument('--output', type=str, default=None, help='Файл для сохранения результата в JSON')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        with open(options['input'], encoding='utf-8') as file:
+            serializer = SweepRequestSerializer(data=json.load(file))
+        if not serializer.is_valid():
+            raise CommandError(f"Ошибка в данных для перебора: {serializer.errors}")
+
+        data_to_calculate = GetDataToCalculate(serializer.validated_data['data_to_calculate'])
+        try:
+            variants = GetSweepVariants(data_to_calculate['network'], serializer.validated_data['routes'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        seed = serializer.validated_data['seed']
+        self.stdout.write(f"Вариантов: {len(variants)}, seed: {seed}")
+
+        started_at = perf_counter()
+        variants_results = RunSweep(data_to_calculate, variants, seed,
+                                    options['max_workers'] or settings.CALCULATION_MAX_WORKERS or None)
+        calculation_time = round(perf_counter() - started_at, 3)
+
+        for variant in variants_results:
+            if variant['error']:
+                self.stdout.write(self.style.ERROR(f"{variant['variant']}: {variant['error_message']}"))
+                continue
+            routes_parameters = ', '.join(
+                f"{route_id}: {route['amount']} авт. / {route['interval']} мин"
+                for route_id, route in variant['routes'].items() if route_id in variants[variant['variant']]
+            )
+            self.stdout.write(
+                f"{variant['variant']}: [{routes_parameters}] ожидание p50/p90 {variant['waiting_time_p50']}/"
+                f"{variant['waiting_time_p90']} мин, рейсов {variant['total_trips_count']}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Перебор завершён за {calculation_time} с"))
+        logger.info(f"Перебор из командной строки: вариантов={len(variants)}, время={calculation_time} с")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({'seed': seed, 'variants': variants_results, 'calculation_time': calculation_time},
+                          file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Результат сохранён в {options['output']}"))
@@ -0,0 +1,36 @@
+import logging
+import signal
+import threading
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+
+from PetriNET.job_utils import RunCalculationWorker
+
+logger = logging.getLogger('PetriNetManager')
+
+
+class Command(BaseCommand):
+    help = 'Обработчик асинхронных задач расчёта: забирает задачи из очереди в БД и выполняет их по одной'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--poll_interval', type=float, default=None,
+                            help='Пауза между проверками пустой очереди в секундах '
+                                 '(по умолчанию CALCULATION_JOB_POLL_INTERVAL)')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить задачи, которые есть в очереди, и завершиться')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        stop_event = threading.Event()
+
+        def stop(signum, frame) -> None:
+            # Текущая задача досчитывается, новые не забираются
+            logger.info(f"Получен сигнал {signum}, обработчик остановится после текущей задачи")
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        jobs_count = RunCalculationWorker(options['poll_interval'] or settings.CALCULATION_JOB_POLL_INTERVAL,
+                                          once=options['once'], stop_event=stop_event)
+        self.stdout.write(self.style.SUCCESS(f"Обработчик остановлен, выполнено задач: {jobs_count}"))
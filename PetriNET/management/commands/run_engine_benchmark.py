@@ -0,0 +1,91 @@
+import json
+import logging
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from PetriNET.benchmark_utils import (LAYOUT_GRID, LAYOUTS, CreateSyntheticNetwork, RunDataPreparationBenchmark,
+                                      RunEngineBenchmark)
+from PetriNET.models import BusStop, Route
+from PetriNET.petri_net_utils import (CALCULATION_ENGINE_DISCRETE, CALCULATION_ENGINES, TIMELINE_FORMAT_FULL,
+                                      TIMELINE_FORMATS)
+
+logger = logging.getLogger('PetriNetManager')
+
+
+class Command(BaseCommand):
+    help = 'Замер времени и памяти этапов расчёта на синтетической сети, результат в JSON для сравнения запусков'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--layout', type=str, default=LAYOUT_GRID, choices=LAYOUTS,
+                            help='Расположение остановок синтетического города')
+        parser.add_argument('--stops', type=int, default=400, help='Количество остановок')
+        parser.add_argument('--routes', type=int, default=20, help='Количество маршрутов')
+        parser.add_argument('--stops_per_route', type=int, default=20, help='Количество остановок на маршруте')
+        parser.add_argument('--passengers', type=int, default=10000, help='Количество пассажиров')
+        parser.add_argument('--capacity', type=int, default=80, help='Вместимость автобуса')
+        parser.add_argument('--interval', type=int, default=10, help='Интервал движения в минутах')
+        parser.add_argument('--amount', type=int, default=3, help='Количество автобусов на маршруте')
+        parser.add_argument('--seed', type=int, default=1, help='Seed генерации сети и пассажиропотока')
+        parser.add_argument('--repeat', type=int, default=3, help='Количество замеров времени')
+        parser.add_argument('--timeline_format', type=str, default=TIMELINE_FORMAT_FULL, choices=TIMELINE_FORMATS,
+                            help='Формат временной шкалы')
+        parser.add_argument('--engine', type=str, default=CALCULATION_ENGINE_DISCRETE, choices=CALCULATION_ENGINES,
+                            help='Движок расчёта: discrete (по пассажирам) или mesoscopic (по количествам пассажиров)')
+        parser.add_argument('--city_id', type=int, default=None,
+                            help='Дополнительно замерить подготовку данных (GetDataToCalculate) по маршрутам города из БД')
+        parser.add_argument('--output', type=str, default=None, help='Файл для сохранения результата в JSON')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        data_to_calculate = CreateSyntheticNetwork(
+            layout=options['layout'],
+            stops_count=options['stops'],
+            routes_count=options['routes'],
+            stops_per_route=options['stops_per_route'],
+            passengers_count=options['passengers'],
+            seed=options['seed'],
+            capacity=options['capacity'],
+            interval=options['interval'],
+            amount=options['amount'],
+        )
+        self.stdout.write(
+            f"Синтетическая сеть: маршрутов {len(data_to_calculate['network'].routes)}, "
+            f"остановок {len(data_to_calculate['network'].bus_stops)}, пассажиров {options['passengers']}"
+        )
+        result = {
+            'parameters': {key: options[key] for key in ('layout', 'stops', 'routes', 'stops_per_route', 'passengers',
+                                                         'capacity', 'interval', 'amount', 'seed', 'engine')},
+            'engine': RunEngineBenchmark(data_to_calculate, repeat=options['repeat'],
+                                         timeline_format=options['timeline_format'], seed=options['seed'],
+                                         engine=options['engine']),
+        }
+        if options['city_id'] is not None:
+            result['data_preparation'] = RunDataPreparationBenchmark(
+                self.get_city_request_data(options['city_id'], options['passengers']), repeat=options['repeat'])
+
+        output = json.dumps(result, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+            self.stdout.write(self.style.SUCCESS(f"Результат сохранён в {options['output']}"))
+        else:
+            self.stdout.write(output)
+        logger.info(f"Бенчмарк расчёта: {json.dumps(result['engine']['stages'], ensure_ascii=False)}")
+
+    def get_city_request_data(self, city_id: int, passengers_count: int) -> dict:
+        """Запрос на расчёт по всем маршрутам города: на каждой остановке пассажиры без направления"""
+        routes = list(Route.objects.filter(city_id=city_id).values('id', 'name'))
+        bus_stop_ids = BusStop.objects.filter(city_id=city_id, route__in=[route['id'] for route in routes]) \
+            .values_list('id', flat=True).distinct()
+        passengers_per_stop = max(passengers_count // (len(bus_stop_ids) or 1), 1)
+        return {
+            'city_id': city_id,
+            'routes': routes,
+            'busstops': {
+                str(bus_stop_id): {
+                    'busstop_id': bus_stop_id,
+                    'passengers_without_direction': passengers_per_stop,
+                    'directions': [],
+                } for bus_stop_id in bus_stop_ids
+            },
+        }
@@ -0,0 +1,319 @@
+"""
+Мезоскопический движок расчёта для сценариев масштаба города.
+
+Вместо отдельных пассажиров хранятся количества: очередь остановки - массив NumPy по остановкам
+назначения, загрузка автобуса - массив по позициям маршрута, на которых пассажиры выйдут.
+Автобусы обрабатываются пакетами по времени (MESOSCOPIC_BATCH_SECONDS): высадка считается сразу
+для всего пакета, посадка - одной операцией над массивом остановок назначения.
+
+Правила движения те же, что у PetriNet. Время ожидания считается так же точно (все пассажиры
+появляются в начале расчёта), время поездки - по среднему времени посадки пассажиров с одной
+остановкой высадки. Отчёт строится тем же PetriNet.get_data_to_report, временная шкала не записывается
+"""
+from __future__ import annotations
+
+import logging
+from time import perf_counter
+
+import numpy as np
+
+from .petri_net_utils import TIMELINE_FORMAT_FULL, PetriNet
+
+logger = logging.getLogger('PetriNetManager')
+
+# Длительность пакета: автобусы с событиями в пределах пакета обрабатываются вместе (секунд)
+MESOSCOPIC_BATCH_SECONDS = 60
+
+
+class MesoscopicNet():
+    """
+    Агрегированный расчёт сети с интерфейсом PetriNet: Calculation, CreateDataToReport,
+    combining_steps и timeline.get_delta_response (временная шкала всегда пустая)
+    """
+    def __init__(self, data_to_calculate: dict, timeline_format: str = TIMELINE_FORMAT_FULL,
+                 record_timeline: bool = False, observer: PetriNet.Observer | None = None,
+                 seed: int | None = None) -> None:
+        self.data_to_calculate = data_to_calculate
+        self.network: PetriNet.NetworkSnapshot = data_to_calculate['network']
+        self.routes = list(self.network.routes.values())
+        self.observer = observer
+        self.seed = seed
+        self.random = np.random.default_rng(seed)
+        # Отдельных пассажиров в модели нет, поэтому шаги для отрисовки не записываются
+        self.timeline = PetriNet.TimeLine({}, timeline_format, record_timeline=False)
+        self.last_seconds_from_start = 0
+        # Статистика для отчёта в формате PetriNet.get_statistics
+        self.routes_statistics = {route.id: {'average_passengers_stops_count': [0, 0],
+                                             'average_fullness': [0, 0],
+                                             'completed_trips': 0,
+                                             'boardings_count': 0,
+                                             'max_occupancy': 0,
+                                             'waiting_times': PetriNet.Histogram(),
+                                             'ride_times': PetriNet.Histogram(),
+                                             'route_length': 0,
+                                             } for route in self.routes}
+        self.bus_stops_statistics: dict[int, dict] = {}
+        if observer is not None:
+            phase_start = perf_counter()
+        self.init_action()
+        if observer is not None:
+            observer.on_phase('init', perf_counter() - phase_start)
+
+    def init_action(self) -> None:
+        """Очереди остановок, таблицы посадки маршрутов и массивы состояния автобусов"""
+        self.route_indexes: dict[int, PetriNet.RouteIndex] = {}
+        buses = []
+        for route in self.routes:
+            if not route.amount or not route.capacity:
+                logger.warning(f"На маршруте {route.id} не указаны автобусы, маршрут не будет учитываться в расчёте")
+                continue
+            route_index = self.route_indexes[route.id] = PetriNet.RouteIndex.from_route(route,
+                                                                                        self.network.bus_stops)
+            self.routes_statistics[route.id]['route_length'] = route_index.route_length
+            buses.extend((route, bus_number * route.interval * 60) for bus_number in range(route.amount))
+        if not buses:
+            raise Exception("Отсутствуют автобусы на маршрутах")
+
+        # Остановка -> (id остановки назначения -> номер столбца очереди) и очередь по остановкам назначения
+        self.destinations: dict[int, dict[int, int]] = {}
+        self.queues: dict[int, np.ndarray] = {}
+        for busstops_direction in self.data_to_calculate['busstops_directions']:
+            bus_stop_id = busstops_direction['busstop']
+            valid_bus_stops = self.network.get_reachable_bus_stop_ids(bus_stop_id)
+            columns = {destination: column for column, destination in enumerate(valid_bus_stops)}
+            # Явные направления вне достижимых остановок тоже хранятся в очереди, как в PetriNet
+            for direction in sorted(busstops_direction['directions']):
+                if direction and direction not in columns:
+                    columns[direction] = len(columns)
+            queue = np.zeros(len(columns), dtype=np.int64)
+            for direction, count in sorted(busstops_direction['directions'].items()):
+                if direction == 0:
+                    # Пассажиры без направления распределяются по достижимым остановкам равновероятно
+                    if valid_bus_stops:
+                        queue += self.random.multinomial(count, np.full(len(valid_bus_stops), 1 / len(valid_bus_stops)))
+                else:
+                    queue[columns[direction]] += count
+            self.destinations[bus_stop_id] = columns
+            self.queues[bus_stop_id] = queue
+            self.bus_stops_statistics[bus_stop_id] = {
+                'initial_passengers_count': int(queue.sum()),
+                'last_served_time': None,
+                'waiting_times': PetriNet.Histogram(),
+            }
+        if not self.queues:
+            raise Exception("Отсутствуют пассажиры")
+
+        # Маршрут -> [направление][позиция] -> (столбцы очереди остановки, позиции высадки) или None
+        self.boarding_tables: dict[int, list[list[tuple[np.ndarray, np.ndarray] | None]]] = {
+            route_id: self.get_boarding_table(route_index) for route_id, route_index in self.route_indexes.items()
+        }
+
+        max_route_length = max(route_index.last_position + 1 for route_index in self.route_indexes.values())
+        self.bus_routes: list[PetriNet.RouteData] = [route for route, _ in buses]
+        self.bus_directions = np.zeros(len(buses), dtype=np.int64)
+        self.bus_positions = np.zeros(len(buses), dtype=np.int64)
+        self.bus_times = np.array([start_time for _, start_time in buses], dtype=np.int64)
+        self.bus_active = np.ones(len(buses), dtype=bool)
+        # Пассажиры в автобусе по позиции высадки в текущем направлении и сумма их времени посадки
+        self.bus_loads = np.zeros((len(buses), max_route_length), dtype=np.int64)
+        self.bus_boarding_time_sums = np.zeros((len(buses), max_route_length), dtype=np.int64)
+        # (маршрут, остановка) -> время последнего отправления автобуса маршрута с конечной
+        self.last_departures: dict[tuple[int, int], int] = {}
+
+    def get_boarding_table(self, route_index: PetriNet.RouteIndex) -> list[list[tuple[np.ndarray, np.ndarray] | None]]:
+        """
+        Для каждой позиции маршрута: столбцы очереди остановки с остановками назначения впереди по пути
+        и позиции высадки (первое вхождение остановки после текущей позиции, как в PetriNet)
+        """
+        table = []
+        for sequence in route_index.sequences:
+            direction_table = []
+            for position, bus_stop_id in enumerate(sequence):
+                columns = self.destinations.get(bus_stop_id)
+                if columns is None:
+                    direction_table.append(None)
+                    continue
+                end_positions = {}
+                for end_position in range(len(sequence) - 1, position, -1):
+                    end_positions[sequence[end_position]] = end_position
+                pairs = sorted((end_position, columns[destination]) for destination, end_position in end_positions.items()
+                               if destination in columns)
+                if pairs:
+                    direction_table.append((np.array([column for _, column in pairs], dtype=np.int64),
+                                            np.array([end_position for end_position, _ in pairs], dtype=np.int64)))
+                else:
+                    direction_table.append(None)
+            table.append(direction_table)
+        return table
+
+    def get_waiting(self, route: PetriNet.RouteData, direction: int, position: int) -> tuple | None:
+        """Пассажиры остановки, которых автобус может довезти от позиции: (столбцы, позиции высадки, количества)"""
+        boarding = self.boarding_tables[route.id][direction][position]
+        if boarding is None:
+            return None
+        columns, end_positions = boarding
+        bus_stop_id = self.route_indexes[route.id].sequences[direction][position]
+        waiting = self.queues[bus_stop_id][columns]
+        if not waiting.any():
+            return None
+        return columns, end_positions, waiting
+
+    def is_route_waiting(self, route: PetriNet.RouteData) -> bool:
+        """Есть ли на остановках маршрута пассажиры, которых он может довезти"""
+        return any(self.get_waiting(route, direction, position) is not None
+                   for direction, direction_table in enumerate(self.boarding_tables[route.id])
+                   for position, boarding in enumerate(direction_table) if boarding is not None)
+
+    def board(self, bus: int, route: PetriNet.RouteData, direction: int, position: int, seconds_from_start: int,
+              free_places: int) -> int:
+        """Посадка в автобус по остановкам назначения в порядке следования, пока есть места"""
+        waiting = self.get_waiting(route, direction, position)
+        if waiting is None or free_places <= 0:
+            return 0
+        columns, end_positions, waiting = waiting
+        boarded = np.minimum(waiting, np.maximum(free_places - (np.cumsum(waiting) - waiting), 0))
+        boarded_count = int(boarded.sum())
+        bus_stop_id = self.route_indexes[route.id].sequences[direction][position]
+        self.queues[bus_stop_id][columns] -= boarded
+        self.bus_loads[bus, end_positions] += boarded
+        self.bus_boarding_time_sums[bus, end_positions] += boarded * seconds_from_start
+        # Все пассажиры появляются на остановках в начале расчёта, ожидание длится до посадки
+        statistics = self.routes_statistics[route.id]
+        self.bus_stops_statistics[bus_stop_id]['waiting_times'].record(seconds_from_start, boarded_count)
+        statistics['waiting_times'].record(seconds_from_start, boarded_count)
+        statistics['average_passengers_stops_count'][0] += int(((end_positions - position) * boarded).sum())
+        statistics['average_passengers_stops_count'][1] += boarded_count
+        statistics['boardings_count'] += boarded_count
+        return boarded_count
+
+    def fast_forward_empty_bus(self, route: PetriNet.RouteData, direction: int, position: int) -> tuple[int, int]:
+        """Пустой автобус проезжает остановки без пассажиров по пути, возвращает позицию и время в пути"""
+        route_index = self.route_indexes[route.id]
+        start_position = position
+        while position != route_index.last_position:
+            if route_index.sequences[direction][position] in route_index.terminal_bus_stop_ids or \
+                    self.get_waiting(route, direction, position) is not None:
+                break
+            position += 1
+        self.routes_statistics[route.id]['average_fullness'][1] += position - start_position
+        return position, route_index.get_travel_time_between(direction, start_position, position)
+
+    def process_bus(self, bus: int, alighted_count: int, boarding_time_sum: int) -> None:
+        """Событие автобуса на остановке после высадки: посадка и отправление (правила как в PetriNet.Calculation)"""
+        route = self.bus_routes[bus]
+        route_index = self.route_indexes[route.id]
+        statistics = self.routes_statistics[route.id]
+        observer = self.observer
+        direction = int(self.bus_directions[bus])
+        position = int(self.bus_positions[bus])
+        seconds_from_start = int(self.bus_times[bus])
+        bus_stop_id = route_index.sequences[direction][position]
+        if alighted_count:
+            statistics['ride_times'].record(seconds_from_start - boarding_time_sum // alighted_count, alighted_count)
+            seconds_from_start += PetriNet.passenger_time * alighted_count
+            if observer is not None:
+                observer.on_alighting(alighted_count)
+
+        ending_station = position == route_index.last_position
+        # На конечной автобус разворачивается, посадка - на оставшийся путь в обратную сторону
+        rest_direction, rest_position = (1 - direction, 0) if ending_station else (direction, position)
+        load = int(self.bus_loads[bus].sum())
+        boarded_count = self.board(bus, route, rest_direction, rest_position, seconds_from_start,
+                                   route.capacity - load)
+        if boarded_count:
+            load += boarded_count
+            self.bus_stops_statistics[bus_stop_id]['last_served_time'] = seconds_from_start
+            statistics['max_occupancy'] = max(statistics['max_occupancy'], load)
+            seconds_from_start += PetriNet.passenger_time * boarded_count
+            if observer is not None:
+                observer.on_boarding(boarded_count)
+        self.last_seconds_from_start = max(self.last_seconds_from_start, seconds_from_start)
+
+        if (ending_station or position == 0) and not load and not self.is_route_waiting(route):
+            # Автобус завершил работу - на маршруте больше нет пассажиров, которых он может довезти
+            self.bus_active[bus] = False
+            return
+        last_departure = self.last_departures.get((route.id, bus_stop_id))
+        if ending_station and last_departure is not None and \
+                seconds_from_start - last_departure < route.interval * 60:
+            # Автобус ждёт интервал движения на конечной
+            self.bus_times[bus] = seconds_from_start + route.interval * 60
+            return
+        self.last_departures[(route.id, bus_stop_id)] = seconds_from_start
+        travel_time = route_index.segment_travel_times[rest_direction][rest_position]
+        statistics['average_fullness'][0] += load
+        statistics['average_fullness'][1] += 1
+        if ending_station:
+            statistics['completed_trips'] += 1
+        position = rest_position + 1
+        if not load:
+            position, fast_forward_time = self.fast_forward_empty_bus(route, rest_direction, position)
+            travel_time += fast_forward_time
+        self.bus_directions[bus] = rest_direction
+        self.bus_positions[bus] = position
+        self.bus_times[bus] = seconds_from_start + travel_time
+
+    def Calculation(self) -> list:
+        """Расчёт пакетами: автобусы с событиями в пределах MESOSCOPIC_BATCH_SECONDS от ближайшего события"""
+        observer = self.observer
+        if observer is not None:
+            observer.on_calculation_start()
+        while True:
+            active = np.flatnonzero(self.bus_active)
+            if not active.size:
+                break
+            active_times = self.bus_times[active]
+            batch = active[active_times < active_times.min() + MESOSCOPIC_BATCH_SECONDS]
+            batch = batch[np.argsort(self.bus_times[batch], kind='stable')]
+            if observer is not None:
+                phase_start = perf_counter()
+                observer.on_event(int(self.bus_times[batch[0]]), int(batch.size), int(active.size - batch.size))
+            # Высадка всего пакета: пассажиры, чья позиция высадки совпадает с позицией автобуса
+            positions = self.bus_positions[batch]
+            alighted_counts = self.bus_loads[batch, positions]
+            boarding_time_sums = self.bus_boarding_time_sums[batch, positions]
+            self.bus_loads[batch, positions] = 0
+            self.bus_boarding_time_sums[batch, positions] = 0
+            if observer is not None:
+                phase_end = perf_counter()
+                observer.on_phase('alighting', phase_end - phase_start)
+                phase_start = phase_end
+            for bus, alighted_count, boarding_time_sum in zip(batch.tolist(), alighted_counts.tolist(),
+                                                               boarding_time_sums.tolist()):
+                self.process_bus(bus, alighted_count, boarding_time_sum)
+            if observer is not None:
+                observer.on_phase('boarding', perf_counter() - phase_start)
+        if observer is not None:
+            observer.on_calculation_end()
+        return self.timeline.data_to_response
+
+    def get_statistics(self) -> dict:
+        """Статистика расчёта в формате PetriNet.get_statistics"""
+        return {
+            'last_seconds_from_start': self.last_seconds_from_start,
+            'bus_stops': {
+                bus_stop_id: {
+                    **statistics,
+                    # Время последней посадки, если остановка опустела, иначе ожидание длится до конца расчёта
+                    'last_served_time': None if self.queues[bus_stop_id].any() else statistics['last_served_time'],
+                    'waiting_times': PetriNet.get_censored_waiting_times(statistics['waiting_times'],
+                                                                         int(self.queues[bus_stop_id].sum()),
+                                                                         self.last_seconds_from_start),
+                } for bus_stop_id, statistics in self.bus_stops_statistics.items()
+                if statistics['initial_passengers_count']
+            },
+            'routes': self.routes_statistics,
+        }
+
+    def CreateDataToReport(self) -> dict:
+        """Собирает данные для отчёта"""
+        if self.observer is not None:
+            phase_start = perf_counter()
+        data_to_report = PetriNet.get_data_to_report(self.network, self.get_statistics())
+        if self.observer is not None:
+            self.observer.on_phase('report', perf_counter() - phase_start)
+        return data_to_report
+
+    def combining_steps(self) -> list:
+        """Временная шкала не записывается"""
+        return self.timeline.data_to_response
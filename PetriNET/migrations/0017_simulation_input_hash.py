@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PetriNET', '0016_add_validators_and_defaults'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simulation',
+            name='input_hash',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='По хэшу повторный расчёт тех же данных берётся из сохранённой симуляции', max_length=64, verbose_name='Хэш входных данных'),
+        ),
+    ]
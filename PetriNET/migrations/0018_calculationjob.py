@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-17 12:00
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PetriNET', '0017_simulation_input_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalculationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Выполнена'), ('failed', 'Ошибка')], db_index=True, default='queued', max_length=16, verbose_name='Статус')),
+                ('stage', models.CharField(default='queued', max_length=32, verbose_name='Этап расчёта')),
+                ('progress', models.FloatField(default=0, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)], verbose_name='Доля выполнения')),
+                ('request_data', models.JSONField(verbose_name='Данные запроса расчёта')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Результат')),
+                ('response_status', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='HTTP-статус ответа')),
+                ('error_message', models.TextField(blank=True, default='', verbose_name='Сообщение об ошибке')),
+                ('worker', models.CharField(blank=True, default='', help_text='Хост и процесс обработчика, выполняющего задачу', max_length=255, verbose_name='Обработчик')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата начала')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата завершения')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('simulation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='calculation_jobs', to='PetriNET.simulation', verbose_name='Симуляция')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='calculation_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Задача расчёта',
+                'verbose_name_plural': 'Задачи расчёта',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
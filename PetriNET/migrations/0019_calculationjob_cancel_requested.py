@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-17 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PetriNET', '0018_calculationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calculationjob',
+            name='cancel_requested',
+            field=models.BooleanField(default=False, verbose_name='Запрошена отмена'),
+        ),
+        migrations.AlterField(
+            model_name='calculationjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Выполнена'), ('failed', 'Ошибка'), ('cancelled', 'Отменена')], db_index=True, default='queued', max_length=16, verbose_name='Статус'),
+        ),
+    ]
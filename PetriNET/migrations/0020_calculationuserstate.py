@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-17 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PetriNET', '0019_calculationjob_cancel_requested'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalculationUserState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150, unique=True, verbose_name='Пользователь')),
+                ('active_count', models.PositiveIntegerField(default=0, verbose_name='Активных расчётов')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Расчёты пользователя',
+                'verbose_name_plural': 'Расчёты пользователей',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PetriNET', '0020_calculationuserstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calculationuserstate',
+            name='cancel_generation',
+            field=models.PositiveIntegerField(default=0, verbose_name='Номер отмены расчётов'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-17 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('PetriNET', '0021_calculationuserstate_cancel_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalculationPoolSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('running', 'Выполнение'), ('queued', 'Очередь')], max_length=20, verbose_name='Вид места')),
+                ('number', models.PositiveIntegerField(verbose_name='Номер места')),
+                ('owner', models.CharField(blank=True, default='', max_length=255, verbose_name='Владелец')),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата отметки')),
+            ],
+            options={
+                'verbose_name': 'Место пула расчётов',
+                'verbose_name_plural': 'Места пула расчётов',
+                'unique_together': {('kind', 'number')},
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 from decimal import Decimal
 
+from django.conf import settings
 from django.contrib.gis.db import models as gis_models
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
@@ -253,6 +254,16 @@ class Simulation(models.Model):
         null=True,
         help_text="Дополнительное описание симуляции"
     )
+
+    # Хэш входных данных, seed, версии движка и содержимого маршрутов и остановок (GetCalculationHash)
+    input_hash = models.CharField(
+        verbose_name="Хэш входных данных",
+        max_length=64,
+        blank=True,
+        default='',
+        db_index=True,
+        help_text="По хэшу повторный расчёт тех же данных берётся из сохранённой симуляции"
+    )
     
     def __str__(self):
         return f"<Симуляция {self.pk} {self.created_at.strftime('%d.%m.%Y %H:%M')}>"
@@ -261,3 +272,186 @@ class Simulation(models.Model):
         verbose_name = 'Симуляция'
         verbose_name_plural = 'Симуляции'
         ordering = ['-created_at']
+
+
+class CalculationJob(models.Model):
+    """Задача расчёта в очереди БД, выполняется командой run_calculation_worker"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Выполнена'),
+        (STATUS_FAILED, 'Ошибка'),
+        (STATUS_CANCELLED, 'Отменена'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name="Пользователь",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='calculation_jobs'
+    )
+    status = models.CharField(
+        verbose_name="Статус",
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=STATUS_QUEUED,
+        db_index=True
+    )
+    stage = models.CharField(
+        verbose_name="Этап расчёта",
+        max_length=32,
+        default='queued'
+    )
+    progress = models.FloatField(
+        verbose_name="Доля выполнения",
+        default=0,
+        validators=[MinValueValidator(0), MaxValueValidator(1)]
+    )
+    # Данные запроса расчёта, проверяются CalculationRequestSerializer при выполнении задачи
+    request_data = models.JSONField(
+        verbose_name="Данные запроса расчёта"
+    )
+    # Ответ расчёта, если его нельзя получить из симуляции (временная шкала или ошибка)
+    result = models.JSONField(
+        verbose_name="Результат",
+        null=True,
+        blank=True
+    )
+    response_status = models.PositiveSmallIntegerField(
+        verbose_name="HTTP-статус ответа",
+        null=True,
+        blank=True
+    )
+    simulation = models.ForeignKey(
+        Simulation,
+        verbose_name="Симуляция",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='calculation_jobs'
+    )
+    error_message = models.TextField(
+        verbose_name="Сообщение об ошибке",
+        blank=True,
+        default=''
+    )
+    # Отмена выполняющейся задачи: обработчик проверяет признак во время расчёта и останавливает его
+    cancel_requested = models.BooleanField(
+        verbose_name="Запрошена отмена",
+        default=False
+    )
+    worker = models.CharField(
+        verbose_name="Обработчик",
+        max_length=255,
+        blank=True,
+        default='',
+        help_text="Хост и процесс обработчика, выполняющего задачу"
+    )
+    created_at = models.DateTimeField(
+        verbose_name="Дата создания",
+        auto_now_add=True,
+        db_index=True
+    )
+    started_at = models.DateTimeField(
+        verbose_name="Дата начала",
+        null=True,
+        blank=True
+    )
+    finished_at = models.DateTimeField(
+        verbose_name="Дата завершения",
+        null=True,
+        blank=True
+    )
+    # Обновляется при сохранении задачи и прогресса и отметкой обработчика (JobHeartbeat):
+    # по нему находятся задачи остановившихся обработчиков
+    updated_at = models.DateTimeField(
+        verbose_name="Дата обновления",
+        auto_now=True
+    )
+
+    def __str__(self):
+        return f"<Задача расчёта {self.pk} {self.get_status_display()}>"
+
+    class Meta:
+        verbose_name = 'Задача расчёта'
+        verbose_name_plural = 'Задачи расчёта'
+        ordering = ['-created_at']
+
+
+class CalculationUserState(models.Model):
+    """Синхронные расчёты пользователя во всех процессах веб-сервера (см. calculation_pool_utils)"""
+    username = models.CharField(
+        verbose_name="Пользователь",
+        max_length=150,
+        unique=True
+    )
+    # Расчёты пользователя, которые выполняются или ждут в пуле расчётов
+    active_count = models.PositiveIntegerField(
+        verbose_name="Активных расчётов",
+        default=0
+    )
+    # Номер отмены синхронных расчётов: расчёты, начатые до его увеличения, останавливаются
+    cancel_generation = models.PositiveIntegerField(
+        verbose_name="Номер отмены расчётов",
+        default=0
+    )
+    # Обновляется при каждом изменении счётчика (update задаёт его явно):
+    # давно не менявшийся счётчик остался от аварийно завершившихся процессов и сбрасывается
+    updated_at = models.DateTimeField(
+        verbose_name="Дата обновления",
+        auto_now=True
+    )
+
+    def __str__(self):
+        return f"<Расчёты пользователя {self.username}: {self.active_count}>"
+
+    class Meta:
+        verbose_name = 'Расчёты пользователя'
+        verbose_name_plural = 'Расчёты пользователей'
+
+
+class CalculationPoolSlot(models.Model):
+    """Место пула синхронных расчётов, общее для всех процессов веб-сервера (см. calculation_pool_utils)"""
+    KIND_RUNNING = 'running'
+    KIND_QUEUED = 'queued'
+    KIND_CHOICES = [
+        (KIND_RUNNING, 'Выполнение'),
+        (KIND_QUEUED, 'Очередь'),
+    ]
+
+    kind = models.CharField(
+        verbose_name="Вид места",
+        max_length=20,
+        choices=KIND_CHOICES
+    )
+    number = models.PositiveIntegerField(
+        verbose_name="Номер места"
+    )
+    # Процесс и поток веб-сервера, занявшие место, пустая строка - место свободно
+    owner = models.CharField(
+        verbose_name="Владелец",
+        max_length=255,
+        blank=True,
+        default=''
+    )
+    # Владелец отмечается, пока ждёт расчёт: место без отметки осталось от аварийно завершившегося процесса
+    heartbeat_at = models.DateTimeField(
+        verbose_name="Дата отметки",
+        null=True,
+        blank=True
+    )
+
+    def __str__(self):
+        return f"<Место пула расчётов {self.get_kind_display()} {self.number}: {self.owner or 'свободно'}>"
+
+    class Meta:
+        verbose_name = 'Место пула расчётов'
+        verbose_name_plural = 'Места пула расчётов'
+        unique_together = ('kind', 'number')
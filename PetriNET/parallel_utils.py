@@ -0,0 +1,134 @@
+"""
+Выполнение независимых расчётов в пуле процессов.
+
+Общие данные (снимок сети и пассажиропоток) сериализуются один раз и распаковываются
+в каждом процессе при его запуске, задачи передают только свои параметры.
+Общая память (multiprocessing.RawArray: счётчики задач для текущего процесса) и флаг снятия задач
+передаются процессам при запуске: если on_wait текущего процесса выбросил исключение (например, расчёт отменён),
+задачи в очереди снимаются, а выполняющиеся останавливаются в check_worker_cancelled.
+Модуль не импортирует модели: при запуске процессов через spawn (Windows) Django
+настраивается в init_worker до распаковки общих данных
+"""
+from __future__ import annotations
+
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from typing import Any, Callable, Iterable
+
+# Как часто текущий процесс вызывает on_wait, пока задачи выполняются в пуле (секунд)
+POOL_WAIT_INTERVAL = 0.5
+
+# Общие данные, общая память и флаг снятия задач текущего процесса (заполняются init_worker)
+worker_data: Any = None
+worker_shared_memory: Any = None
+worker_cancel_flag: Any = None
+# on_wait задач, которые выполняются в текущем процессе без пула
+worker_on_wait: Callable[[], None] | None = None
+
+
+class TaskCancelled(Exception):
+    """Задача пула остановлена: процесс, запустивший пул, снял задачи"""
+
+
+def GetWorkersCount(tasks_count: int, max_workers: int | None = None) -> int:
+    """Количество процессов: не больше задач и ядер (или max_workers)"""
+    return max(min(tasks_count, max_workers or os.cpu_count() or 1), 1)
+
+
+def init_django() -> None:
+    """Настройка Django в процессе пула, запущенном через spawn"""
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'TransportMap.settings')
+        django.setup()
+
+
+def init_worker(shared_data: bytes, shared_memory: Any = None, cancel_flag: Any = None) -> None:
+    """Инициализация процесса пула: настройка Django, распаковка общих данных, общая память и флаг снятия задач"""
+    global worker_data, worker_shared_memory, worker_cancel_flag
+    init_django()
+    worker_data = pickle.loads(shared_data)
+    worker_shared_memory = shared_memory
+    worker_cancel_flag = cancel_flag
+
+
+def get_worker_data() -> Any:
+    """Общие данные задач, переданные в RunInProcessPool"""
+    return worker_data
+
+
+def get_worker_shared_memory() -> Any:
+    """Общая память задач, переданная в RunInProcessPool"""
+    return worker_shared_memory
+
+
+def check_worker_cancelled() -> None:
+    """
+    Вызывается задачей периодически: TaskCancelled, если задачи пула сняты.
+    Задачи без пула вместо флага вызывают on_wait, который сам выбрасывает исключение
+    """
+    if worker_cancel_flag is not None and worker_cancel_flag.value:
+        raise TaskCancelled('Задачи пула сняты')
+    if worker_on_wait is not None:
+        worker_on_wait()
+
+
+def RunInProcessPool(function: Callable[[Any], Any], shared_data: Any, tasks: Iterable[Any],
+                     max_workers: int | None = None, shared_memory: Any = None,
+                     on_wait: Callable[[], None] | None = None) -> list[Any]:
+    """
+    Выполняет function(task) для каждой задачи и возвращает результаты в порядке задач.
+    function должна быть функцией уровня модуля и получать общие данные через get_worker_data(),
+    общую память - через get_worker_shared_memory().
+    on_wait вызывается в текущем процессе каждые POOL_WAIT_INTERVAL секунд, пока задачи выполняются
+    (например, чтобы прочитать счётчики задач из общей памяти). Исключение on_wait снимает задачи в очереди
+    и останавливает выполняющиеся (флаг проверяет check_worker_cancelled), затем передаётся вызывающему.
+    При одном процессе задачи выполняются в текущем процессе без пула, on_wait - после каждой задачи
+    и из check_worker_cancelled
+    """
+    global worker_data, worker_shared_memory, worker_on_wait
+    tasks = list(tasks)
+    if not tasks:
+        return []
+    workers_count = GetWorkersCount(len(tasks), max_workers)
+    if workers_count == 1:
+        previous_data, worker_data = worker_data, shared_data
+        previous_shared_memory, worker_shared_memory = worker_shared_memory, shared_memory
+        previous_on_wait = worker_on_wait
+        if previous_on_wait is not None and on_wait is not None:
+            # Пул без процессов внутри задачи такого же пула: проверяется и отмена внешних задач
+            def chained_on_wait() -> None:
+                previous_on_wait()
+                on_wait()
+            worker_on_wait = chained_on_wait
+        else:
+            worker_on_wait = previous_on_wait or on_wait
+        try:
+            results = []
+            for task in tasks:
+                results.append(function(task))
+                if on_wait is not None:
+                    on_wait()
+            return results
+        finally:
+            worker_data = previous_data
+            worker_shared_memory = previous_shared_memory
+            worker_on_wait = previous_on_wait
+    cancel_flag = multiprocessing.RawValue('b', 0)
+    with ProcessPoolExecutor(max_workers=workers_count, initializer=init_worker,
+                             initargs=(pickle.dumps(shared_data, protocol=pickle.HIGHEST_PROTOCOL),
+                                       shared_memory, cancel_flag)) as executor:
+        futures = [executor.submit(function, task) for task in tasks]
+        if on_wait is not None:
+            try:
+                while wait(futures, timeout=POOL_WAIT_INTERVAL, return_when=FIRST_EXCEPTION).not_done:
+                    on_wait()
+            except BaseException:
+                cancel_flag.value = 1
+                # Ожидание завершения: выполняющиеся задачи останавливаются по флагу за несколько событий расчёта
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+        return [future.result() for future in futures]
@@ -0,0 +1,261 @@
+"""
+Расчёт сети по независимым частям.
+
+Маршруты без общих остановок друг на друга не влияют: пассажиры садятся только на своей остановке,
+а автобусы разных маршрутов встречаются только на общих остановках. Сеть делится на связные
+компоненты (маршруты, связанные общими остановками), компоненты считаются параллельно в пуле
+процессов, их статистика и временные шкалы объединяются в ответ того же вида, что у PetriNet
+"""
+from __future__ import annotations
+
+import hashlib
+import heapq
+import multiprocessing
+from time import perf_counter
+
+from .mesoscopic_utils import MesoscopicNet
+from .parallel_utils import RunInProcessPool, check_worker_cancelled, get_worker_data, get_worker_shared_memory
+from .petri_net_utils import (CALCULATION_ENGINE_DISCRETE, CALCULATION_ENGINE_MESOSCOPIC, TIMELINE_FORMAT_DELTA,
+                              TIMELINE_FORMAT_FULL, PetriNet)
+
+# Как часто расчёт в задаче пула проверяет, не сняты ли задачи (событий расчёта)
+TASK_CANCEL_CHECK_EVENTS = 100
+
+
+def GetNetworkComponents(network: PetriNet.NetworkSnapshot) -> list[list[int]]:
+    """Связные компоненты маршрутов расчёта по общим остановкам (id маршрутов в порядке снимка сети)"""
+    parents = {route_id: route_id for route_id in network.routes}
+
+    def find(route_id: int) -> int:
+        while parents[route_id] != route_id:
+            parents[route_id] = parents[parents[route_id]]
+            route_id = parents[route_id]
+        return route_id
+
+    bus_stops_route: dict[int, int] = {}
+    for route in network.routes.values():
+        for bus_stop_id in route.bus_stop_ids:
+            other_route_id = bus_stops_route.setdefault(bus_stop_id, route.id)
+            parents[find(route.id)] = find(other_route_id)
+
+    components: dict[int, list[int]] = {}
+    for route_id in network.routes:
+        components.setdefault(find(route_id), []).append(route_id)
+    return list(components.values())
+
+
+def GetCalculationParts(data_to_calculate: dict) -> list[list[int]]:
+    """
+    Части расчёта - компоненты сети, в которых есть и автобусы, и пассажиры.
+    Компоненты без автобусов или без пассажиров присоединяются к первой части:
+    их маршруты и остановки попадают в отчёт, а отдельный расчёт для них невозможен
+    """
+    network = data_to_calculate['network']
+    bus_stops_with_passengers = {busstops_direction['busstop']
+                                 for busstops_direction in data_to_calculate['busstops_directions']}
+    parts, idle_route_ids = [], []
+    for component in GetNetworkComponents(network):
+        routes = [network.routes[route_id] for route_id in component]
+        has_buses = any(route.amount and route.capacity for route in routes)
+        has_passengers = any(bus_stop_id in bus_stops_with_passengers
+                             for route in routes for bus_stop_id in route.bus_stop_ids)
+        if has_buses and has_passengers:
+            parts.append(component)
+        else:
+            idle_route_ids.extend(component)
+    if not parts:
+        return [list(network.routes)]
+    parts[0].extend(idle_route_ids)
+    return parts
+
+
+def SplitCalculationData(data_to_calculate: dict, route_ids: list[int]) -> dict:
+    """Данные расчёта части сети: маршруты части, их остановки и пассажиры этих остановок"""
+    network = data_to_calculate['network']
+    route_ids = set(route_ids)
+    routes = {route_id: route for route_id, route in network.routes.items() if route_id in route_ids}
+    bus_stop_ids = {bus_stop_id for route in routes.values() for bus_stop_id in route.bus_stop_ids}
+    return {
+        'city_id': data_to_calculate['city_id'],
+        # Связи остановок со всеми маршрутами БД общие: от них зависят допустимые направления пассажиров
+        'network': PetriNet.NetworkSnapshot(
+            network.city_id, network.city_name, routes,
+            {bus_stop_id: bus_stop for bus_stop_id, bus_stop in network.bus_stops.items()
+             if bus_stop_id in bus_stop_ids},
+            network.routes_bus_stop_ids,
+        ),
+        'busstops_directions': [busstops_direction for busstops_direction in data_to_calculate['busstops_directions']
+                                if busstops_direction['busstop'] in bus_stop_ids],
+    }
+
+
+def get_part_seed(seed: int | None, route_ids: list[int]) -> int | None:
+    """Seed части: зависит от seed расчёта и маршрутов части, но не от количества процессов"""
+    if seed is None:
+        return None
+    return int(hashlib.sha256(f'{seed}:{min(route_ids)}'.encode()).hexdigest()[:16], 16)
+
+
+def merge_timelines(timelines: list[list], timeline_format: str) -> list:
+    """
+    Объединяет временные шкалы частей по времени (при равном времени - в порядке частей).
+    В формате full каждый шаг содержит остановки с пассажирами всех частей,
+    в формате delta шаги перенумеровываются в общем порядке
+    """
+    steps = heapq.merge(*[[(step[0], part_number, step) for step in timeline]
+                          for part_number, timeline in enumerate(timelines)], key=lambda step: step[0])
+    if timeline_format == TIMELINE_FORMAT_DELTA:
+        return [(seconds_from_start, step[1], step_number)
+                for step_number, (seconds_from_start, _, step) in enumerate(steps)]
+    # Остановки с пассажирами каждой части на текущий момент, изначально - по первому шагу части
+    bus_stops_now = [timeline[0][1]['BusStops'] if timeline else [] for timeline in timelines]
+    merged = []
+    for seconds_from_start, part_number, step in steps:
+        bus_stops_now[part_number] = step[1]['BusStops']
+        merged.append((seconds_from_start, {**step[1], 'BusStops': [bus_stop for bus_stops in bus_stops_now
+                                                                    for bus_stop in bus_stops]}))
+    return merged
+
+
+class PoolTaskObserver(PetriNet.StatsCollector):
+    """
+    Счётчики расчёта в задаче RunInProcessPool: количество севших пассажиров задачи пишется в общую память,
+    каждые TASK_CANCEL_CHECK_EVENTS событий проверяется, не сняты ли задачи пула (check_worker_cancelled)
+    """
+    def __init__(self, task_number: int, boarded_counts) -> None:
+        super().__init__()
+        self.task_number = task_number
+        self.boarded_counts = boarded_counts
+
+    def on_event(self, seconds_from_start: int, buses_count: int, queue_depth: int) -> None:
+        super().on_event(seconds_from_start, buses_count, queue_depth)
+        if not self.events_count % TASK_CANCEL_CHECK_EVENTS:
+            check_worker_cancelled()
+
+    def on_boarding(self, passengers_count: int) -> None:
+        super().on_boarding(passengers_count)
+        self.boarded_counts[self.task_number] = self.boarded_passengers_count
+
+    def on_parts_progress(self, boarded_passengers_count: int) -> None:
+        # Задача считает сеть по частям (репликация): количество севших пассажиров передают части
+        self.boarded_counts[self.task_number] = boarded_passengers_count
+
+    def __getstate__(self) -> dict:
+        # Общая память передаётся процессам только при запуске, в результат задачи попадают только счётчики
+        return {**self.__dict__, 'boarded_counts': None}
+
+
+def run_calculation_part(part_number: int) -> dict:
+    """Расчёт части сети в процессе пула: статистика для отчёта, временная шкала и счётчики"""
+    # Задача могла дождаться процесса уже после снятия задач пула
+    check_worker_cancelled()
+    calculation_data = get_worker_data()
+    route_ids = calculation_data['parts'][part_number]
+    boarded_counts = get_worker_shared_memory()
+    if boarded_counts is not None:
+        stats_collector = PoolTaskObserver(part_number, boarded_counts)
+    elif calculation_data['collect_stats']:
+        stats_collector = PetriNet.StatsCollector()
+    else:
+        stats_collector = None
+    petri_net = PetriNet(SplitCalculationData(calculation_data['data_to_calculate'], route_ids),
+                         calculation_data['timeline_format'], record_timeline=calculation_data['record_timeline'],
+                         observer=stats_collector, seed=get_part_seed(calculation_data['seed'], route_ids))
+    petri_net.Calculation()
+    return {
+        'statistics': petri_net.get_statistics(),
+        'data_to_response': petri_net.timeline.data_to_response,
+        'stats_collector': stats_collector if calculation_data['collect_stats'] else None,
+    }
+
+
+class PartitionedPetriNet():
+    """
+    Расчёт независимых частей сети в пуле процессов с тем же интерфейсом, что у PetriNet:
+    Calculation, CreateDataToReport, combining_steps и timeline.get_delta_response.
+
+    Счётчики частей объединяются, если наблюдатель - PetriNet.StatsCollector,
+    другие наблюдатели получают только начало и конец расчёта и время отчёта.
+    Пока части считаются, наблюдатель получает количество севших пассажиров всех частей (on_parts_progress);
+    исключение из on_parts_progress (например, отмена расчёта) останавливает процессы частей
+    """
+    def __init__(self, data_to_calculate: dict, parts: list[list[int]],
+                 timeline_format: str = TIMELINE_FORMAT_FULL, record_timeline: bool = True,
+                 observer: PetriNet.Observer | None = None, seed: int | None = None,
+                 max_workers: int | None = None) -> None:
+        self.data_to_calculate = data_to_calculate
+        self.network: PetriNet.NetworkSnapshot = data_to_calculate['network']
+        self.routes = list(self.network.routes.values())
+        self.parts = parts
+        self.timeline_format = timeline_format
+        self.record_timeline = record_timeline
+        self.observer = observer
+        self.seed = seed
+        self.max_workers = max_workers
+        # Объединённая временная шкала частей
+        self.timeline = PetriNet.TimeLine({}, timeline_format, record_timeline)
+        self.statistics: dict | None = None
+
+    def Calculation(self) -> list:
+        """Расчёт частей в пуле процессов и объединение результатов"""
+        observer = self.observer
+        if observer is not None:
+            observer.on_calculation_start()
+        calculation_data = {
+            'data_to_calculate': self.data_to_calculate,
+            'parts': self.parts,
+            'timeline_format': self.timeline_format,
+            'record_timeline': self.record_timeline,
+            'collect_stats': isinstance(observer, PetriNet.StatsCollector),
+            'seed': self.seed,
+        }
+        if observer is not None:
+            # Процессы частей пишут количество севших пассажиров в общую память, текущий процесс передаёт их сумму
+            boarded_counts = multiprocessing.RawArray('q', len(self.parts))
+            results = RunInProcessPool(run_calculation_part, calculation_data, range(len(self.parts)),
+                                       self.max_workers, shared_memory=boarded_counts,
+                                       on_wait=lambda: observer.on_parts_progress(sum(boarded_counts)))
+        else:
+            results = RunInProcessPool(run_calculation_part, calculation_data, range(len(self.parts)),
+                                       self.max_workers)
+        self.statistics = PetriNet.merge_statistics([result['statistics'] for result in results])
+        if self.record_timeline:
+            self.timeline.data_to_response = merge_timelines([result['data_to_response'] for result in results],
+                                                             self.timeline_format)
+        if observer is not None:
+            for result in results:
+                if result['stats_collector'] is not None:
+                    observer.merge(result['stats_collector'])
+            observer.on_calculation_end()
+        return self.timeline.data_to_response
+
+    def CreateDataToReport(self) -> dict:
+        """Собирает данные для отчёта по объединённой статистике частей"""
+        if self.observer is not None:
+            phase_start = perf_counter()
+        data_to_report = PetriNet.get_data_to_report(self.network, self.statistics)
+        if self.observer is not None:
+            self.observer.on_phase('report', perf_counter() - phase_start)
+        return data_to_report
+
+    def combining_steps(self) -> list:
+        """Объединение шагов временной шкалы, как в PetriNet.combining_steps"""
+        return PetriNet.combining_steps(self)
+
+
+def CreatePetriNet(data_to_calculate: dict, timeline_format: str = TIMELINE_FORMAT_FULL,
+                   record_timeline: bool = True, observer: PetriNet.Observer | None = None,
+                   seed: int | None = None, max_workers: int | None = None,
+                   engine: str = CALCULATION_ENGINE_DISCRETE) -> PetriNet | PartitionedPetriNet | MesoscopicNet:
+    """
+    Расчёт сети: по независимым частям, если их несколько, иначе обычный PetriNet.
+    Мезоскопический движок считает всю сеть сразу и без временной шкалы
+    """
+    if engine == CALCULATION_ENGINE_MESOSCOPIC:
+        return MesoscopicNet(data_to_calculate, timeline_format, observer=observer, seed=seed)
+    parts = GetCalculationParts(data_to_calculate)
+    if len(parts) == 1:
+        return PetriNet(data_to_calculate, timeline_format, record_timeline=record_timeline,
+                        observer=observer, seed=seed)
+    return PartitionedPetriNet(data_to_calculate, parts, timeline_format, record_timeline=record_timeline,
+                               observer=observer, seed=seed, max_workers=max_workers)
@@ -1,10 +1,18 @@
 from __future__ import annotations
 
 import datetime
+import hashlib
+import heapq
+import json
 import logging
+import math
 import os
 import random
-from decimal import Decimal
+from array import array
+from collections import deque
+from itertools import accumulate
+from time import perf_counter
+from typing import TYPE_CHECKING
 
 from faker import Faker
 from geopy import distance
@@ -12,27 +20,49 @@ from openpyxl import Workbook
 from openpyxl.styles import Alignment, Border, Font, Side
 from openpyxl.utils import get_column_letter
 
-from .models import BusStop, City, Route
+if TYPE_CHECKING:
+    from .models import Route
 
 logger = logging.getLogger('PetriNetManager')
 
 fake = Faker("ru_RU")
 
 MAX_PASSENGERS_COUNT_FOR_RESPONSE = 10
+# Версия движка расчёта: повышается при любом изменении результатов расчёта, входит в ключ кэша результатов
+ENGINE_VERSION = '3'
+# Допустимое отклонение координат точки маршрута от координат остановки (градусов)
+ROUTE_POINT_TOLERANCE = 0.0001
+
+# Форматы временной шкалы в ответе: полный снимок остановок на каждом шаге или только изменения
+TIMELINE_FORMAT_FULL = 'full'
+TIMELINE_FORMAT_DELTA = 'delta'
+TIMELINE_FORMATS = (TIMELINE_FORMAT_FULL, TIMELINE_FORMAT_DELTA)
+# Через сколько шагов в формате delta повторяется полный снимок для перемотки
+TIMELINE_KEYFRAME_INTERVAL = 100
+# Движки расчёта: пошаговый по отдельным пассажирам (PetriNet) или мезоскопический по количествам пассажиров
+CALCULATION_ENGINE_DISCRETE = 'discrete'
+CALCULATION_ENGINE_MESOSCOPIC = 'mesoscopic'
+CALCULATION_ENGINES = (CALCULATION_ENGINE_DISCRETE, CALCULATION_ENGINE_MESOSCOPIC)
+# Перцентили времени ожидания и поездки пассажиров в отчёте
+REPORT_PERCENTILES = (50, 90, 99)
 
 
 def GetDataToCalculate(request_data_to_calculate: dict) -> dict:
+    # Модели импортируются здесь: движок и снимки сети используются без Django/GIS (бенчмарк, тесты, дочерние процессы)
+    from .models import BusStop, Route
+
     city_id = int(request_data_to_calculate['city_id'])
     DataToCalculate = {
         'city_id': city_id
     }
 
-    # Получения маршрутов из бд
+    # Получения маршрутов из бд одним запросом
     routes = []
     invalid_routes = []  # Маршруты с ошибками
+    routes_by_id = Route.objects.filter(city_id=city_id).select_related('tc').in_bulk(
+        [request_route['id'] for request_route in request_data_to_calculate['routes']])
     for request_route in request_data_to_calculate['routes']:
-        route = Route.objects.filter(city_id=city_id,
-                                     id=request_route['id']).prefetch_related('busstop').first()
+        route = routes_by_id.get(request_route['id'])
         if route:
             # Проверка корректности маршрута
             errors = []
@@ -65,16 +95,21 @@ def GetDataToCalculate(request_data_to_calculate: dict) -> dict:
             error_msg += ". Ошибки: " + "; ".join(invalid_routes)
         raise Exception(error_msg)
     
-    DataToCalculate['routes'] = routes
+
+    # Снимок сети с картой достижимости остановок строится фиксированным числом запросов,
+    # дальше проверка направлений идёт в памяти
+    network = PetriNet.NetworkSnapshot.from_routes(city_id, routes)
 
     # Получение остановок и путей пассажиров
     busstops_directions = []
-    busstops = BusStop.objects.filter(
+    busstops = set(BusStop.objects.filter(
         city_id=city_id,
-        route__id__in=[route.id for route in routes]
-    ).prefetch_related('route_set').distinct()
+        id__in=network.bus_stops.keys()
+    ).values_list('id', flat=True))
 
-    for busstop in busstops:
+    for busstop in network.bus_stops.values():
+        if busstop.id not in busstops:
+            continue
         try:
             BSAddItem = {
                 "busstop": busstop.id,
@@ -85,8 +120,7 @@ def GetDataToCalculate(request_data_to_calculate: dict) -> dict:
                     # 0:12  # 12 человек поедут рандомно
                 }
             }
-            valid_bus_stops = BusStop.objects.filter(
-                route__id__in=busstop.get_routes_ids()).values_list('id', flat=True).distinct()  # Пока делаем без пересадок
+            valid_bus_stops = set(network.get_reachable_bus_stop_ids(busstop.id))  # Пока делаем без пересадок
             busstop_from_request = request_data_to_calculate['busstops'].pop(str(busstop.id), None)
             if busstop_from_request:
                 PassengersWithoutDirection = int(busstop_from_request.get('passengers_without_direction', 0))
@@ -97,7 +131,7 @@ def GetDataToCalculate(request_data_to_calculate: dict) -> dict:
                 for direction in busstop_from_request['directions']:
                     BusStopID = int(direction.get('busstop_id', 0))
                     PassengersCount = int(direction.get('passengers_count', 0))
-                    if BusStopID and PassengersCount and busstops.filter(id=BusStopID).exists() and \
+                    if BusStopID and PassengersCount and BusStopID in busstops and \
                        BusStopID != busstop.id and BusStopID in valid_bus_stops:
                         BSAddItem['directions'].update({
                             BusStopID: PassengersCount
@@ -111,12 +145,37 @@ def GetDataToCalculate(request_data_to_calculate: dict) -> dict:
 
     if not busstops_directions:
         raise Exception("Отсутствуют остановки")
-    DataToCalculate['busstops'] = busstops
+    DataToCalculate['network'] = network
     DataToCalculate['busstops_directions'] = busstops_directions
 
     return DataToCalculate
 
 
+def GetCalculationHash(data_to_calculate: dict, seed: int | None, replications: int = 1,
+                       engine: str = CALCULATION_ENGINE_DISCRETE) -> str:
+    """
+    Ключ результата расчёта: хэш нормализованных направлений пассажиров, seed, количества репликаций,
+    движка и его версии и содержимого маршрутов и остановок (снимка сети).
+    Отчёт не зависит от формата временной шкалы, поэтому он в ключ не входит
+    """
+    content = {
+        'engine_version': ENGINE_VERSION,
+        'engine': engine,
+        'seed': seed,
+        'replications': replications,
+        'network': data_to_calculate['network'].get_fingerprint(),
+        # Порядок остановок задаётся снимком сети, порядок направлений на остановке не важен (см. init_action)
+        'busstops_directions': [[busstops_direction['busstop'], sorted(busstops_direction['directions'].items())]
+                                for busstops_direction in data_to_calculate['busstops_directions']],
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_report_minutes(seconds: int) -> float:
+    """Время в минутах для отчёта: максимумы и перцентили округляются одинаково"""
+    return round(seconds / 60, 1)
+
+
 def get_travel_time(latitude_start: float, longitude_start: float,
                   latitude_end: float, longitude_end: float, distance_km: int) -> int:
     # Написать функцию получения времени, за которое автобус проедет расстояние между остановками в секундах
@@ -132,76 +191,474 @@ def get_travel_range(latitude_start: float, longitude_start: float,
 class PetriNet():
     passenger_time = 4  # Время входа или выхода пассажира (секунд)
 
+    class RouteData():
+        """Маршрут расчёта без привязки к БД"""
+        def __init__(self, id: int, name: str, tc_name: str | None, capacity: int, interval: int, amount: int,
+                     list_coord: list, bus_stop_ids: tuple[int, ...]) -> None:
+            self.id = id
+            self.name = name
+            # Тип ТС и его вместимость
+            self.tc_name = tc_name
+            self.capacity = capacity
+            # Интервал движения в минутах и кол-во автобусов
+            self.interval = interval
+            self.amount = amount
+            # Координаты пути [[широта, долгота], ...]
+            self.list_coord = list_coord
+            # Остановки маршрута в порядке связи в БД
+            self.bus_stop_ids = bus_stop_ids
+
+    class BusStopData():
+        """Остановка расчёта без привязки к БД"""
+        def __init__(self, id: int, name: str, latitude: float, longitude: float,
+                     route_ids: tuple[int, ...]) -> None:
+            self.id = id
+            self.name = name
+            self.latitude = latitude
+            self.longitude = longitude
+            # Все маршруты из БД, проходящие через остановку (не только маршруты расчёта)
+            self.route_ids = route_ids
+
+    class NetworkSnapshot():
+        """
+        Снимок транспортной сети для расчёта: маршруты и остановки в виде простых данных.
+        Строится фиксированным числом запросов, после этого расчёт не обращается к БД,
+        а снимок можно дёшево передать в другой процесс
+        """
+        def __init__(self, city_id: int, city_name: str, routes: dict[int, PetriNet.RouteData],
+                     bus_stops: dict[int, PetriNet.BusStopData],
+                     routes_bus_stop_ids: dict[int, tuple[int, ...]]) -> None:
+            self.city_id = city_id
+            self.city_name = city_name
+            # Маршруты расчёта в порядке запроса
+            self.routes = routes
+            # Остановки маршрутов расчёта
+            self.bus_stops = bus_stops
+            # Любой маршрут из БД -> его остановки из числа остановок расчёта
+            self.routes_bus_stop_ids = routes_bus_stop_ids
+
+        @classmethod
+        def from_routes(cls, city_id: int, routes: list[Route]) -> PetriNet.NetworkSnapshot:
+            """Строит снимок по маршрутам из БД (с подгруженным tc) за 4 запроса"""
+            from .models import BusStop, City, Route
+
+            RouteBusStop = Route.busstop.through
+            city_name = City.objects.filter(id=city_id).values_list('name', flat=True).first() or ''
+            route_bus_stop_ids: dict[int, list[int]] = {route.id: [] for route in routes}
+            for route_id, bus_stop_id in RouteBusStop.objects.filter(
+                    route_id__in=route_bus_stop_ids.keys()).order_by('id').values_list('route_id', 'busstop_id'):
+                route_bus_stop_ids[route_id].append(bus_stop_id)
+            bus_stop_ids = {bus_stop_id for ids in route_bus_stop_ids.values() for bus_stop_id in ids}
+            # Связи остановок расчёта со всеми маршрутами БД, в том числе не участвующими в расчёте
+            bus_stops_route_ids: dict[int, list[int]] = {bus_stop_id: [] for bus_stop_id in bus_stop_ids}
+            routes_bus_stop_ids: dict[int, list[int]] = {}
+            for route_id, bus_stop_id in RouteBusStop.objects.filter(
+                    busstop_id__in=bus_stop_ids).order_by('busstop_id', 'route_id').values_list('route_id',
+                                                                                                'busstop_id'):
+                bus_stops_route_ids[bus_stop_id].append(route_id)
+                routes_bus_stop_ids.setdefault(route_id, []).append(bus_stop_id)
+            bus_stops = {
+                bus_stop['id']: PetriNet.BusStopData(bus_stop['id'], bus_stop['name'],
+                                                     float(bus_stop['latitude']), float(bus_stop['longitude']),
+                                                     tuple(bus_stops_route_ids[bus_stop['id']]))
+                for bus_stop in BusStop.objects.filter(id__in=bus_stop_ids).order_by('id').values(
+                    'id', 'name', 'latitude', 'longitude')
+            }
+            return cls(
+                city_id=city_id,
+                city_name=city_name,
+                routes={
+                    route.id: PetriNet.RouteData(
+                        id=route.id,
+                        name=route.name,
+                        tc_name=route.tc.name if route.tc else None,
+                        capacity=route.tc.capacity if route.tc else 0,
+                        interval=route.interval,
+                        amount=route.amount,
+                        list_coord=route.list_coord,
+                        bus_stop_ids=tuple(route_bus_stop_ids[route.id]),
+                    ) for route in routes
+                },
+                bus_stops=bus_stops,
+                routes_bus_stop_ids={route_id: tuple(ids) for route_id, ids in routes_bus_stop_ids.items()},
+            )
+
+        def get_fingerprint(self) -> str:
+            """Хэш содержимого снимка, меняется при любом изменении маршрутов и остановок расчёта"""
+            content = {
+                'city': [self.city_id, self.city_name],
+                # Порядок маршрутов влияет на расчёт (порядок выхода автобусов), поэтому не сортируется
+                'routes': [[route.id, route.name, route.tc_name, route.capacity, route.interval, route.amount,
+                            route.list_coord, route.bus_stop_ids] for route in self.routes.values()],
+                'bus_stops': [[bus_stop.id, bus_stop.name, bus_stop.latitude, bus_stop.longitude, bus_stop.route_ids]
+                              for bus_stop in self.bus_stops.values()],
+                'routes_bus_stop_ids': sorted(self.routes_bus_stop_ids.items()),
+            }
+            return hashlib.sha256(json.dumps(content, default=str).encode()).hexdigest()
+
+        def get_reachable_bus_stop_ids(self, bus_stop_id: int) -> list[int]:
+            """Остановки расчёта, до которых можно доехать с остановки без пересадок (по возрастанию id)"""
+            reachable = set()
+            for route_id in self.bus_stops[bus_stop_id].route_ids:
+                reachable.update(self.routes_bus_stop_ids.get(route_id, ()))
+            reachable.discard(bus_stop_id)
+            return sorted(reachable)
+
+    class BusStopsGrid():
+        """Хеш-сетка остановок маршрута для поиска остановки, соответствующей точке маршрута"""
+        def __init__(self, bus_stops, cell_size: float = ROUTE_POINT_TOLERANCE) -> None:
+            self.cell_size = cell_size
+            # Точные координаты -> id первой остановки с такими координатами
+            self.exact: dict[tuple[float, float], int] = {}
+            # Ячейка сетки -> остановки (порядковый номер, id, широта, долгота)
+            self.cells: dict[tuple[int, int], list[tuple[int, int, float, float]]] = {}
+            for order, bs in enumerate(bus_stops):
+                lat, lon = float(bs.latitude), float(bs.longitude)
+                self.exact.setdefault((lat, lon), bs.id)
+                self.cells.setdefault(self.get_cell(lat, lon), []).append((order, bs.id, lat, lon))
+
+        def get_cell(self, lat: float, lon: float) -> tuple[int, int]:
+            return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+        def find(self, lat: float, lon: float) -> int:
+            """id остановки в точке или ближайшей в пределах cell_size по каждой координате, 0 - не найдена"""
+            # Сначала пробуем точное совпадение
+            bus_stop_id = self.exact.get((lat, lon))
+            if bus_stop_id is not None:
+                return bus_stop_id
+            # Остановки в пределах допуска могут быть только в соседних ячейках
+            cell_lat, cell_lon = self.get_cell(lat, lon)
+            nearby_stops = []
+            for delta_lat in (-1, 0, 1):
+                for delta_lon in (-1, 0, 1):
+                    for stop in self.cells.get((cell_lat + delta_lat, cell_lon + delta_lon), ()):
+                        if (lat - self.cell_size <= stop[2] <= lat + self.cell_size and
+                                lon - self.cell_size <= stop[3] <= lon + self.cell_size):
+                            nearby_stops.append(stop)
+            if not nearby_stops:
+                return 0
+            if len(nearby_stops) == 1:
+                return nearby_stops[0][1]
+            # Если найдено несколько остановок, выбираем ближайшую (при равенстве - первую в списке маршрута)
+            nearby_stops.sort()
+            return min(nearby_stops, key=lambda stop: get_travel_range(lat, lon, stop[2], stop[3]))[1]
+
+    class RouteIndex():
+        """
+        Индекс маршрута в прямом и обратном направлении: позиции остановок,
+        расстояния и время в пути между соседними остановками
+        """
+        def __init__(self, route_points: list[dict]) -> None:
+            bus_stop_ids = [point['bus_stop_id'] for point in route_points]
+            # Последовательности id остановок: 0 - прямое направление, 1 - обратное
+            self.sequences = (tuple(bus_stop_ids), tuple(reversed(bus_stop_ids)))
+            # Для каждого направления: id остановки -> возрастающие позиции (остановка может повторяться)
+            self.positions: tuple[dict[int, tuple[int, ...]], ...] = tuple(
+                self.get_positions(sequence) for sequence in self.sequences)
+            # Для каждого направления: id остановки -> последняя позиция, для проверки за O(1)
+            self.last_positions: tuple[dict[int, int], ...] = tuple(
+                {bus_stop_id: positions[-1] for bus_stop_id, positions in direction_positions.items()}
+                for direction_positions in self.positions)
+            # Расстояния (км) и время в пути между соседними остановками, считаются один раз на маршрут
+            segment_distances = []
+            segment_travel_times = []
+            for start, end in zip(route_points, route_points[1:]):
+                distance_km = get_travel_range(start["latitude"], start["longitude"],
+                                               end["latitude"], end["longitude"])
+                segment_distances.append(distance_km)
+                segment_travel_times.append(get_travel_time(start["latitude"], start["longitude"],
+                                                            end["latitude"], end["longitude"], distance_km))
+            # Для каждого направления: расстояние и время в пути от позиции i до позиции i + 1
+            self.segment_distances = (tuple(segment_distances), tuple(reversed(segment_distances)))
+            self.segment_travel_times = (tuple(segment_travel_times), tuple(reversed(segment_travel_times)))
+            # Для каждого направления: расстояние и время в пути от начала направления до позиции i
+            self.cumulative_distances = tuple(
+                tuple(accumulate(distances, initial=0)) for distances in self.segment_distances)
+            self.cumulative_travel_times = tuple(
+                tuple(accumulate(travel_times, initial=0)) for travel_times in self.segment_travel_times)
+            # Протяжённость маршрута в км
+            self.route_length = self.cumulative_distances[0][-1]
+            # Точки маршрута с привязанными остановками: 0 - прямое направление, 1 - обратное.
+            # Общие для всех автобусов маршрута и не изменяются во время расчёта
+            self.route_points = (tuple(route_points), tuple(reversed(route_points)))
+            # Позиция конечной остановки в любом направлении
+            self.last_position = len(route_points) - 1
+            # Остановки на концах маршрута, на них автобусы проверяют интервал отправления
+            self.terminal_bus_stop_ids = frozenset((bus_stop_ids[0], bus_stop_ids[-1]))
+
+        @classmethod
+        def from_route(cls, route: PetriNet.RouteData,
+                       bus_stops: dict[int, PetriNet.BusStopData]) -> PetriNet.RouteIndex:
+            """Строит индекс маршрута, сопоставляя точки маршрута с его остановками"""
+            bus_stops_grid = PetriNet.BusStopsGrid([bus_stops[bus_stop_id] for bus_stop_id in route.bus_stop_ids])
+            route_points = []
+            for point in route.list_coord:
+                lat, lon = point[0], point[1]
+                bus_stop_id = bus_stops_grid.find(lat, lon)
+                if bus_stop_id == 0:
+                    raise Exception(f"Не удалось найти остановку для точки маршрута: {point}, {route.id}. "
+                                    f"Переформируйте маршрут.")
+                route_points.append({
+                    "bus_stop_id": bus_stop_id,
+                    "latitude": lat,
+                    "longitude": lon,
+                })
+            return cls(route_points)
+
+        @staticmethod
+        def get_positions(sequence: tuple[int, ...]) -> dict[int, tuple[int, ...]]:
+            positions = {}
+            for position, bus_stop_id in enumerate(sequence):
+                positions.setdefault(bus_stop_id, []).append(position)
+            return {bus_stop_id: tuple(items) for bus_stop_id, items in positions.items()}
+
+        def is_ahead(self, direction: int, position: int, bus_stop_id: int) -> bool:
+            """Проверяет, что остановка есть на пути от позиции position до конечной"""
+            return self.last_positions[direction].get(bus_stop_id, -1) >= position
+
+        def get_travel_time_between(self, direction: int, start_position: int, end_position: int) -> int:
+            """Время в пути между позициями одного направления"""
+            travel_times = self.cumulative_travel_times[direction]
+            return travel_times[end_position] - travel_times[start_position]
+
+        def get_route_count(self, direction: int, position: int, bus_stop_id: int) -> int:
+            """Кол-во остановок от позиции position до ближайшего вхождения остановки"""
+            for end_position in self.positions[direction].get(bus_stop_id, ()):
+                if end_position > position:
+                    return end_position - position
+            raise Exception("Неправильное получение длительности пути пассажира")
+
+    class Histogram():
+        """
+        Гистограмма времени (секунд) фиксированного размера с логарифмическими корзинами, как в HDR Histogram.
+
+        Значения меньше 2 ** sub_bucket_bits хранятся точно, большие - с относительной погрешностью
+        не более 2 ** (1 - sub_bucket_bits). Значения больше 2 ** max_value_bits - 1 попадают в последнюю корзину
+        """
+        def __init__(self, sub_bucket_bits: int = 6, max_value_bits: int = 24) -> None:
+            self.sub_bucket_bits = sub_bucket_bits
+            self.sub_bucket_count = 1 << sub_bucket_bits
+            self.half_sub_bucket_count = self.sub_bucket_count >> 1
+            self.max_value = (1 << max_value_bits) - 1
+            self.counts = array('l', [0] * (self.get_index(self.max_value) + 1))
+            self.total_count = 0
+            # Наибольшее записанное значение, ограничивает перцентили сверху
+            self.highest_recorded_value = 0
+
+        def get_index(self, value: int) -> int:
+            if value < self.sub_bucket_count:
+                return value
+            shift = value.bit_length() - self.sub_bucket_bits
+            return self.sub_bucket_count + (shift - 1) * self.half_sub_bucket_count + \
+                (value >> shift) - self.half_sub_bucket_count
+
+        def get_highest_value(self, index: int) -> int:
+            """Наибольшее значение, попадающее в корзину index"""
+            if index < self.sub_bucket_count:
+                return index
+            shift, sub_index = divmod(index - self.sub_bucket_count, self.half_sub_bucket_count)
+            shift += 1
+            return ((sub_index + self.half_sub_bucket_count + 1) << shift) - 1
+
+        def record(self, value: int, count: int = 1) -> None:
+            value = min(max(value, 0), self.max_value)
+            self.counts[self.get_index(value)] += count
+            self.total_count += count
+            self.highest_recorded_value = max(self.highest_recorded_value, value)
+
+        def merge(self, other: PetriNet.Histogram) -> None:
+            """Добавляет значения другой гистограммы с теми же параметрами"""
+            for index, count in enumerate(other.counts):
+                if count:
+                    self.counts[index] += count
+            self.total_count += other.total_count
+            self.highest_recorded_value = max(self.highest_recorded_value, other.highest_recorded_value)
+
+        def get_percentile(self, percentile: float) -> int:
+            """Значение перцентиля (верхняя граница корзины), 0 для пустой гистограммы"""
+            if not self.total_count:
+                return 0
+            rank = max(math.ceil(percentile / 100 * self.total_count), 1)
+            cumulative_count = 0
+            for index, count in enumerate(self.counts):
+                cumulative_count += count
+                if cumulative_count >= rank:
+                    return min(self.get_highest_value(index), self.highest_recorded_value)
+            return self.highest_recorded_value
+
+        def to_report(self, prefix: str, max_value: int | None = None) -> dict:
+            """
+            Перцентили REPORT_PERCENTILES в минутах для отчёта: {prefix_p50: ..., ...}.
+            max_value - максимум показателя в отчёте (секунд): перцентили его не превышают
+            """
+            report = {}
+            for percentile in REPORT_PERCENTILES:
+                value = self.get_percentile(percentile)
+                if max_value is not None:
+                    value = min(value, max_value)
+                report[f'{prefix}_p{percentile}'] = get_report_minutes(value)
+            return report
+
+    class Passengers():
+        """
+        Все пассажиры расчёта в виде параллельных массивов, пассажир - индекс в массивах
+
+        Имена создаются лениво и только для пассажиров, попадающих в ответ (MAX_PASSENGERS_COUNT_FOR_RESPONSE).
+        При заданном seed имена повторяются от расчёта к расчёту
+        """
+        def __init__(self, seed: int | None = None) -> None:
+            self.start_bus_stop_ids = array('l')
+            self.end_bus_stop_ids = array('l')
+            # Время посадки в автобус и прибытия на остановку назначения (-1 - ещё не было)
+            self.boarding_times = array('l')
+            self.arrival_times = array('l')
+            self.names: dict[int, str] = {}
+            self.seed = seed
+            # Генератор имён создаётся при первом обращении
+            self.fake: Faker | None = None
+
+        def __len__(self) -> int:
+            return len(self.start_bus_stop_ids)
+
+        def add(self, start_point: int, end_points: list[int]) -> range:
+            """Добавляет пассажиров с остановки start_point до остановок end_points, возвращает их индексы"""
+            first_passenger = len(self)
+            count = len(end_points)
+            self.start_bus_stop_ids.extend(array('l', [start_point]) * count)
+            self.end_bus_stop_ids.extend(end_points)
+            self.boarding_times.extend(array('l', [-1]) * count)
+            self.arrival_times.extend(array('l', [-1]) * count)
+            return range(first_passenger, first_passenger + count)
+
+        def set_boarding_time(self, passengers, seconds_from_start: int) -> None:
+            for pas in passengers:
+                self.boarding_times[pas] = seconds_from_start
+
+        def set_arrival_time(self, passengers, seconds_from_start: int) -> None:
+            for pas in passengers:
+                self.arrival_times[pas] = seconds_from_start
+
+        def get_name(self, pas: int) -> str:
+            name = self.names.get(pas)
+            if name is None:
+                if self.fake is None:
+                    if self.seed is None:
+                        self.fake = fake
+                    else:
+                        self.fake = Faker("ru_RU")
+                        self.fake.seed_instance(self.seed)
+                name = self.names[pas] = self.fake.first_name()
+            return name
+
+        def to_dict(self, pas: int) -> dict:
+            """Получение данных пассажира для отображения на сайте"""
+            return {
+                "name": self.get_name(pas),
+                "start": self.start_bus_stop_ids[pas],
+                "end": self.end_bus_stop_ids[pas]
+            }
+
+    class PassengerQueue():
+        """Пассажиры, сгруппированные по остановке назначения (внутри группы - в порядке прихода)"""
+        def __init__(self, passengers: PetriNet.Passengers) -> None:
+            # Хранилище данных пассажиров, в очереди только их индексы
+            self.passengers = passengers
+            # id остановки назначения -> очередь пассажиров
+            self.buckets: dict[int, deque[int]] = {}
+            self.count = 0
+
+        def __len__(self) -> int:
+            return self.count
+
+        def append(self, bus_stop_id: int, pas: int) -> None:
+            """Добавляет пассажира, едущего до остановки bus_stop_id"""
+            bucket = self.buckets.get(bus_stop_id)
+            if bucket is None:
+                bucket = self.buckets[bus_stop_id] = deque()
+            bucket.append(pas)
+            self.count += 1
+
+        def extend(self, bus_stop_id: int, passengers) -> None:
+            """Добавляет пассажиров, едущих до остановки bus_stop_id"""
+            bucket = self.buckets.get(bus_stop_id)
+            if bucket is None:
+                bucket = self.buckets[bus_stop_id] = deque()
+            bucket.extend(passengers)
+            self.count = self.count + len(passengers)
+
+        def pop_destination(self, bus_stop_id: int) -> deque:
+            """Забирает всех пассажиров, едущих до остановки bus_stop_id"""
+            bucket = self.buckets.pop(bus_stop_id, None)
+            if bucket is None:
+                return deque()
+            self.count -= len(bucket)
+            return bucket
+
+        def pop_first(self, bus_stop_id: int, max_count: int) -> list:
+            """Забирает не более max_count первых пассажиров, едущих до остановки bus_stop_id"""
+            bucket = self.buckets[bus_stop_id]
+            if len(bucket) <= max_count:
+                return list(self.pop_destination(bus_stop_id))
+            passengers = [bucket.popleft() for _ in range(max_count)]
+            self.count -= max_count
+            return passengers
+
+        def destinations(self) -> list[int]:
+            """Остановки назначения, до которых есть пассажиры"""
+            return list(self.buckets)
+
+        def head(self, max_count: int) -> list[int]:
+            """Первые max_count пассажиров для отображения"""
+            passengers = []
+            for bucket in self.buckets.values():
+                for pas in bucket:
+                    if len(passengers) >= max_count:
+                        return passengers
+                    passengers.append(pas)
+            return passengers
+
+        def to_dict(self) -> list[dict]:
+            """Получение данных первых пассажиров для отображения на сайте"""
+            return [self.passengers.to_dict(pas) for pas in self.head(MAX_PASSENGERS_COUNT_FOR_RESPONSE)]
+
     class Bus():
         """Автобус"""
-        def __init__(self, route: Route, bus_id) -> None:
+        def __init__(self, route: PetriNet.RouteData, bus_id, passengers: PetriNet.Passengers,
+                     route_index: PetriNet.RouteIndex) -> None:
             # К какому маршруту относится
             self.route = route
             self.bus_id = bus_id
             # Вместимость
-            self.capacity = self.route.tc.capacity
-            # Координаты пути
-            self.route_list = [self.serialize_route_point(point) for point in self.route.list_coord.copy()]
-            self.bus_stop_ids = [bs.id for bs in self.route.busstop.all()]
-            # Индекс остановки из пути
+            self.capacity = self.route.capacity
+            # Индекс маршрута с координатами пути, общий для всех автобусов маршрута
+            self.route_index = route_index
+            # Направление движения (0 - прямое, 1 - обратное) и индекс остановки из пути
+            self.direction = 0
             self.bus_stop_index_now = 0
             # Пассажиры внутри
-            self.passengers = []
+            self.passengers = PetriNet.PassengerQueue(passengers)
+            # Остановки, проеханные без события при перемотке пустого автобуса (для анимации)
+            self.passed_route_points: list[dict] = []
             # Наверное сюда можно статистику добавить
 
-        @property
-        def get_rest_route(self) -> list[int]:
-            """Получение списка id оставшихся ОП до конечной"""
+        def get_rest_position(self) -> tuple[int, int]:
+            """Направление и позиция, с которых начинается оставшийся путь до конечной"""
             if self.ending_station():
-                route_list = self.route_list.copy()
-                route_list.reverse()
-                return [point['bus_stop_id'] for point in route_list[0:]]
-            return [point['bus_stop_id'] for point in self.route_list[self.bus_stop_index_now:]]
+                # На конечной автобус разворачивается и оставшийся путь - весь маршрут в обратную сторону
+                return 1 - self.direction, 0
+            return self.direction, self.bus_stop_index_now
 
-        def serialize_route_point(self, point: list):
-            # Удобное хранение данных маршрута
-            tolerance = Decimal('0.0001')
+        def get_route_point(self) -> dict:
+            """Текущая точка маршрута автобуса"""
+            return self.route_index.route_points[self.direction][self.bus_stop_index_now]
 
-            bus_stop_id = 0
-            lat, lon = point[0], point[1]
-            
-            # Сначала пробуем точное совпадение
-            for bs in self.route.busstop.all():
-                if lat == float(bs.latitude) and lon == float(bs.longitude):
-                    bus_stop_id = bs.id
-                    break
-            
-            # Если точное совпадение не найдено, ищем в радиусе tolerance
-            if bus_stop_id == 0:
-                nearby_stops = []
-                for bs in self.route.busstop.all():
-                    bs_lat = float(bs.latitude)
-                    bs_lon = float(bs.longitude)
-                    if (bs_lat >= lat - float(tolerance) and bs_lat <= lat + float(tolerance) and
-                        bs_lon >= lon - float(tolerance) and bs_lon <= lon + float(tolerance)):
-                        nearby_stops.append(bs)
-                
-                if nearby_stops:
-                    if len(nearby_stops) > 1:
-                        # Если найдено несколько остановок, выбираем ближайшую
-                        closest_stop = min(nearby_stops, key=lambda stop: 
-                                         get_travel_range(lat, lon, float(stop.latitude), float(stop.longitude)))
-                        bus_stop_id = closest_stop.id
-                    else:
-                        bus_stop_id = nearby_stops[0].id
-            
-            if bus_stop_id == 0:
-                raise Exception(f"Не удалось найти остановку для точки маршрута: {point}, {self.route.id}. Переформируйте маршрут.")
-
-            return {
-                "bus_stop_id": bus_stop_id,
-                "latitude": lat,
-                "longitude": lon,
-                }
+        def get_bus_stop_id(self) -> int:
+            """id текущей остановки автобуса"""
+            return self.route_index.sequences[self.direction][self.bus_stop_index_now]
 
         def ending_station(self) -> bool:
             """Проверяет конечную станцию"""
-            return True if self.bus_stop_index_now == len(self.route_list) - 1 else False
+            return True if self.bus_stop_index_now == self.route_index.last_position else False
         
         def start_station(self) -> bool:
             """Проверяет начальную станцию"""
@@ -217,26 +674,13 @@ class PetriNet():
 
         def get_travel_time(self) -> int:
             """Возвращает время, требуемое на дорогу до следующей остановки"""
-            start_index = self.bus_stop_index_now
-            end_index = start_index - 1 if self.ending_station() else start_index + 1
-            distance_km = get_travel_range(
-                self.route_list[start_index]["latitude"],
-                self.route_list[start_index]["longitude"],
-                self.route_list[end_index]["latitude"],
-                self.route_list[end_index]["longitude"],
-            )
-            return get_travel_time(
-                self.route_list[start_index]["latitude"],
-                self.route_list[start_index]["longitude"],
-                self.route_list[end_index]["latitude"],
-                self.route_list[end_index]["longitude"],
-                distance_km
-                )
+            direction, position = self.get_rest_position()
+            return self.route_index.segment_travel_times[direction][position]
 
         def drive_to_next_bus_stop(self):
             """Передвигает автобус на следующиую остановку"""
             if self.ending_station():
-                self.route_list.reverse()
+                self.direction = 1 - self.direction
                 self.bus_stop_index_now = 1
             else:
                 self.bus_stop_index_now += 1
@@ -246,24 +690,34 @@ class PetriNet():
 
         def to_dict(self) -> dict:
             """Получение данных для отображения на сайте"""
+            route_point = self.get_route_point()
             return {
                 "bus_id": self.bus_id,
-                "route_id": self.route.pk,
+                "route_id": self.route.id,
                 "capacity": self.capacity,
-                "bus_stop_id": self.route_list[self.bus_stop_index_now]["bus_stop_id"],
-                "lat": self.route_list[self.bus_stop_index_now]["latitude"],
-                "lng": self.route_list[self.bus_stop_index_now]["longitude"],
-                "passengers": [pas.to_dict() for pas in self.passengers[0:MAX_PASSENGERS_COUNT_FOR_RESPONSE]],
-                "passengers_count": len(self.passengers)
+                "bus_stop_id": route_point["bus_stop_id"],
+                "lat": route_point["latitude"],
+                "lng": route_point["longitude"],
+                "passengers": self.passengers.to_dict(),
+                "passengers_count": len(self.passengers),
+                "passed_route_points": self.passed_route_points,
             }
 
     class BusStop():
         """Остановочный пункт"""
-        def __init__(self, bus_stop: BusStop, passengers: list) -> None:
+        def __init__(self, bus_stop: PetriNet.BusStopData, passengers: PetriNet.PassengerQueue) -> None:
             self.bus_stop = bus_stop
             self.passengers = passengers
+            # Маршруты расчёта, проходящие через остановку
+            self.route_ids: list[int] = []
             # Время последнего отправления автобуса для каждого маршрута
             self.routs_last_start_bus_time = {}
+            # Статистика для отчёта: начальное кол-во пассажиров (очередь только убывает, поэтому оно же и пиковое)
+            # и время последней посадки в автобус
+            self.initial_passengers_count = len(passengers)
+            self.last_served_time: int | None = None
+            # Распределение времени ожидания пассажиров этой остановки
+            self.waiting_times = PetriNet.Histogram()
 
         def set_last_start_bus_time(self, route_id: int, seconds_from_start: int):
             """Устанавливает остановке последнее время отправления для текущего маршрута"""
@@ -272,44 +726,129 @@ class PetriNet():
         def to_dict(self) -> dict:
             """Получение данных для отображения на сайте"""
             return {
-                "id": self.bus_stop.pk,
+                "id": self.bus_stop.id,
                 "lat": self.bus_stop.latitude,
                 "lng": self.bus_stop.longitude,
-                "passengers": [pas.to_dict() for pas in self.passengers[0:MAX_PASSENGERS_COUNT_FOR_RESPONSE]],
+                "passengers": self.passengers.to_dict(),
                 "passengers_count": len(self.passengers)
             }
 
-    class Passenger():
-        """Пассажир"""
-        def __init__(self, start_point: int, end_point: int) -> None:
-            self.name = fake.first_name()
-            self.start_bus_stop_id = start_point
-            self.end_bus_stop_id = end_point
-
-        def get_route_count(self, bus_stop_ids: list[int]) -> int:
-            """Получение длительности пути пассажира (кол-ва остановок)"""
-            start_index = bus_stop_ids.index(self.start_bus_stop_id)
-            end_index = bus_stop_ids.index(self.end_bus_stop_id)
-            if start_index >= end_index:
-                raise Exception("Неправильное получение длительности пути пассажира")
-            return end_index - start_index
+    class Observer():
+        """
+        Наблюдатель за расчётом. Методы вызываются движком только если наблюдатель подключён,
+        без наблюдателя расчёт не делает лишней работы
+        """
+        def on_calculation_start(self) -> None:
+            pass
+
+        def on_event(self, seconds_from_start: int, buses_count: int, queue_depth: int) -> None:
+            """Обработка таймпоинта: кол-во автобусов в нём и кол-во таймпоинтов, оставшихся в очереди"""
+            pass
 
-        def to_dict(self) -> dict:
-            """Получение данных для отображения на сайте"""
+        def on_alighting(self, passengers_count: int) -> None:
+            pass
+
+        def on_boarding(self, passengers_count: int) -> None:
+            pass
+
+        def on_phase(self, phase: str, seconds: float) -> None:
+            """Время, затраченное на этап (init, alighting, boarding, departure, report)"""
+            pass
+
+        def on_parts_progress(self, boarded_passengers_count: int) -> None:
+            """
+            Расчёт частей сети в других процессах (PartitionedPetriNet): сколько пассажиров село во всех частях.
+            Вызывается периодически вместо событий частей, их счётчики объединяются в конце расчёта
+            """
+            pass
+
+        def on_calculation_end(self) -> None:
+            pass
+
+    class StatsCollector(Observer):
+        """Наблюдатель по умолчанию: счётчики расчёта для ответа и сохранения в симуляции"""
+        def __init__(self) -> None:
+            self.events_count = 0
+            self.bus_actions_count = 0
+            self.max_queue_depth = 0
+            self.queue_depth_sum = 0
+            self.alighting_operations_count = 0
+            self.alighted_passengers_count = 0
+            self.boarding_operations_count = 0
+            self.boarded_passengers_count = 0
+            self.phases: dict[str, float] = {}
+            self.calculation_started_at: float | None = None
+            self.calculation_time = 0.0
+
+        def on_calculation_start(self) -> None:
+            self.calculation_started_at = perf_counter()
+
+        def on_event(self, seconds_from_start: int, buses_count: int, queue_depth: int) -> None:
+            self.events_count += 1
+            self.bus_actions_count += buses_count
+            self.queue_depth_sum += queue_depth
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+        def on_alighting(self, passengers_count: int) -> None:
+            self.alighting_operations_count += 1
+            self.alighted_passengers_count += passengers_count
+
+        def on_boarding(self, passengers_count: int) -> None:
+            self.boarding_operations_count += 1
+            self.boarded_passengers_count += passengers_count
+
+        def on_phase(self, phase: str, seconds: float) -> None:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+        def on_calculation_end(self) -> None:
+            if self.calculation_started_at is not None:
+                self.calculation_time += perf_counter() - self.calculation_started_at
+
+        def merge(self, other: PetriNet.StatsCollector) -> None:
+            """Добавляет счётчики расчёта другой части сети, время расчёта не складывается (части считаются параллельно)"""
+            self.events_count += other.events_count
+            self.bus_actions_count += other.bus_actions_count
+            self.max_queue_depth = max(self.max_queue_depth, other.max_queue_depth)
+            self.queue_depth_sum += other.queue_depth_sum
+            self.alighting_operations_count += other.alighting_operations_count
+            self.alighted_passengers_count += other.alighted_passengers_count
+            self.boarding_operations_count += other.boarding_operations_count
+            self.boarded_passengers_count += other.boarded_passengers_count
+            for phase, seconds in other.phases.items():
+                self.on_phase(phase, seconds)
+
+        def summary(self) -> dict:
             return {
-                "name": self.name,
-                "start": self.start_bus_stop_id,
-                "end": self.end_bus_stop_id
+                'events_count': self.events_count,
+                'bus_actions_count': self.bus_actions_count,
+                'max_queue_depth': self.max_queue_depth,
+                'average_queue_depth': round(self.queue_depth_sum / (self.events_count or 1), 2),
+                'alighting_operations_count': self.alighting_operations_count,
+                'alighted_passengers_count': self.alighted_passengers_count,
+                'boarding_operations_count': self.boarding_operations_count,
+                'boarded_passengers_count': self.boarded_passengers_count,
+                'phases': {phase: round(seconds, 4) for phase, seconds in self.phases.items()},
+                'calculation_time': round(self.calculation_time, 4),
+                'events_per_second': round(self.events_count / self.calculation_time) if self.calculation_time else 0,
             }
 
     class TimeLine():
         """Порядок расчёта, класс работы с таймлайном"""
-        def __init__(self, bus_stops_now: dict) -> None:
+        def __init__(self, bus_stops_now: dict[int, PetriNet.BusStop],
+                     timeline_format: str = TIMELINE_FORMAT_FULL, record_timeline: bool = True) -> None:
+            # Действия, сгруппированные по секунде
             self.timeline = {}
-            # Указатель на автобусы из расчёта
+            # Очередь с приоритетом из секунд, для которых есть действия в self.timeline
+            self.timeline_heap = []
+            # Указатель на остановки расчёта, на которых есть пассажиры
             self.bus_stops_now = bus_stops_now
             # Данные для отправки на страницу расчёта
             self.data_to_response = []
+            self.timeline_format = timeline_format
+            # Записывать ли шаги для отрисовки (без временной шкалы отчёт считается по статистике расчёта)
+            self.record_timeline = record_timeline
+            # Для формата delta: остановки, изменившиеся с последнего шага
+            self.changed_bus_stops: dict[int, PetriNet.BusStop] = {}
 
         def add_timepoint(self, seconds_from_start: int, action: dict):
             """
@@ -327,6 +866,7 @@ class PetriNet():
                         action_in_timeline[key] = value
             else:
                 self.timeline[seconds_from_start] = action
+                heapq.heappush(self.timeline_heap, seconds_from_start)
 
         def add_list_timepoints(self, list_timepoints: list) -> None:
             """
@@ -343,42 +883,119 @@ class PetriNet():
                     item_for_responce[key] = [v.to_dict() for v in value]
                 else:
                     item_for_responce[key] = value.to_dict()
-            # Отправляем только остановки с пассажирами
-            item_for_responce["BusStops"] = [bus_stop.to_dict() for bus_stop in self.bus_stops_now.values() if
-                                             bus_stop.passengers]
+            if self.timeline_format == TIMELINE_FORMAT_DELTA and self.data_to_response:
+                # Отправляем только изменившиеся остановки (в том числе опустевшие)
+                item_for_responce["BusStops"] = [bus_stop.to_dict() for bus_stop in self.changed_bus_stops.values()]
+            else:
+                # Отправляем только остановки с пассажирами
+                item_for_responce["BusStops"] = [bus_stop.to_dict() for bus_stop in self.bus_stops_now.values()]
+            self.changed_bus_stops.clear()
             return item_for_responce
 
+        def mark_bus_stop_changed(self, bus_stop: PetriNet.BusStop) -> None:
+            """Отмечает остановку, пассажиры которой изменились, для формата delta"""
+            if self.record_timeline and self.timeline_format == TIMELINE_FORMAT_DELTA:
+                self.changed_bus_stops[bus_stop.bus_stop.id] = bus_stop
+
         def add_data_to_response(self, seconds_from_start: int, action: dict) -> None:
             """Добавляет действие для отрисовки"""
-            self.data_to_response.append((seconds_from_start, self.process_item_for_responce(action)))
+            if not self.record_timeline:
+                return
+            item = self.process_item_for_responce(action)
+            if self.timeline_format == TIMELINE_FORMAT_DELTA:
+                # Порядковый номер шага нужен, чтобы после сортировки по времени не применить устаревшее состояние
+                self.data_to_response.append((seconds_from_start, item, len(self.data_to_response)))
+            else:
+                self.data_to_response.append((seconds_from_start, item))
+
+        def get_delta_response(self, keyframe_interval: int = TIMELINE_KEYFRAME_INTERVAL) -> list:
+            """
+            Временная шкала в формате delta (после сортировки data_to_response по времени).
+
+            Первый шаг и каждый keyframe_interval-й - полные снимки ("keyframe": true) со всеми автобусами
+            и остановками с пассажирами. Остальные шаги содержат только автобусы этого шага и остановки,
+            состояние которых изменилось (опустевшие приходят с passengers_count = 0).
+            """
+            response = []
+            bus_stops_state: dict[int, tuple[int, dict]] = {}
+            buses_state: dict[tuple[int, int], dict] = {}
+            for index, (seconds_from_start, item, step_number) in enumerate(self.data_to_response):
+                bus_stops = []
+                for bus_stop in item['BusStops']:
+                    last_state = bus_stops_state.get(bus_stop['id'])
+                    if last_state is not None and last_state[0] > step_number:
+                        # Более новое состояние остановки уже отправлено
+                        continue
+                    bus_stops_state[bus_stop['id']] = (step_number, bus_stop)
+                    bus_stops.append(bus_stop)
+                for bus in item['Bus']:
+                    buses_state[(bus['route_id'], bus['bus_id'])] = bus
+                if index % keyframe_interval == 0:
+                    response.append((seconds_from_start, {
+                        'keyframe': True,
+                        'Bus': list(buses_state.values()),
+                        'BusStops': [bus_stop for _, bus_stop in bus_stops_state.values()
+                                     if bus_stop['passengers_count']],
+                    }))
+                else:
+                    response.append((seconds_from_start, {
+                        'keyframe': False,
+                        'Bus': item['Bus'],
+                        'BusStops': bus_stops,
+                    }))
+            return response
 
         def pop_first_timepoint(self) -> tuple[int, dict]:
             if not self.timeline:
                 return None, None
-            first_seconds_from_start, _ = self.get_first_timepoint()
+            first_seconds_from_start = heapq.heappop(self.timeline_heap)
             first_action = self.timeline.pop(first_seconds_from_start)
-            self.data_to_response.append((first_seconds_from_start, self.process_item_for_responce(first_action)))
+            self.add_data_to_response(first_seconds_from_start, first_action)
             return first_seconds_from_start, first_action
 
         def get_first_timepoint(self) -> tuple[int, dict]:
-            list_actions = [key for key in self.timeline.keys()]
-            list_actions.sort()
-            first_key = list_actions[0]
+            first_key = self.timeline_heap[0]
             return first_key, self.timeline[first_key]
 
-    def __init__(self, data_to_calculate: dict = {}) -> None:
+    def __init__(self, data_to_calculate: dict = {}, timeline_format: str = TIMELINE_FORMAT_FULL,
+                 record_timeline: bool = True, observer: PetriNet.Observer | None = None,
+                 seed: int | None = None) -> None:
         self.data_to_calculate = data_to_calculate
-        self.routes = data_to_calculate['routes']
+        # Снимок сети: расчёт работает только с ним и не обращается к БД
+        self.network: PetriNet.NetworkSnapshot = data_to_calculate['network']
+        self.routes = list(self.network.routes.values())
         self.data_to_report = {'routes': {route.id: {'route': route,
                                                      'average_passengers_stops_count': [0, 0],
                                                      'average_fullness': [0, 0],
                                                      'completed_trips': 0,  # Количество завершённых рейсов (достижений конечной)
+                                                     'boardings_count': 0,  # Количество посадок пассажиров
+                                                     'max_occupancy': 0,  # Наибольшее кол-во пассажиров в автобусе
+                                                     # Распределения времени ожидания и поездки пассажиров маршрута
+                                                     'waiting_times': self.Histogram(),
+                                                     'ride_times': self.Histogram(),
                                                      } for route in self.routes}}
+        # Генератор случайных чисел расчёта: при одном seed одинаковые входные данные дают одинаковый результат
+        self.seed = seed
+        self.random = random.Random(seed)
+        # Данные всех пассажиров расчёта
+        self.passengers = self.Passengers(seed)
+        # Индексы маршрутов (позиции остановок, расстояния и время в пути), общие для автобусов маршрута
+        self.route_indexes: dict[int, PetriNet.RouteIndex] = {}
         # Список объектов остановок с пассажирами
         self.busstops: dict[int, PetriNet.BusStop] = {}
-        self.busstops_cached: dict[int, BusStop] = {busstop.id: busstop for busstop in data_to_calculate['busstops']}
-        self.timeline = self.TimeLine(self.busstops)
+        # Остановки, на которых сейчас есть пассажиры, и их кол-во на каждом маршруте
+        self.waiting_busstops: dict[int, PetriNet.BusStop] = {}
+        self.routes_waiting_busstops_count: dict[int, int] = {route.id: 0 for route in self.routes}
+        # Время последнего события расчёта
+        self.last_seconds_from_start = 0
+        self.timeline = self.TimeLine(self.waiting_busstops, timeline_format, record_timeline)
+        # Наблюдатель за расчётом (счётчики, время этапов), None - без инструментирования
+        self.observer = observer
+        if observer is not None:
+            phase_start = perf_counter()
         self.init_action()
+        if observer is not None:
+            observer.on_phase('init', perf_counter() - phase_start)
         # Наверное переделать Имитацию работы онлайн с 400мс. на относительную скорость движения между actions
 
     def init_action(self):
@@ -387,15 +1004,18 @@ class PetriNet():
 
         for route in self.routes:
             time = 0
-            if not route.amount or not route.tc:
+            if not route.amount or not route.capacity:
                 logger.warning(f"На маршруте {route.id} не указаны автобусы, маршрут не будет учитываться в расчёте")
             else:
+                route_index = self.route_indexes[route.id] = self.RouteIndex.from_route(route,
+                                                                                         self.network.bus_stops)
                 for bus_id in range(route.amount):
+                    bus = self.Bus(route, bus_id + 1, self.passengers, route_index)
                     add_timepoints.append({
                         "seconds_from_start": time,
                         "action": {
                             "Bus": [
-                                self.Bus(route, bus_id + 1),
+                                bus,
                             ]
                         }
                     })
@@ -405,102 +1025,193 @@ class PetriNet():
             raise Exception("Отсутствуют автобусы на маршрутах")
 
         for busstops_direction in self.data_to_calculate['busstops_directions']:
-            bus_stop = self.busstops_cached[busstops_direction['busstop']]
-            valid_bus_stops = list(BusStop.objects.filter(
-                route__id__in=bus_stop.get_routes_ids(),
-                id__in=list(self.busstops_cached.keys())).values_list('id', flat=True).distinct())
-            if busstops_direction['busstop'] in valid_bus_stops:
-                valid_bus_stops.remove(busstops_direction['busstop'])
-            passengers = []
-            for direction, count in busstops_direction['directions'].items():
+            bus_stop = self.network.bus_stops[busstops_direction['busstop']]
+            valid_bus_stops = self.network.get_reachable_bus_stop_ids(bus_stop.id)
+            passengers = self.PassengerQueue(self.passengers)
+            # Направления в порядке номеров остановок: результат не зависит от порядка направлений в запросе
+            for direction, count in sorted(busstops_direction['directions'].items()):
                 if direction == 0:
-                    passengers.extend(
-                        self.Passenger(bus_stop.id,
-                                       random.choice(valid_bus_stops)) for pas in range(count)
-                                       )
+                    end_points = [self.random.choice(valid_bus_stops) for pas in range(count)]
+                    for pas, end_point in zip(self.passengers.add(bus_stop.id, end_points), end_points):
+                        passengers.append(end_point, pas)
                 else:
-                    passengers.extend(self.Passenger(bus_stop.id, direction) for pas in range(count))
+                    passengers.extend(direction, self.passengers.add(bus_stop.id, [direction] * count))
             self.busstops.update({bus_stop.id: self.BusStop(bus_stop, passengers)})
 
         if not self.busstops:
             raise Exception("Отсутствуют пассажиры")
 
-        for busstop in self.data_to_calculate['busstops']:
+        for busstop in self.network.bus_stops.values():
             if busstop.id not in self.busstops:
-                self.busstops.update({busstop.id: self.BusStop(busstop, [])})
+                self.busstops.update({busstop.id: self.BusStop(busstop, self.PassengerQueue(self.passengers))})
+
+        for route in self.routes:
+            for bus_stop_id in route.bus_stop_ids:
+                self.busstops[bus_stop_id].route_ids.append(route.id)
+
+        for busstop in self.busstops.values():
+            self.update_waiting_busstop(busstop)
 
         self.timeline.add_list_timepoints(add_timepoints)
 
+    def update_waiting_busstop(self, busstop: PetriNet.BusStop) -> None:
+        """
+        Обновляет множество остановок с пассажирами и счётчики таких остановок на маршрутах.
+        Вызывается после появления пассажиров на остановке и после посадки
+        """
+        waiting = bool(busstop.passengers)
+        if waiting == (busstop.bus_stop.id in self.waiting_busstops):
+            return
+        if waiting:
+            self.waiting_busstops[busstop.bus_stop.id] = busstop
+        else:
+            del self.waiting_busstops[busstop.bus_stop.id]
+        for route_id in busstop.route_ids:
+            self.routes_waiting_busstops_count[route_id] += 1 if waiting else -1
+
+    def is_bus_stop_needed(self, bus: PetriNet.Bus, bus_stop_id: int) -> bool:
+        """Проверяет, что на остановке есть пассажиры, которых автобус может довезти по пути до конечной"""
+        busstop = self.waiting_busstops.get(bus_stop_id)
+        if busstop is None:
+            return False
+        return any(bus.route_index.is_ahead(bus.direction, bus.bus_stop_index_now, destination)
+                   for destination in busstop.passengers.destinations())
+
+    def fast_forward_empty_bus(self, bus: PetriNet.Bus, seconds_from_start: int) -> int:
+        """
+        Перематывает пустой автобус, прибывший на остановку в seconds_from_start, до ближайшей остановки,
+        где он может кого-то забрать, или до конечной. Возвращает время в пути.
+
+        Пассажиры на остановках только убывают, поэтому пропущенные остановки не понадобились бы автобусу
+        и при пошаговом расчёте. На конечных остановках автобус не пропускает проверку интервала отправления.
+        Пропущенные остановки с расчётным временем сохраняются в passed_route_points для анимации
+        """
+        route_index = bus.route_index
+        direction = bus.direction
+        start_position = bus.bus_stop_index_now
+        while not bus.ending_station():
+            bus_stop_id = bus.get_bus_stop_id()
+            if bus_stop_id in route_index.terminal_bus_stop_ids or self.is_bus_stop_needed(bus, bus_stop_id):
+                break
+            route_point = bus.get_route_point()
+            bus.passed_route_points.append({
+                "seconds_from_start": seconds_from_start +
+                route_index.get_travel_time_between(direction, start_position, bus.bus_stop_index_now),
+                "bus_stop_id": bus_stop_id,
+                "lat": route_point["latitude"],
+                "lng": route_point["longitude"],
+            })
+            bus.bus_stop_index_now += 1
+        # Отправления с пропущенных остановок учитываются в средней наполненности (автобус пуст)
+        self.data_to_report['routes'][bus.route.id]['average_fullness'][1] += \
+            bus.bus_stop_index_now - start_position
+        return route_index.get_travel_time_between(direction, start_position, bus.bus_stop_index_now)
+
     def Calculation(self):
         """Модуль расчёта"""
+        observer = self.observer
+        if observer is not None:
+            observer.on_calculation_start()
         # Получаем первый таймпоинт
         this_seconds_from_start: int | None
         this_action: dict | None
         this_seconds_from_start, this_action = self.timeline.pop_first_timepoint()
         # Проходим по всем таймпоинтам
         while this_seconds_from_start or this_action:
+            if observer is not None:
+                observer.on_event(this_seconds_from_start, len(this_action["Bus"]), len(self.timeline.timeline_heap))
             # Проверяем все автобусы в таймпоинте
             bus: PetriNet.Bus
             for bus in this_action["Bus"].copy():
+                if observer is not None:
+                    phase_start = perf_counter()
+                # Пропущенные остановки уже отправлены в снимке прибытия, в следующих снимках они не повторяются
+                bus.passed_route_points = []
+                # Время автобуса: задержки посадки других автобусов этого таймпоинта его не сдвигают
+                bus_seconds_from_start: int = this_seconds_from_start
                 # Сколько временя заняло действие
                 time_delta: int = 0
                 # id текущей остановки автобуса
-                bus_stop_id_now: int = bus.route_list[bus.bus_stop_index_now]["bus_stop_id"]
-                # Сначала высаживаются из автобуса
-                pas: PetriNet.Passenger
-                for pas in bus.passengers.copy():
-                    # Если конечная точка пассажира совпадает с текущей автобуса
-                    if pas.end_bus_stop_id == bus_stop_id_now:
-                        # Пассажир прибыл в место назначения
-                        bus.passengers.remove(pas)
-                        time_delta += self.passenger_time
+                bus_stop_id_now: int = bus.get_bus_stop_id()
+                # Сначала высаживаются из автобуса пассажиры, чья конечная точка совпадает с текущей автобуса
+                arrived_passengers = bus.passengers.pop_destination(bus_stop_id_now)
+                # Пассажиры прибыли в место назначения
+                self.passengers.set_arrival_time(arrived_passengers, bus_seconds_from_start)
+                ride_times = self.data_to_report['routes'][bus.route.id]['ride_times']
+                for pas in arrived_passengers:
+                    ride_times.record(bus_seconds_from_start - self.passengers.boarding_times[pas])
+                time_delta += self.passenger_time * len(arrived_passengers)
                 # Добавить таймпоинт после высадки людей
                 if time_delta:
-                    this_seconds_from_start += time_delta
+                    bus_seconds_from_start += time_delta
                     time_delta = 0
-                    self.timeline.add_data_to_response(this_seconds_from_start, bus.get_action())
+                    self.timeline.add_data_to_response(bus_seconds_from_start, bus.get_action())
+                if observer is not None:
+                    if arrived_passengers:
+                        observer.on_alighting(len(arrived_passengers))
+                    phase_end = perf_counter()
+                    observer.on_phase('alighting', phase_end - phase_start)
+                    phase_start = phase_end
                 # Заходят пассажиры, которые могут доехать до своей остановки
-                for pas in self.busstops[bus_stop_id_now].passengers.copy():
-                    # Если конечная точка пассажира есть в оставшемся пути автобуса (до конечной),
-                    # и места в автобусе ещё есть
-                    if pas.end_bus_stop_id in bus.get_rest_route and len(bus.passengers) < bus.capacity:
-                        # Пассажир уходит с остановки
-                        self.busstops[bus_stop_id_now].passengers.remove(pas)
-                        # Садится в автобус
-                        bus.passengers.append(pas)
-                        # Считается средняя длительность пути пассажиров
-                        self.data_to_report['routes'][bus.route.id]['average_passengers_stops_count'][0] +=\
-                            pas.get_route_count(bus.get_rest_route)
-                        self.data_to_report['routes'][bus.route.id]['average_passengers_stops_count'][1] += 1
-                        # Это занимает некоторое время
-                        time_delta += self.passenger_time
-                # Добавить таймпоинт после посадки людей
+                rest_direction, rest_position = bus.get_rest_position()
+                route_report = self.data_to_report['routes'][bus.route.id]
+                bus_stop_passengers = self.busstops[bus_stop_id_now].passengers
+                for destination in bus_stop_passengers.destinations():
+                    free_places = bus.capacity - len(bus.passengers)
+                    # Мест в автобусе не осталось
+                    if free_places <= 0:
+                        break
+                    # Конечной точки пассажиров нет в оставшемся пути автобуса (до конечной)
+                    if not bus.route_index.is_ahead(rest_direction, rest_position, destination):
+                        continue
+                    # Пассажиры уходят с остановки и садятся в автобус
+                    boarded_passengers = bus_stop_passengers.pop_first(destination, free_places)
+                    self.timeline.mark_bus_stop_changed(self.busstops[bus_stop_id_now])
+                    bus.passengers.extend(destination, boarded_passengers)
+                    self.passengers.set_boarding_time(boarded_passengers, bus_seconds_from_start)
+                    # Все пассажиры появляются на остановках в начале расчёта, ожидание длится до посадки
+                    self.busstops[bus_stop_id_now].waiting_times.record(bus_seconds_from_start, len(boarded_passengers))
+                    route_report['waiting_times'].record(bus_seconds_from_start, len(boarded_passengers))
+                    # Считается средняя длительность пути пассажиров
+                    route_report['average_passengers_stops_count'][0] +=\
+                        bus.route_index.get_route_count(rest_direction, rest_position, destination) * \
+                        len(boarded_passengers)
+                    route_report['average_passengers_stops_count'][1] += len(boarded_passengers)
+                    route_report['boardings_count'] += len(boarded_passengers)
+                    # Это занимает некоторое время
+                    time_delta += self.passenger_time * len(boarded_passengers)
+                    if observer is not None:
+                        observer.on_boarding(len(boarded_passengers))
+                self.update_waiting_busstop(self.busstops[bus_stop_id_now])
                 if time_delta:
-                    this_seconds_from_start += time_delta
+                    # Статистика: время посадки на остановке и наибольшая наполненность автобусов маршрута
+                    self.busstops[bus_stop_id_now].last_served_time = bus_seconds_from_start
+                    route_report['max_occupancy'] = max(route_report['max_occupancy'], len(bus.passengers))
+                    # Добавить таймпоинт после посадки людей
+                    bus_seconds_from_start += time_delta
                     time_delta = 0
-                    self.timeline.add_data_to_response(this_seconds_from_start, bus.get_action())
-
-                def exists_pass_in_bus_path(bus_stop_ids: list[int]) -> bool:
-                    """Проверяем есть ли пассажиры на пути автобуса"""
-                    stop_intersections: set[int] = set(bus_stop_ids) & \
-                        {busstop.bus_stop.id for busstop in self.busstops.values() if busstop.passengers}
-                    return bool(stop_intersections)
+                    self.timeline.add_data_to_response(bus_seconds_from_start, bus.get_action())
+                if observer is not None:
+                    phase_end = perf_counter()
+                    observer.on_phase('boarding', phase_end - phase_start)
+                    phase_start = phase_end
 
                 # Автобус отправляется на следующую остановку,
                 # если она конечная: если есть пассажиры на его пути или в нём едем дальше, иначе останавливаемся
-                if (bus.ending_station() or bus.start_station()) and not bus.passengers and not exists_pass_in_bus_path(bus.bus_stop_ids):
+                if (bus.ending_station() or bus.start_station()) and not bus.passengers and \
+                        not self.routes_waiting_busstops_count[bus.route.id]:
                     # В этот момент можно у маркера отключить анимацию
                     # Автобус завершил работу - на маршруте больше нет пассажиров
                     pass
                 else:
                     # При достижении начальной остановки, если за последние route.interval минут выезжал автобус
                     if bus.ending_station() and not bus.chech_of_travel_permit(self.busstops[bus_stop_id_now],
-                                                                               this_seconds_from_start):
+                                                                               bus_seconds_from_start):
                         # Этот автобус ждёт route.interval минут
                         time_delta += bus.route.interval * 60
                     else:
                         # Устанавливаем остановке последнее время отправления для текущего маршрута
-                        self.busstops[bus_stop_id_now].set_last_start_bus_time(bus.route.id, this_seconds_from_start)
+                        self.busstops[bus_stop_id_now].set_last_start_bus_time(bus.route.id, bus_seconds_from_start)
                         # Добавляем время пути до следующей остановки
                         time_delta += bus.get_travel_time()
                         # Считаем среднюю наполненность
@@ -509,39 +1220,101 @@ class PetriNet():
                         # Считаем завершённый рейс когда автобус достигает конечной остановки
                         if bus.ending_station():
                             self.data_to_report['routes'][bus.route.id]['completed_trips'] += 1
-                        # Передвигаем автобус
+                        # Передвигаем автобус. Новый список: снимки на этой остановке ссылаются на текущий
+                        bus.passed_route_points = []
                         bus.drive_to_next_bus_stop()
+                        # Пустой автобус сразу едет до остановки, где он нужен, без промежуточных событий
+                        if not bus.passengers:
+                            time_delta += self.fast_forward_empty_bus(bus, bus_seconds_from_start + time_delta)
                     this_action["Bus"].remove(bus)
                     # Добавляем следующий таймпоинт в таймлайн
-                    self.timeline.add_timepoint(this_seconds_from_start + time_delta, bus.get_action())
+                    self.timeline.add_timepoint(bus_seconds_from_start + time_delta, bus.get_action())
+                self.last_seconds_from_start = max(self.last_seconds_from_start, bus_seconds_from_start)
+                if observer is not None:
+                    observer.on_phase('departure', perf_counter() - phase_start)
             this_seconds_from_start, this_action = self.timeline.pop_first_timepoint()
         self.timeline.data_to_response.sort(key=lambda i: i[0])
+        if observer is not None:
+            observer.on_calculation_end()
         return self.timeline.data_to_response
 
-    def CreateDataToReport(self) -> dict:
-        """Собирает данные для отчёта"""
+    def get_statistics(self) -> dict:
+        """
+        Статистика расчёта для отчёта без объектов расчёта (остановки и маршруты по id).
+        Статистику независимых частей сети можно объединить (merge_statistics) и построить по ней общий отчёт
+        """
+        return {
+            'last_seconds_from_start': self.last_seconds_from_start,
+            'bus_stops': {
+                bus_stop_id: {
+                    'initial_passengers_count': busstop.initial_passengers_count,
+                    # Время последней посадки, если остановка опустела, иначе ожидание длится до конца расчёта
+                    'last_served_time': None if busstop.passengers else busstop.last_served_time,
+                    'waiting_times': self.get_censored_waiting_times(busstop.waiting_times, len(busstop.passengers),
+                                                                     self.last_seconds_from_start),
+                } for bus_stop_id, busstop in self.busstops.items() if busstop.initial_passengers_count
+            },
+            'routes': {
+                route_id: {
+                    **{key: value for key, value in route.items() if key != 'route'},
+                    # Протяжённость маршрута по координатам в порядке следования (посчитана в индексе маршрута)
+                    'route_length': self.route_indexes[route_id].route_length if route_id in self.route_indexes else 0,
+                } for route_id, route in self.data_to_report['routes'].items()
+            },
+        }
+
+    @classmethod
+    def get_censored_waiting_times(cls, waiting_times: PetriNet.Histogram, waiting_count: int,
+                                   last_seconds_from_start: int) -> PetriNet.Histogram:
+        """
+        Ожидание пассажиров остановки вместе с не севшими до конца расчёта: их ожидание не меньше
+        last_seconds_from_start (цензурированные значения), без них перцентили занижены на перегруженных остановках
+        """
+        if not waiting_count:
+            return waiting_times
+        censored_waiting_times = cls.Histogram()
+        censored_waiting_times.merge(waiting_times)
+        censored_waiting_times.record(last_seconds_from_start, waiting_count)
+        return censored_waiting_times
+
+    @staticmethod
+    def merge_statistics(statistics_list: list[dict]) -> dict:
+        """Объединяет статистику расчётов частей сети без общих остановок"""
+        return {
+            'last_seconds_from_start': max(statistics['last_seconds_from_start'] for statistics in statistics_list),
+            'bus_stops': {bus_stop_id: bus_stop for statistics in statistics_list
+                          for bus_stop_id, bus_stop in statistics['bus_stops'].items()},
+            'routes': {route_id: route for statistics in statistics_list
+                       for route_id, route in statistics['routes'].items()},
+        }
+
+    @classmethod
+    def get_data_to_report(cls, network: PetriNet.NetworkSnapshot, statistics: dict) -> dict:
+        """Данные для отчёта по статистике расчёта (get_statistics), остановки и маршруты в порядке снимка сети"""
         data_to_report = {}
-        data_to_report['city_name'] = City.objects.get(id=self.data_to_calculate['city_id']).name
+        data_to_report['city_name'] = network.city_name
         data_to_report['data'] = str(datetime.datetime.now().isoformat(sep='_', timespec='seconds')).replace(':', '-')
         data_to_report['bus_stops'] = []
-        for bus_stop in self.data_to_calculate['busstops']:
-            bus_add = {}
-            for bus_in_calculate in self.timeline.data_to_response[0][1]['BusStops']:
-                if bus_in_calculate['id'] == bus_stop.id:
-                    bus_add['bus_name'] = bus_stop.name
-                    bus_add['passengers_count'] = bus_in_calculate['passengers_count']
-                    break
-            if bus_add:
-                for timepoint in self.timeline.data_to_response:
-                    for bus_in_calculate in timepoint[1]['BusStops']:
-                        if bus_in_calculate['id'] == bus_stop.id:
-                            bus_add['max_waiting_time'] = timepoint[0]
-                            break
-                    else:
-                        break
-                bus_add['max_waiting_time'] = int(bus_add['max_waiting_time'] / 60)
-                bus_add['routes_count'] = len(bus_stop.route_set.all())
-                data_to_report['bus_stops'].append(bus_add)
+        # Общее распределение времени ожидания для итоговой строки
+        waiting_times = cls.Histogram()
+        # Статистика остановок собрана во время расчёта, временная шкала не нужна
+        for bus_stop in network.bus_stops.values():
+            busstop = statistics['bus_stops'].get(bus_stop.id)
+            if busstop is None:
+                continue
+            # Ожидание длится до последней посадки на опустевшей остановке, иначе до конца расчёта
+            if busstop['last_served_time'] is None:
+                max_waiting_time = statistics['last_seconds_from_start']
+            else:
+                max_waiting_time = busstop['last_served_time']
+            data_to_report['bus_stops'].append({
+                'bus_name': bus_stop.name,
+                'passengers_count': busstop['initial_passengers_count'],
+                'max_waiting_time': get_report_minutes(max_waiting_time),
+                'routes_count': len(bus_stop.route_ids),
+                **busstop['waiting_times'].to_report('waiting_time', max_waiting_time),
+            })
+            waiting_times.merge(busstop['waiting_times'])
         results_add = {
             'bus_name': 'Итоги',
             'passengers_count': 0,
@@ -552,44 +1325,46 @@ class PetriNet():
             results_add['passengers_count'] += bus_stop['passengers_count']
             results_add['max_waiting_time'].append(bus_stop['max_waiting_time'])
         # Среднее время ожидания
-        results_add['max_waiting_time'] = int(sum(results_add['max_waiting_time']) /
-                                              len(results_add['max_waiting_time']))
+        results_add['max_waiting_time'] = round(sum(results_add['max_waiting_time']) /
+                                                len(results_add['max_waiting_time']), 1)
+        results_add.update(waiting_times.to_report('waiting_time'))
         data_to_report['bus_stops'].append(results_add)
         # Формировать цвет время ожидания автобуса относительно среднего
         # bus_add['color'] = 'white'
         data_to_report['routes'] = []
-        for route in self.data_to_report['routes'].values():
+        for route_data in network.routes.values():
+            route = statistics['routes'][route_data.id]
             add_route = route.copy()
-            add_route.pop('route')
-            add_route['name'] = route['route'].name
-            TC = route['route'].tc
-            add_route['TC'] = f'{TC.name}, {TC.capacity}' if TC else ''
-            add_route['interval'] = route['route'].interval
+            route_length = add_route.pop('route_length')
+            add_route.update(add_route.pop('waiting_times').to_report('waiting_time'))
+            add_route.update(add_route.pop('ride_times').to_report('ride_time'))
+            add_route['name'] = route_data.name
+            capacity = route_data.capacity
+            add_route['TC'] = f'{route_data.tc_name}, {capacity}' if route_data.tc_name is not None else ''
+            add_route['interval'] = route_data.interval
             add_route['average_passengers_stops_count'] = round(route['average_passengers_stops_count'][0] /
                                                                 (route['average_passengers_stops_count'][1] or 1), 2)
             add_route['average_fullness'] = str(round((route['average_fullness'][0] /
                                                        (route['average_fullness'][1] or 1) /
-                                                       (TC.capacity or 1)) * 100, 2)) + '%'
-            add_route['bus_stop_count'] = len(route['route'].busstop.all())
-            # Расчёт протяжённости маршрута по координатам в порядке следования
-            add_route['route_length'] = 0
-            list_coord = route['route'].list_coord
-            if list_coord and len(list_coord) > 1:
-                for i in range(len(list_coord) - 1):
-                    add_route['route_length'] += get_travel_range(
-                        list_coord[i][0],
-                        list_coord[i][1],
-                        list_coord[i + 1][0],
-                        list_coord[i + 1][1],
-                    )
-            add_route['route_length'] = round(add_route['route_length'], 2)
-            add_route['TC_count'] = route['route'].amount
+                                                       (capacity or 1)) * 100, 2)) + '%'
+            add_route['bus_stop_count'] = len(route_data.bus_stop_ids)
+            add_route['route_length'] = round(route_length, 2)
+            add_route['TC_count'] = route_data.amount
             add_route['trips_count'] = route['completed_trips']
             data_to_report['routes'].append(add_route)
         # Добавляем суммарное количество поездок (завершённых рейсов)
         data_to_report['total_trips_count'] = sum(route['trips_count'] for route in data_to_report['routes'])
         return data_to_report
 
+    def CreateDataToReport(self) -> dict:
+        """Собирает данные для отчёта"""
+        if self.observer is not None:
+            phase_start = perf_counter()
+        data_to_report = self.get_data_to_report(self.network, self.get_statistics())
+        if self.observer is not None:
+            self.observer.on_phase('report', perf_counter() - phase_start)
+        return data_to_report
+
     def combining_steps(self) -> list:
         """
         Объединяет шаги timeline для оптимизации отображения при нескольких маршрутах.
@@ -671,13 +1446,12 @@ class PetriNet():
         return combined_result
 
 
-def CreateResponseFile(data_to_report: dict) -> str:
+def CreateResponseFile(data_to_report: dict, path: str = 'media/reports/') -> str:
     city_name = data_to_report.get('city_name', '')
     date = data_to_report.get('data', '')
 
-    path = 'media/reports/'
     file_name = f'report_{city_name}_{date}.xlsx'
-    file_path = path + file_name
+    file_path = os.path.join(path, file_name)
     if os.path.isfile(file_path):
         return file_path
 
@@ -705,7 +1479,7 @@ def CreateResponseFile(data_to_report: dict) -> str:
     current_row = 1
 
     # Заголовок отчёта
-    ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=9)
+    ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=17)
     title_cell = ws.cell(row=current_row, column=1,
                          value=f'Результат расчёта нагрузки на транспортную сеть с использованием маршрутов: {", ".join([route["name"] for route in routes])}')
     title_cell.font = title_font
@@ -725,7 +1499,8 @@ def CreateResponseFile(data_to_report: dict) -> str:
         current_row += 1
 
         bus_stop_headers = ['Остановка', 'Количество пассажиров',
-                           'Максимальное время ожидания автобуса, мин.', 'Количество маршрутов, шт.']
+                           'Максимальное время ожидания автобуса, мин.', 'Количество маршрутов, шт.',
+                           *[f'Время ожидания p{percentile}, мин.' for percentile in REPORT_PERCENTILES]]
 
         for col, header in enumerate(bus_stop_headers, 1):
             cell = ws.cell(row=current_row, column=col, value=header)
@@ -739,7 +1514,8 @@ def CreateResponseFile(data_to_report: dict) -> str:
                 stop.get('bus_name', ''),
                 stop.get('passengers_count', ''),
                 stop.get('max_waiting_time', ''),
-                stop.get('routes_count', '')
+                stop.get('routes_count', ''),
+                *[stop.get(f'waiting_time_p{percentile}', '') for percentile in REPORT_PERCENTILES]
             ]
             for col, value in enumerate(row_data, 1):
                 cell = ws.cell(row=current_row, column=col, value=value)
@@ -764,7 +1540,11 @@ def CreateResponseFile(data_to_report: dict) -> str:
             'Количество остановок',
             'Протяжённость, км.',
             'Кол-во автобусов',
-            'Кол-во поездок'
+            'Кол-во поездок',
+            'Кол-во посадок',
+            'Макс. наполненность, чел.',
+            *[f'Время ожидания p{percentile}, мин.' for percentile in REPORT_PERCENTILES],
+            *[f'Время в пути p{percentile}, мин.' for percentile in REPORT_PERCENTILES]
         ]
 
         for col, header in enumerate(route_headers, 1):
@@ -784,7 +1564,11 @@ def CreateResponseFile(data_to_report: dict) -> str:
                 route.get('bus_stop_count', ''),
                 route.get('route_length', ''),
                 route.get('TC_count', ''),
-                route.get('trips_count', '')
+                route.get('trips_count', ''),
+                route.get('boardings_count', ''),
+                route.get('max_occupancy', ''),
+                *[route.get(f'waiting_time_p{percentile}', '') for percentile in REPORT_PERCENTILES],
+                *[route.get(f'ride_time_p{percentile}', '') for percentile in REPORT_PERCENTILES]
             ]
             for col, value in enumerate(row_data, 1):
                 cell = ws.cell(row=current_row, column=col, value=value)
@@ -795,7 +1579,7 @@ def CreateResponseFile(data_to_report: dict) -> str:
 
         # Итоговая строка
         total_trips = data_to_report.get('total_trips_count', 0)
-        for col in range(1, 10):
+        for col in range(1, len(route_headers) + 1):
             cell = ws.cell(row=current_row, column=col, value='')
             cell.font = header_font
             cell.alignment = center_alignment
@@ -0,0 +1,167 @@
+"""
+Повторные расчёты (репликации) одного сценария с разными seed.
+
+Направления пассажиров без направления случайны, поэтому один расчёт - одна выборка.
+Репликации считаются в пуле процессов без временной шкалы, по их отчётам считаются
+среднее и доверительный интервал каждого показателя CreateDataToReport
+"""
+from __future__ import annotations
+
+import math
+import multiprocessing
+
+from .parallel_utils import RunInProcessPool, check_worker_cancelled, get_worker_data, get_worker_shared_memory
+from .partition_utils import CreatePetriNet, PoolTaskObserver
+from .petri_net_utils import CALCULATION_ENGINE_DISCRETE, PetriNet
+
+# Ограничение количества репликаций одного расчёта
+REPLICATIONS_MAX = 100
+CONFIDENCE_LEVEL = 0.95
+# Квантили распределения Стьюдента для двустороннего интервала 95% при 1..30 степенях свободы,
+# при большем количестве репликаций используется квантиль нормального распределения
+T_QUANTILES_95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+                  2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+                  2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+Z_QUANTILE_95 = 1.96
+
+
+class RunningStatistic():
+    """Среднее и дисперсия показателя по мере поступления значений (алгоритм Уэлфорда)"""
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def get_summary(self) -> dict:
+        """Среднее, стандартное отклонение и границы доверительного интервала 95%"""
+        std = math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+        degrees_of_freedom = self.count - 1
+        if degrees_of_freedom < 1:
+            half_width = 0.0
+        else:
+            quantile = T_QUANTILES_95[degrees_of_freedom - 1] if degrees_of_freedom <= len(T_QUANTILES_95) \
+                else Z_QUANTILE_95
+            half_width = quantile * std / math.sqrt(self.count)
+        return {
+            'mean': round(self.mean, 2),
+            'std': round(std, 2),
+            'ci_low': round(self.mean - half_width, 2),
+            'ci_high': round(self.mean + half_width, 2),
+        }
+
+
+def get_metric_value(value) -> float | None:
+    """Числовое значение показателя отчёта: числа и проценты ('45.3%'), остальное не усредняется"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str) and value.endswith('%'):
+        try:
+            return float(value[:-1])
+        except ValueError:
+            return None
+    return None
+
+
+def get_mean_value(example, mean: float):
+    """Среднее в типе исходного показателя, чтобы отчёт сохранял формат CreateDataToReport"""
+    if isinstance(example, int):
+        return round(mean)
+    if isinstance(example, str):
+        return f'{round(mean, 2)}%'
+    return round(mean, 2)
+
+
+class ReplicationsAggregator():
+    """Накопление показателей отчётов репликаций: строки остановок и маршрутов совпадают между репликациями"""
+    sections = ('bus_stops', 'routes')
+
+    def __init__(self) -> None:
+        self.first_report: dict | None = None
+        self.statistics: dict[tuple, RunningStatistic] = {}
+
+    def add(self, data_to_report: dict) -> None:
+        if self.first_report is None:
+            self.first_report = data_to_report
+        for section in self.sections:
+            for row_number, row in enumerate(data_to_report[section]):
+                for field, value in row.items():
+                    value = get_metric_value(value)
+                    if value is not None:
+                        self.statistics.setdefault((section, row_number, field), RunningStatistic()).add(value)
+        self.statistics.setdefault(('total_trips_count',), RunningStatistic()).add(data_to_report['total_trips_count'])
+
+    def get_report(self, seeds: list[int]) -> dict:
+        """Отчёт в формате CreateDataToReport со средними значениями и интервалами в поле replications"""
+        data_to_report = {key: value for key, value in self.first_report.items() if key not in self.sections}
+        replications = {
+            'count': len(seeds),
+            'seeds': seeds,
+            'confidence_level': CONFIDENCE_LEVEL,
+        }
+        for section in self.sections:
+            data_to_report[section] = []
+            replications[section] = []
+            for row_number, row in enumerate(self.first_report[section]):
+                mean_row, intervals_row = {}, {}
+                for field, value in row.items():
+                    statistic = self.statistics.get((section, row_number, field))
+                    if statistic is None:
+                        mean_row[field] = intervals_row[field] = value
+                    else:
+                        mean_row[field] = get_mean_value(value, statistic.mean)
+                        intervals_row[field] = statistic.get_summary()
+                data_to_report[section].append(mean_row)
+                replications[section].append(intervals_row)
+        total_trips_count = self.statistics[('total_trips_count',)]
+        data_to_report['total_trips_count'] = round(total_trips_count.mean)
+        replications['total_trips_count'] = total_trips_count.get_summary()
+        data_to_report['replications'] = replications
+        return data_to_report
+
+
+def run_replication(seed: int) -> dict:
+    """Расчёт одной репликации в процессе пула, возвращается только отчёт"""
+    # Задача могла дождаться процесса уже после снятия задач пула
+    check_worker_cancelled()
+    replications_data = get_worker_data()
+    boarded_counts = get_worker_shared_memory()
+    observer = None
+    if boarded_counts is not None:
+        observer = PoolTaskObserver(seed - replications_data['seed'], boarded_counts)
+    # Части сети репликации считаются в этом же процессе: параллельны сами репликации
+    petri_net = CreatePetriNet(replications_data['data_to_calculate'], record_timeline=False, observer=observer,
+                               seed=seed, max_workers=1, engine=replications_data['engine'])
+    petri_net.Calculation()
+    return petri_net.CreateDataToReport()
+
+
+def RunReplications(data_to_calculate: dict, seed: int, replications_count: int,
+                    max_workers: int | None = None, engine: str = CALCULATION_ENGINE_DISCRETE,
+                    observer: PetriNet.Observer | None = None) -> dict:
+    """
+    Считает репликации с seed, seed + 1, ... и возвращает отчёт со средними и доверительными интервалами.
+    Наблюдатель получает среднее по репликациям количество севших пассажиров (on_parts_progress),
+    исключение из on_parts_progress (например, отмена расчёта) останавливает репликации
+    """
+    seeds = list(range(seed, seed + replications_count))
+    replications_data = {'data_to_calculate': data_to_calculate, 'engine': engine, 'seed': seed}
+    if observer is not None:
+        boarded_counts = multiprocessing.RawArray('q', replications_count)
+        reports = RunInProcessPool(run_replication, replications_data, seeds, max_workers,
+                                   shared_memory=boarded_counts,
+                                   on_wait=lambda: observer.on_parts_progress(sum(boarded_counts) //
+                                                                              replications_count))
+    else:
+        reports = RunInProcessPool(run_replication, replications_data, seeds, max_workers)
+    aggregator = ReplicationsAggregator()
+    for data_to_report in reports:
+        aggregator.add(data_to_report)
+    return aggregator.get_report(seeds)
@@ -2,7 +2,10 @@ from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 from rest_framework_gis.serializers import GeoFeatureModelSerializer
 
-from .models import EI, TC, BusStop, City, District, Route, Simulation
+from .models import EI, TC, BusStop, CalculationJob, City, District, Route, Simulation
+from .estimate_utils import ESTIMATE_HORIZON_MINUTES
+from .petri_net_utils import CALCULATION_ENGINE_DISCRETE, CALCULATION_ENGINES, TIMELINE_FORMAT_FULL, TIMELINE_FORMATS
+from .replication_utils import REPLICATIONS_MAX
 
 
 class CitySerializer(serializers.ModelSerializer):
@@ -286,20 +289,69 @@ class CalculationRequestSerializer(serializers.Serializer):
         default=True,
         help_text="Флаг для возвращения временной шкалы с имитацией работы транспортной сети"
     )
+    timeline_format = serializers.ChoiceField(
+        choices=TIMELINE_FORMATS,
+        default=TIMELINE_FORMAT_FULL,
+        help_text="Формат временной шкалы: full - все остановки с пассажирами на каждом шаге, "
+                  "delta - полные снимки (keyframe) периодически, между ними только изменившиеся автобусы и остановки"
+    )
+    seed = serializers.IntegerField(
+        default=0,
+        min_value=0,
+        help_text="Seed генератора случайных чисел: одинаковые данные с одинаковым seed дают одинаковый результат, "
+                  "повторный расчёт возвращается из кэша (с временной шкалой - если она не больше "
+                  "CALCULATION_CACHE_MAX_TIMELINE_SIZE байт)"
+    )
+    replications = serializers.IntegerField(
+        default=1,
+        min_value=1,
+        max_value=REPLICATIONS_MAX,
+        help_text="Количество репликаций с seed, seed + 1, ...: при значении больше 1 показатели отчёта - средние "
+                  "по репликациям, доверительные интервалы в data_to_report.replications, временная шкала не возвращается"
+    )
+    engine = serializers.ChoiceField(
+        choices=CALCULATION_ENGINES,
+        default=CALCULATION_ENGINE_DISCRETE,
+        help_text="Движок расчёта: discrete - пошаговый расчёт по отдельным пассажирам, mesoscopic - приближённый "
+                  "расчёт по количествам пассажиров для сценариев масштаба города (отчёт того же вида, "
+                  "временная шкала не возвращается)"
+    )
+    run_async = serializers.BooleanField(
+        default=False,
+        help_text="Выполнить расчёт асинхронно: ответ 202 с id задачи сразу, статус и результат - "
+                  "в /api/calculation-jobs/{id}/ (задачи выполняет команда run_calculation_worker)"
+    )
+    cancel_previous = serializers.BooleanField(
+        default=True,
+        help_text="Отменить незавершённые синхронные расчёты пользователя перед новым расчётом "
+                  "(во всех процессах веб-сервера)"
+    )
 
 
 class BusStopReportSerializer(serializers.Serializer):
     """Сериализатор для данных остановки в отчете"""
     bus_name = serializers.CharField(help_text="Название остановки")
     passengers_count = serializers.IntegerField(help_text="Количество пассажиров")
-    max_waiting_time = serializers.IntegerField(
+    max_waiting_time = serializers.FloatField(
         required=False,
-        help_text="Максимальное время ожидания в минутах"
+        help_text="Максимальное время ожидания в минутах (в итогах - среднее по остановкам)"
     )
     routes_count = serializers.CharField(
         required=False,
         help_text="Количество маршрутов"
     )
+    waiting_time_p50 = serializers.FloatField(
+        required=False,
+        help_text="Время ожидания пассажиров, 50-й перцентиль (мин.)"
+    )
+    waiting_time_p90 = serializers.FloatField(
+        required=False,
+        help_text="Время ожидания пассажиров, 90-й перцентиль (мин.)"
+    )
+    waiting_time_p99 = serializers.FloatField(
+        required=False,
+        help_text="Время ожидания пассажиров, 99-й перцентиль (мин.)"
+    )
 
 
 class RouteReportSerializer(serializers.Serializer):
@@ -317,6 +369,38 @@ class RouteReportSerializer(serializers.Serializer):
         required=False,
         help_text="Количество автобусов на маршруте"
     )
+    boardings_count = serializers.IntegerField(
+        required=False,
+        help_text="Количество посадок пассажиров"
+    )
+    max_occupancy = serializers.IntegerField(
+        required=False,
+        help_text="Наибольшее количество пассажиров в автобусе"
+    )
+    waiting_time_p50 = serializers.FloatField(
+        required=False,
+        help_text="Время ожидания пассажиров, 50-й перцентиль (мин.)"
+    )
+    waiting_time_p90 = serializers.FloatField(
+        required=False,
+        help_text="Время ожидания пассажиров, 90-й перцентиль (мин.)"
+    )
+    waiting_time_p99 = serializers.FloatField(
+        required=False,
+        help_text="Время ожидания пассажиров, 99-й перцентиль (мин.)"
+    )
+    ride_time_p50 = serializers.FloatField(
+        required=False,
+        help_text="Время в пути пассажиров, 50-й перцентиль (мин.)"
+    )
+    ride_time_p90 = serializers.FloatField(
+        required=False,
+        help_text="Время в пути пассажиров, 90-й перцентиль (мин.)"
+    )
+    ride_time_p99 = serializers.FloatField(
+        required=False,
+        help_text="Время в пути пассажиров, 99-й перцентиль (мин.)"
+    )
 
 
 class ReportDataSerializer(serializers.Serializer):
@@ -333,6 +417,15 @@ class ReportDataSerializer(serializers.Serializer):
         required=False,
         help_text="Данные по маршрутам"
     )
+    engine_stats = serializers.DictField(
+        required=False,
+        help_text="Счётчики движка расчёта: события, глубина очереди, посадки/высадки, время этапов, событий в секунду"
+    )
+    replications = serializers.DictField(
+        required=False,
+        help_text="Репликации: количество, seed, для каждого показателя остановок и маршрутов - среднее, "
+                  "стандартное отклонение и доверительный интервал (ci_low, ci_high)"
+    )
 
 
 class CalculationResponseSerializer(serializers.Serializer):
@@ -350,6 +443,11 @@ class CalculationResponseSerializer(serializers.Serializer):
         required=False,
         help_text="Временная шкала расчета (список кортежей: время, данные)"
     )
+    timeline_format = serializers.ChoiceField(
+        choices=TIMELINE_FORMATS,
+        required=False,
+        help_text="Формат временной шкалы в поле calculate"
+    )
     data_to_report = ReportDataSerializer(
         required=False,
         help_text="Данные для формирования отчета"
@@ -358,6 +456,136 @@ class CalculationResponseSerializer(serializers.Serializer):
         required=False,
         help_text="ID симуляции в базе (если есть)"
     )
+    seed = serializers.IntegerField(
+        required=False,
+        help_text="Seed, с которым выполнен расчёт"
+    )
+    cached = serializers.BooleanField(
+        required=False,
+        help_text="Результат получен из кэша или из сохранённой симуляции без повторного расчёта"
+    )
+
+
+class SweepRangeSerializer(serializers.Serializer):
+    """Сериализатор для диапазона значений параметра маршрута в переборе"""
+    min = serializers.IntegerField(min_value=1, help_text="Наименьшее значение")
+    max = serializers.IntegerField(min_value=1, help_text="Наибольшее значение (включительно)")
+    step = serializers.IntegerField(default=1, min_value=1, help_text="Шаг")
+
+    def validate(self, attrs):
+        """Валидация границ диапазона"""
+        if attrs['min'] > attrs['max']:
+            raise serializers.ValidationError("Наименьшее значение больше наибольшего")
+        return attrs
+
+
+class SweepRouteSerializer(serializers.Serializer):
+    """Сериализатор для перебираемых параметров маршрута"""
+    route_id = serializers.IntegerField(help_text="ID маршрута из данных для расчета")
+    amount = SweepRangeSerializer(
+        required=False,
+        help_text="Диапазон количества автобусов на маршруте (по умолчанию - как в маршруте)"
+    )
+    interval = SweepRangeSerializer(
+        required=False,
+        help_text="Диапазон интервала движения в минутах (по умолчанию - как в маршруте)"
+    )
+
+
+class SweepRequestSerializer(serializers.Serializer):
+    """Сериализатор для запроса перебора параметров маршрутов"""
+    data_to_calculate = CalculationDataSerializer(
+        help_text="Базовый сценарий: данные для расчета нагрузки"
+    )
+    seed = serializers.IntegerField(
+        default=0,
+        min_value=0,
+        help_text="Seed генератора случайных чисел, общий для всех вариантов"
+    )
+    routes = SweepRouteSerializer(
+        many=True,
+        help_text="Перебираемые параметры маршрутов, варианты - все сочетания значений"
+    )
+
+    def validate_routes(self, value):
+        """Валидация перебираемых маршрутов"""
+        if not value:
+            raise serializers.ValidationError("Список перебираемых маршрутов не может быть пустым")
+        return value
+
+
+class SweepResponseSerializer(serializers.Serializer):
+    """Сериализатор для ответа на запрос перебора параметров маршрутов"""
+    error = serializers.IntegerField(
+        help_text="Код ошибки (0 - успех, 1 - ошибка данных, 2 - ошибка расчета)"
+    )
+    error_message = serializers.CharField(
+        required=False,
+        allow_blank=True,
+        help_text="Сообщение об ошибке (если error != 0)"
+    )
+    seed = serializers.IntegerField(
+        required=False,
+        help_text="Seed, с которым выполнены расчёты"
+    )
+    variants = serializers.ListField(
+        child=serializers.DictField(),
+        required=False,
+        help_text="Варианты: номер, параметры маршрутов и основные показатели отчёта"
+    )
+    calculation_time = serializers.FloatField(
+        required=False,
+        help_text="Время расчёта всех вариантов в секундах"
+    )
+
+
+class EstimateRequestSerializer(serializers.Serializer):
+    """Сериализатор для запроса быстрой оценки нагрузки без расчёта"""
+    data_to_calculate = CalculationDataSerializer(
+        help_text="Данные для расчета нагрузки"
+    )
+    horizon_minutes = serializers.IntegerField(
+        default=ESTIMATE_HORIZON_MINUTES,
+        min_value=1,
+        max_value=1440,
+        help_text="Горизонт оценки насыщения в минутах: загрузка перегона сравнивается с вместимостью рейсов "
+                  "за это время"
+    )
+
+
+class EstimateResponseSerializer(serializers.Serializer):
+    """Сериализатор для ответа на запрос быстрой оценки нагрузки"""
+    error = serializers.IntegerField(
+        help_text="Код ошибки (0 - успех, 1 - ошибка данных, 2 - ошибка оценки)"
+    )
+    error_message = serializers.CharField(
+        required=False,
+        allow_blank=True,
+        help_text="Сообщение об ошибке (если error != 0)"
+    )
+    horizon_minutes = serializers.IntegerField(
+        required=False,
+        help_text="Горизонт оценки насыщения в минутах"
+    )
+    routes = serializers.ListField(
+        child=serializers.DictField(),
+        required=False,
+        help_text="Маршруты: ожидаемые пассажиры, наибольшая загрузка перегона, интервал, нужные рейсы, "
+                  "ожидаемое ожидание, насыщение и статус (ok, warning, overloaded)"
+    )
+    bus_stops = serializers.ListField(
+        child=serializers.DictField(),
+        required=False,
+        help_text="Остановки с пассажирами: пассажиры без маршрута расчёта, ожидаемое ожидание и признак насыщения"
+    )
+    totals = serializers.DictField(
+        required=False,
+        help_text="Итоги: пассажиры, ожидаемое ожидание, наибольшее насыщение и количество перегруженных маршрутов"
+    )
+    estimate_time_ms = serializers.FloatField(
+        required=False,
+        help_text="Время оценки в миллисекундах"
+    )
 
 
 class SimulationSerializer(serializers.ModelSerializer):
@@ -372,4 +600,26 @@ class SimulationSerializer(serializers.ModelSerializer):
             'report_data', 
             'description',
         ]
-        read_only_fields = ['id', 'created_at']
\ No newline at end of file
+        read_only_fields = ['id', 'created_at']
+
+
+class CalculationJobSerializer(serializers.ModelSerializer):
+    """Сериализатор для статуса задачи расчёта"""
+    user_name = serializers.CharField(source='user.username', read_only=True, default=None)
+
+    class Meta:
+        model = CalculationJob
+        fields = [
+            'id',
+            'status',
+            'stage',
+            'progress',
+            'user_name',
+            'simulation',
+            'error_message',
+            'cancel_requested',
+            'created_at',
+            'started_at',
+            'finished_at',
+        ]
+        read_only_fields = fields
@@ -0,0 +1,142 @@
+"""
+Перебор параметров маршрутов (количество автобусов и интервал движения).
+
+Все варианты считаются по одному снимку сети и одному пассажиропотоку с одним seed,
+поэтому различия в результатах вызваны только изменёнными параметрами маршрутов
+"""
+from __future__ import annotations
+
+import copy
+import itertools
+import logging
+import multiprocessing
+
+from .parallel_utils import (RunInProcessPool, TaskCancelled, check_worker_cancelled, get_worker_data,
+                             get_worker_shared_memory)
+from .partition_utils import PoolTaskObserver
+from .petri_net_utils import PetriNet
+
+logger = logging.getLogger('PetriNetManager')
+
+# Ограничение количества вариантов одного перебора
+SWEEP_MAX_VARIANTS = 200
+# Параметры маршрута, которые можно перебирать
+SWEEP_PARAMETERS = ('amount', 'interval')
+
+
+def GetSweepVariants(network: PetriNet.NetworkSnapshot, routes_ranges: list[dict]) -> list[dict[int, dict]]:
+    """
+    Варианты перебора - все сочетания значений параметров маршрутов.
+
+    routes_ranges: [{'route_id': 1, 'amount': {'min': 2, 'max': 6, 'step': 1}, 'interval': {...}}, ...],
+    не указанный параметр остаётся как в маршруте.
+    Вариант: {route_id: {'amount': 3, 'interval': 10}, ...}
+    """
+    routes_values = []
+    for route_ranges in routes_ranges:
+        route = network.routes.get(route_ranges['route_id'])
+        if route is None:
+            raise ValueError(f"Маршрут {route_ranges['route_id']} не участвует в расчёте")
+        parameters_values = []
+        for parameter in SWEEP_PARAMETERS:
+            parameter_range = route_ranges.get(parameter)
+            if parameter_range:
+                parameters_values.append(range(parameter_range['min'], parameter_range['max'] + 1,
+                                               parameter_range.get('step', 1)))
+            else:
+                parameters_values.append((getattr(route, parameter),))
+        routes_values.append([(route.id, dict(zip(SWEEP_PARAMETERS, values)))
+                              for values in itertools.product(*parameters_values)])
+
+    variants_count = 1
+    for route_values in routes_values:
+        variants_count *= len(route_values)
+    if variants_count > SWEEP_MAX_VARIANTS:
+        raise ValueError(f"Слишком много вариантов перебора: {variants_count}, допустимо не более {SWEEP_MAX_VARIANTS}")
+    return [dict(variant) for variant in itertools.product(*routes_values)]
+
+
+def ApplySweepVariant(network: PetriNet.NetworkSnapshot, variant: dict[int, dict]) -> PetriNet.NetworkSnapshot:
+    """Снимок сети с параметрами маршрутов варианта, остановки и неизменённые маршруты общие с исходным"""
+    routes = dict(network.routes)
+    for route_id, parameters in variant.items():
+        route = routes[route_id] = copy.copy(routes[route_id])
+        for parameter, value in parameters.items():
+            setattr(route, parameter, value)
+    return PetriNet.NetworkSnapshot(network.city_id, network.city_name, routes, network.bus_stops,
+                                    network.routes_bus_stop_ids)
+
+
+def GetReportMetrics(petri_net: PetriNet, data_to_report: dict) -> dict:
+    """Основные показатели отчёта одного варианта: итоги по остановкам и показатели маршрутов"""
+    totals = data_to_report['bus_stops'][-1]
+    return {
+        'passengers_count': totals['passengers_count'],
+        'average_max_waiting_time': totals['max_waiting_time'],
+        'waiting_time_p50': totals['waiting_time_p50'],
+        'waiting_time_p90': totals['waiting_time_p90'],
+        'waiting_time_p99': totals['waiting_time_p99'],
+        'total_trips_count': data_to_report['total_trips_count'],
+        'routes': {
+            route_id: {
+                'amount': route['TC_count'],
+                'interval': route['interval'],
+                'average_fullness': float(route['average_fullness'].rstrip('%')),
+                'trips_count': route['trips_count'],
+                'boardings_count': route['boardings_count'],
+                'max_occupancy': route['max_occupancy'],
+                'waiting_time_p90': route['waiting_time_p90'],
+                'ride_time_p90': route['ride_time_p90'],
+            }
+            # Маршруты отчёта идут в порядке маршрутов расчёта
+            for route_id, route in zip(petri_net.data_to_report['routes'], data_to_report['routes'])
+        },
+    }
+
+
+def run_sweep_variant(variant_number: int) -> dict:
+    """Расчёт одного варианта в процессе пула (без временной шкалы)"""
+    # Задача могла дождаться процесса уже после снятия задач пула
+    check_worker_cancelled()
+    sweep_data = get_worker_data()
+    variant = sweep_data['variants'][variant_number]
+    boarded_counts = get_worker_shared_memory()
+    observer = PoolTaskObserver(variant_number, boarded_counts) if boarded_counts is not None else None
+    result = {'variant': variant_number, 'error': 0}
+    try:
+        petri_net = PetriNet({'city_id': sweep_data['city_id'],
+                              'network': ApplySweepVariant(sweep_data['network'], variant),
+                              'busstops_directions': sweep_data['busstops_directions']},
+                             record_timeline=False, observer=observer, seed=sweep_data['seed'])
+        petri_net.Calculation()
+        result.update(GetReportMetrics(petri_net, petri_net.CreateDataToReport()))
+    except TaskCancelled:
+        raise
+    except Exception as e:
+        # Без пула отмену выбрасывает on_wait текущего процесса: отменённый перебор - не ошибка варианта
+        check_worker_cancelled()
+        logger.exception(f"Ошибка расчёта варианта перебора {variant_number}: {variant}")
+        result.update({'error': 2, 'error_message': str(e)})
+    return result
+
+
+def RunSweep(data_to_calculate: dict, variants: list[dict[int, dict]], seed: int | None = 0,
+             max_workers: int | None = None, observer: PetriNet.Observer | None = None) -> list[dict]:
+    """
+    Считает варианты перебора в пуле процессов, результаты в порядке вариантов.
+    Наблюдатель получает среднее по вариантам количество севших пассажиров (on_parts_progress),
+    исключение из on_parts_progress (например, отмена перебора) останавливает расчёт вариантов
+    """
+    sweep_data = {
+        'city_id': data_to_calculate['city_id'],
+        'network': data_to_calculate['network'],
+        'busstops_directions': data_to_calculate['busstops_directions'],
+        'variants': variants,
+        'seed': seed,
+    }
+    if observer is not None:
+        boarded_counts = multiprocessing.RawArray('q', len(variants))
+        return RunInProcessPool(run_sweep_variant, sweep_data, range(len(variants)), max_workers,
+                                shared_memory=boarded_counts,
+                                on_wait=lambda: observer.on_parts_progress(sum(boarded_counts) // len(variants)))
+    return RunInProcessPool(run_sweep_variant, sweep_data, range(len(variants)), max_workers)
@@ -1,3 +1,84 @@
-from django.test import TestCase
+"""
+Регрессионные тесты движка расчёта на синтетической сети benchmark_utils.
 
-# Create your tests here.
+Сеть строится сразу в виде снимка PetriNet.NetworkSnapshot, поэтому тесты
+не используют базу данных и PostGIS
+"""
+from django.test import SimpleTestCase
+
+from .benchmark_utils import CreateSyntheticNetwork
+from .mesoscopic_utils import MesoscopicNet
+from .partition_utils import PartitionedPetriNet, get_part_seed, merge_timelines
+from .petri_net_utils import REPORT_PERCENTILES, TIMELINE_FORMAT_DELTA, TIMELINE_FORMAT_FULL, PetriNet
+from .replication_utils import RunReplications
+
+
+def get_report(petri_net) -> dict:
+    """Отчёт расчёта без времени формирования"""
+    petri_net.Calculation()
+    data_to_report = petri_net.CreateDataToReport()
+    data_to_report.pop('data')
+    return data_to_report
+
+
+class CalculationRegressionTests(SimpleTestCase):
+    def setUp(self):
+        self.data_to_calculate = CreateSyntheticNetwork(stops_count=36, routes_count=4, stops_per_route=6,
+                                                        passengers_count=300, seed=3)
+
+    def test_report_is_equal_for_fixed_seed(self):
+        first_report = get_report(PetriNet(self.data_to_calculate, seed=7))
+        second_report = get_report(PetriNet(self.data_to_calculate, seed=7))
+        self.assertEqual(first_report, second_report)
+        self.assertEqual(first_report['bus_stops'][-1]['passengers_count'], 300)
+
+    def test_waiting_time_percentiles_do_not_exceed_max(self):
+        for petri_net in (PetriNet(self.data_to_calculate, seed=7), MesoscopicNet(self.data_to_calculate, seed=7)):
+            for bus_stop in get_report(petri_net)['bus_stops'][:-1]:
+                for percentile in REPORT_PERCENTILES:
+                    self.assertLessEqual(bus_stop[f'waiting_time_p{percentile}'], bus_stop['max_waiting_time'])
+
+    def test_partitioned_net_matches_single_net_for_one_component(self):
+        route_ids = list(self.data_to_calculate['network'].routes)
+        partitioned_report = get_report(PartitionedPetriNet(self.data_to_calculate, [route_ids], seed=7,
+                                                            max_workers=1))
+        single_report = get_report(PetriNet(self.data_to_calculate, seed=get_part_seed(7, route_ids)))
+        self.assertEqual(partitioned_report, single_report)
+
+    def test_replications_report_has_confidence_intervals(self):
+        data_to_report = RunReplications(self.data_to_calculate, seed=1, replications_count=3, max_workers=1)
+        replications = data_to_report['replications']
+        self.assertEqual(replications['count'], 3)
+        self.assertEqual(replications['seeds'], [1, 2, 3])
+        self.assertEqual(len(replications['bus_stops']), len(data_to_report['bus_stops']))
+        self.assertEqual(len(replications['routes']), len(data_to_report['routes']))
+        total_trips_count = replications['total_trips_count']
+        self.assertEqual(set(total_trips_count), {'mean', 'std', 'ci_low', 'ci_high'})
+        self.assertLessEqual(total_trips_count['ci_low'], total_trips_count['mean'])
+        self.assertLessEqual(total_trips_count['mean'], total_trips_count['ci_high'])
+
+    def test_mesoscopic_report_has_discrete_report_shape(self):
+        discrete_report = get_report(PetriNet(self.data_to_calculate, seed=7))
+        mesoscopic_report = get_report(MesoscopicNet(self.data_to_calculate, seed=7))
+        self.assertEqual(set(mesoscopic_report), set(discrete_report))
+        for section in ('bus_stops', 'routes'):
+            self.assertEqual(len(mesoscopic_report[section]), len(discrete_report[section]))
+            self.assertEqual(set(mesoscopic_report[section][0]), set(discrete_report[section][0]))
+        self.assertEqual(mesoscopic_report['bus_stops'][-1]['passengers_count'], 300)
+
+
+class MergeTimelinesTests(SimpleTestCase):
+    def test_full_timeline_is_ordered_by_time_then_part(self):
+        first_part = [(0, {'BusStops': ['a0']}), (20, {'BusStops': ['a20']})]
+        second_part = [(10, {'BusStops': ['b10']}), (20, {'BusStops': ['b20']})]
+        merged = merge_timelines([first_part, second_part], TIMELINE_FORMAT_FULL)
+        self.assertEqual([step[0] for step in merged], [0, 10, 20, 20])
+        # Каждый шаг содержит текущие остановки всех частей
+        self.assertEqual([step[1]['BusStops'] for step in merged],
+                         [['a0', 'b10'], ['a0', 'b10'], ['a20', 'b10'], ['a20', 'b20']])
+
+    def test_delta_timeline_is_renumbered(self):
+        first_part = [(0, 'a0', 0), (20, 'a20', 1)]
+        second_part = [(10, 'b10', 0)]
+        merged = merge_timelines([first_part, second_part], TIMELINE_FORMAT_DELTA)
+        self.assertEqual(merged, [(0, 'a0', 0), (10, 'b10', 1), (20, 'a20', 2)])
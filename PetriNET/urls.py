@@ -4,6 +4,7 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     BusStopView,
     BusStopViewSet,
+    CalculationJobViewSet,
     CalculationViewSet,
     CityView,
     CityViewSet,
@@ -27,6 +28,7 @@ api_router.register(r'busstops', BusStopViewSet, basename='busstop')
 api_router.register(r'routes', RouteViewSet, basename='route')
 api_router.register(r'districts', DistrictViewSet, basename='district')
 api_router.register(r'calculations', CalculationViewSet, basename='calculation')
+api_router.register(r'calculation-jobs', CalculationJobViewSet, basename='calculation-job')
 api_router.register(r'simulations', SimulationViewSet, basename='simulation')
 # api_router.register(r'measurement-units', EIViewSet, basename='ei')
 
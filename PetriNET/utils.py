@@ -1,3 +1,6 @@
+import select
+import socket
+
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 
@@ -13,4 +16,19 @@ def auth_required(permissions=[]):
 
         return wrapper
     
-    return real_decorator
\ No newline at end of file
+    return real_decorator
+
+
+def client_disconnected(request) -> bool:
+    """
+    Клиент закрыл соединение, не дождавшись ответа. Проверяется сокет gunicorn: закрытое соединение
+    доступно для чтения и возвращает пустые данные. Без сокета gunicorn (runserver) - всегда False
+    """
+    client_socket = request.META.get('gunicorn.socket')
+    if client_socket is None:
+        return False
+    try:
+        readable, _, _ = select.select([client_socket], [], [], 0)
+        return bool(readable) and client_socket.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
@@ -1,7 +1,8 @@
 import json
 import logging
 import os
-from typing import Any
+from time import perf_counter
+from typing import Any, Callable
 from urllib.parse import quote
 
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -15,9 +16,16 @@ from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
-from PetriNET.petri_net_utils import CreateResponseFile, GetDataToCalculate, PetriNet
-from PetriNET.utils import auth_required
+from PetriNET.calculation_pool_utils import (CALCULATION_CANCEL_WAIT_SECONDS, CalculationRejected,
+                                             CancelUserCalculations, GetCalculationPool, GetUserCancelGeneration)
+from PetriNET.calculation_utils import get_cancelled_response
+from PetriNET.estimate_utils import GetCalculationEstimate
+from PetriNET.job_utils import CancelCalculationJob
+from PetriNET.petri_net_utils import CreateResponseFile, GetDataToCalculate
+from PetriNET.sweep_utils import GetSweepVariants
+from PetriNET.utils import auth_required, client_disconnected
 from TransportMap.utils import (
     ValidatedDjangoFilterBackend,
     ValidatedOrderingFilter,
@@ -25,20 +33,25 @@ from TransportMap.utils import (
     ValidatedSearchFilter,
 )
 
-from .models import EI, TC, BusStop, City, District, Route, Simulation
+from .models import EI, TC, BusStop, CalculationJob, City, District, Route, Simulation
 from .serializers import (
     BusStopGeoSerializer,
     BusStopSerializer,
+    CalculationJobSerializer,
     CalculationRequestSerializer,
     CalculationResponseSerializer,
     CitySerializer,
     DistrictGeoSerializer,
     DistrictSerializer,
     EISerializer,
+    EstimateRequestSerializer,
+    EstimateResponseSerializer,
     RouteCreateUpdateSerializer,
     RouteDetailSerializer,
     RouteSerializer,
     SimulationSerializer,
+    SweepRequestSerializer,
+    SweepResponseSerializer,
     TCSerializer,
 )
 
@@ -704,9 +717,17 @@ class CalculationViewSet(viewsets.GenericViewSet):
     
     @extend_schema(
         summary="Выполнить расчёт нагрузки",
-        description="Принимает данные для расчёта нагрузки транспортной сети и возвращает результаты расчёта",
+        description="Принимает данные для расчёта нагрузки транспортной сети и возвращает результаты расчёта. "
+                    "Повторный запрос с теми же данными и seed возвращается из кэша (cached: true): отчёт - всегда, "
+                    "временная шкала - если она не больше CALCULATION_CACHE_MAX_TIMELINE_SIZE байт",
         request=CalculationRequestSerializer,
-        responses={200: CalculationResponseSerializer}
+        responses={
+            200: CalculationResponseSerializer,
+            202: 'Задача асинхронного расчёта создана (run_async)',
+            409: 'Расчёт отменён',
+            429: 'У пользователя уже выполняется расчёт, повторите после Retry-After',
+            503: 'Пул расчётов занят, повторите после Retry-After'
+        }
     )
     @action(detail=False, methods=['post'])
     def calculate(self, request):
@@ -734,240 +755,239 @@ class CalculationViewSet(viewsets.GenericViewSet):
         
         logger.info("Валидация входных данных успешно пройдена")
         
-        # Этап 2: Получение и обработка данных из базы данных
+        if serializer.validated_data['run_async']:
+            return self.create_job(request, serializer)
+
+        username = request.user.username
+        cancel_previous = serializer.validated_data['cancel_previous']
+        if cancel_previous:
+            CancelUserCalculations(username)
+
+        # Расчёт в пуле процессов: потоки веб-сервера не конкурируют с ним за GIL
         try:
-            processed_data = serializer.validated_data['data_to_calculate']
-            city_id = processed_data.get('city_id')
-            routes_count = len(processed_data.get('routes', []))
-            busstops_count = len(processed_data.get('busstops', {}))
-            
-            logger.info(
-                f"Обработка данных: город ID={city_id}, маршрутов={routes_count}, остановок={busstops_count}"
-            )
-            
-            data_to_calculate = GetDataToCalculate(processed_data)
-            
-            logger.info(
-                f"Данные успешно получены из БД: "
-                f"маршрутов={len(data_to_calculate.get('routes', []))}, "
-                f"остановок={len(data_to_calculate.get('busstops', []))}, "
-                f"направлений={len(data_to_calculate.get('busstops_directions', []))}"
-            )
-            
-        except ValueError as e:
+            response, status = GetCalculationPool().run(
+                serializer.validated_data, username, self.get_cancel_reason_getter(request),
+                wait_seconds=CALCULATION_CANCEL_WAIT_SECONDS if cancel_previous else 0)
+        except CalculationRejected as e:
+            return self.get_rejected_response(request, e)
+        if response['error']:
+            return Response(response, status=status)
+
+        # Этап 6: Валидация и возврат ответа
+        try:
+            # Не выполняем строгую валидацию, т.к. calculate содержит кортежи
+            # и data_to_report имеет динамическую структуру
+            response_serializer = CalculationResponseSerializer(data=response)
+            if response_serializer.is_valid():
+                logger.info("Расчёт успешно завершён, данные отправлены клиенту")
+                return Response(response_serializer.validated_data, status=200)
+            else:
+                # Логируем ошибки валидации, но все равно возвращаем результат
+                logger.warning(
+                    f"Ошибка валидации ответа (возвращаем данные как есть): {response_serializer.errors}"
+                )
+                logger.info("Расчёт успешно завершён, данные отправлены клиенту")
+                return Response(response, status=200)
+                
+        except Exception:
             logger.exception(
-                "Ошибка в структуре данных при получении данных для расчёта",
-                extra={'user': request.user.username, 'city_id': city_id}
+                "Ошибка при финальной валидации ответа",
+                extra={'user': request.user.username}
             )
-            return Response({
-                'error': 1,
-                'error_message': 'Ошибка в структуре данных для расчёта',
-                'details': str(e),
-                'stage': 'data_preparation',
-                'hint': 'Проверьте корректность указанных ID маршрутов и остановок'
-            }, status=400)
-            
-        except KeyError as e:
-            logger.exception(
-                "Отсутствует обязательное поле в данных",
+            # Всё равно возвращаем результат, т.к. расчёт выполнен успешно
+            logger.info("Расчёт успешно завершён, данные отправлены клиенту (без валидации)")
+            return Response(response, status=200)
+
+    @extend_schema(
+        summary="Отменить синхронные расчёты",
+        description="Отменяет незавершённые синхронные расчёты и переборы пользователя во всех процессах веб-сервера "
+                    "(признак отмены хранится в БД, общий кэш не нужен): расчёт останавливается в течение "
+                    "секунды, ожидающий его запрос получает ответ 409. Задачи асинхронного расчёта отменяются "
+                    "в /api/calculation-jobs/{id}/cancel/",
+        request=None,
+        responses={200: OpenApiTypes.OBJECT},
+        tags=['Расчёты']
+    )
+    @action(detail=False, methods=['post'])
+    def cancel(self, request):
+        """Отмена синхронных расчётов пользователя"""
+        CancelUserCalculations(request.user.username)
+        logger.info("Запрошена отмена синхронных расчётов", extra={'user': request.user.username})
+        return Response({'error': 0}, status=200)
+
+    def get_cancel_reason_getter(self, request) -> Callable[[], str | None]:
+        """Причина отмены синхронного расчёта, начатого сейчас, для CalculationPool"""
+        username = request.user.username
+        cancel_generation = GetUserCancelGeneration(username)
+
+        def get_cancel_reason() -> str | None:
+            """Расчёт не нужен: клиент закрыл соединение или пользователь отменил его (в том числе новым расчётом)"""
+            if client_disconnected(request):
+                return 'клиент закрыл соединение'
+            # Пока БД недоступна, номер отмены неизвестен и расчёт не отменяется
+            generation = GetUserCancelGeneration(username)
+            if None not in (generation, cancel_generation) and generation != cancel_generation:
+                return 'отменён пользователем'
+            return None
+
+        return get_cancel_reason
+
+    def get_rejected_response(self, request, rejected: CalculationRejected) -> Response:
+        """Ответ на расчёт, не принятый пулом: 429 или 503 с Retry-After"""
+        logger.warning(f"Расчёт не принят: {rejected}", extra={'user': request.user.username})
+        return Response({
+            'error': 3,
+            'error_message': str(rejected),
+            'retry_after': rejected.retry_after,
+            'stage': 'admission',
+            'hint': 'Долгий расчёт можно поставить в очередь с run_async'
+        }, status=rejected.status, headers={'Retry-After': str(rejected.retry_after)})
+
+    def create_job(self, request, serializer) -> Response:
+        """Асинхронный расчёт: задача в очереди БД, её выполняет команда run_calculation_worker"""
+        job = CalculationJob.objects.create(user=request.user, request_data=serializer.initial_data)
+        logger.info(f"Создана задача расчёта {job.pk}", extra={'user': request.user.username})
+        return Response({
+            'error': 0,
+            'job_id': job.pk,
+            'status': job.status,
+            'status_url': reverse('PetriNET:calculation-job-detail', args=[job.pk], request=request),
+            'result_url': reverse('PetriNET:calculation-job-result', args=[job.pk], request=request),
+        }, status=202)
+
+    @extend_schema(
+        summary="Перебор параметров маршрутов",
+        description="Считает базовый сценарий при всех сочетаниях диапазонов количества автобусов и интервала "
+                    "движения маршрутов. Перебор занимает место в пуле синхронных расчётов, варианты считаются "
+                    "по одному снимку сети в CALCULATION_POOL_INNER_WORKERS процессах, "
+                    "в ответе - основные показатели отчёта по каждому варианту",
+        request=SweepRequestSerializer,
+        responses={
+            200: SweepResponseSerializer,
+            400: 'Ошибка в данных для перебора',
+            409: 'Перебор отменён: клиент закрыл соединение или отправил /api/calculations/cancel/',
+            429: 'У пользователя уже выполняется расчёт, повторите после Retry-After',
+            503: 'Пул расчётов занят, повторите после Retry-After',
+            500: 'Ошибка при выполнении перебора'
+        },
+        tags=['Расчёты']
+    )
+    @action(detail=False, methods=['post'])
+    def sweep(self, request):
+        """Перебор параметров маршрутов по базовому сценарию"""
+        logger.info("Начало перебора параметров маршрутов")
+        serializer = SweepRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            logger.warning(
+                f"Ошибка валидации данных перебора: {serializer.errors}",
                 extra={'user': request.user.username}
             )
             return Response({
                 'error': 1,
-                'error_message': f'Отсутствует обязательное поле: {str(e)}',
-                'details': f'Не найдено поле {str(e)} в данных для расчёта',
-                'stage': 'data_preparation'
+                'error_message': 'Ошибка валидации входных данных. Проверьте корректность отправленных данных.',
+                'details': serializer.errors,
+                'stage': 'validation'
             }, status=400)
-            
+
+        try:
+            data_to_calculate = GetDataToCalculate(serializer.validated_data['data_to_calculate'])
+            variants = GetSweepVariants(data_to_calculate['network'], serializer.validated_data['routes'])
         except Exception as e:
-            error_message = str(e)
             logger.exception(
-                "Непредвиденная ошибка при подготовке данных для расчёта",
-                extra={'user': request.user.username, 'city_id': city_id}
+                "Ошибка при подготовке данных для перебора",
+                extra={'user': request.user.username}
             )
-            
-            # Определяем специфичные ошибки для пользователя
-            user_message = error_message
-            hint = None
-            
-            if 'Отсутствуют маршруты' in error_message:
-                hint = 'Убедитесь, что выбранные маршруты существуют в базе данных для указанного города'
-            elif 'Отсутствуют остановки' in error_message:
-                hint = 'Добавьте хотя бы одну остановку с пассажирами для начала расчёта'
-            elif 'Отсутствуют пассажиры' in error_message:
-                hint = 'Укажите направления движения и количество пассажиров на остановках'
-                
             return Response({
                 'error': 1,
-                'error_message': f'Ошибка подготовки данных: {user_message}',
-                'details': error_message,
-                'stage': 'data_preparation',
-                'hint': hint
+                'error_message': f'Ошибка подготовки данных: {str(e)}',
+                'details': str(e),
+                'stage': 'data_preparation'
             }, status=400)
 
-        # Этап 3: Инициализация сети Петри и выполнение расчёта
+        seed = serializer.validated_data['seed']
+        logger.info(f"Перебор: вариантов={len(variants)}, seed={seed}")
+        started_at = perf_counter()
         try:
-            logger.info("Инициализация сети Петри")
-            petri_net = PetriNet(data_to_calculate)
-            
-            logger.info("Запуск расчёта нагрузки")
-            calculate_result = petri_net.Calculation()
-            
-            logger.info(
-                f"Расчёт успешно завершён, временных точек: {len(calculate_result) if calculate_result else 0}"
-            )
-            
-        except ValueError as e:
-            logger.exception(
-                "Ошибка валидации данных при инициализации сети Петри",
+            # Перебор выполняется в процессе пула расчётов и занимает место наравне с синхронным расчётом
+            response, status = GetCalculationPool().run_sweep(data_to_calculate, variants, seed,
+                                                              request.user.username,
+                                                              self.get_cancel_reason_getter(request))
+        except CalculationRejected as e:
+            return self.get_rejected_response(request, e)
+        if response['error']:
+            return Response(response, status=status)
+        calculation_time = round(perf_counter() - started_at, 3)
+        logger.info(f"Перебор завершён: вариантов={len(variants)}, время={calculation_time} с")
+        return Response({
+            'error': 0,
+            'seed': seed,
+            'variants': response['variants'],
+            'calculation_time': calculation_time,
+        }, status=200)
+
+
+    @extend_schema(
+        summary="Быстрая оценка нагрузки без расчёта",
+        description="Оценивает нагрузку по вместимости и интервалу маршрутов, их протяжённости и пассажиропотоку "
+                    "в замкнутой форме за миллисекунды: ожидаемые пассажиры и наибольшая загрузка перегонов "
+                    "маршрутов, ожидание по интервалу движения и признаки насыщения. Подходит для отбора "
+                    "вариантов перед полным расчётом, результат не сохраняется",
+        request=EstimateRequestSerializer,
+        responses={
+            200: EstimateResponseSerializer,
+            400: 'Ошибка в данных для оценки',
+            500: 'Ошибка при выполнении оценки'
+        },
+        tags=['Расчёты']
+    )
+    @action(detail=False, methods=['post'])
+    def estimate(self, request):
+        """Быстрая оценка нагрузки транспортной сети"""
+        serializer = EstimateRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            logger.warning(
+                f"Ошибка валидации данных оценки: {serializer.errors}",
                 extra={'user': request.user.username}
             )
             return Response({
-                'error': 2,
-                'error_message': 'Ошибка в данных маршрутов или остановок',
-                'details': str(e),
-                'stage': 'petri_net_initialization',
-                'hint': 'Проверьте корректность координат остановок и структуры маршрутов'
+                'error': 1,
+                'error_message': 'Ошибка валидации входных данных. Проверьте корректность отправленных данных.',
+                'details': serializer.errors,
+                'stage': 'validation'
             }, status=400)
-            
-        except AttributeError as e:
+
+        try:
+            data_to_calculate = GetDataToCalculate(serializer.validated_data['data_to_calculate'])
+        except Exception as e:
             logger.exception(
-                "Ошибка доступа к атрибутам объектов при расчёте",
+                "Ошибка при подготовке данных для оценки",
                 extra={'user': request.user.username}
             )
             return Response({
-                'error': 2,
-                'error_message': 'Ошибка в структуре данных маршрутов',
+                'error': 1,
+                'error_message': f'Ошибка подготовки данных: {str(e)}',
                 'details': str(e),
-                'stage': 'calculation',
-                'hint': 'Убедитесь, что для всех маршрутов указаны типы транспорта и количество автобусов'
-            }, status=400)
-            
-        except ZeroDivisionError:
-            logger.exception(
-                "Ошибка деления на ноль при расчёте (вероятно, отсутствуют данные)",
-                extra={'user': request.user.username}
-            )
-            return Response({
-                'error': 2,
-                'error_message': 'Недостаточно данных для расчёта',
-                'details': 'Отсутствуют данные для вычисления средних показателей',
-                'stage': 'calculation',
-                'hint': 'Убедитесь, что на маршрутах есть автобусы и пассажиры'
+                'stage': 'data_preparation'
             }, status=400)
-            
-        except Exception as e:
-            error_message = str(e)
-            logger.exception(
-                f"Критическая ошибка при выполнении расчёта: {error_message}",
-                extra={'user': request.user.username}
-            )
-            
-            # Определяем специфичные ошибки
-            user_message = error_message
-            hint = None
-            
-            if 'Отсутствуют автобусы на маршрутах' in error_message:
-                hint = 'Укажите количество автобусов и тип транспорта для каждого маршрута'
-            elif 'Не удалось найти остановку для точки маршрута' in error_message:
-                hint = 'Возможно, координаты остановок на маршруте не совпадают с координатами в базе данных'
-            elif 'Неправильное получение длительности пути пассажира' in error_message:
-                hint = 'Проверьте, что конечная остановка пассажира находится после начальной на маршруте'
-                
-            return Response({
-                'error': 2,
-                'error_message': f'Ошибка при выполнении расчёта: {user_message}',
-                'details': error_message,
-                'stage': 'calculation',
-                'hint': hint
-            }, status=500)
-        
-        # Этап 4: Формирование данных для отчёта
+
         try:
-            logger.info("Формирование данных для отчёта")
-            data_to_report = petri_net.CreateDataToReport()
-            
-            logger.info(
-                f"Данные для отчёта сформированы: "
-                f"остановок={len(data_to_report.get('bus_stops', []))}, "
-                f"маршрутов={len(data_to_report.get('routes', []))}"
-            )
-            
-        except Exception:
+            estimate = GetCalculationEstimate(data_to_calculate, serializer.validated_data['horizon_minutes'])
+        except Exception as e:
             logger.exception(
-                "Ошибка при формировании данных для отчёта",
+                "Ошибка при выполнении оценки",
                 extra={'user': request.user.username}
             )
             return Response({
                 'error': 2,
-                'error_message': 'Ошибка при формировании данных для отчёта',
-                'stage': 'report_generation',
-                'hint': 'Расчёт выполнен, но не удалось сформировать отчёт'
+                'error_message': f'Ошибка при выполнении оценки: {str(e)}',
+                'details': str(e),
+                'stage': 'calculation'
             }, status=500)
-        
-        # Формирование успешного ответа
-        response = {'error': 0}
-        
-        if serializer.validated_data.get('get_timeline'):
-            # Если больше одного маршрута - используем сжатую версию timeline
-            combined_timeline = petri_net.combining_steps()
-            response['calculate'] = combined_timeline
-            logger.debug(
-                f"Включены данные временной шкалы "
-                f"(исходных точек: {len(calculate_result)}, после объединения: {len(combined_timeline)})"
-            )
-
-        response.update({
-            'data_to_report': data_to_report,
-        })
-
-        # Этап 5: Сохранение симуляции в базу данных
-        try:
-            logger.info("Сохранение результатов симуляции в БД")
-            
-            simulation = Simulation.objects.create(
-                input_data=serializer.validated_data,
-                report_data=data_to_report
-            )
-            
-            response['simulation_id'] = simulation.pk
-            
-            logger.info(f"Симуляция успешно сохранена с ID={simulation.pk}")
-            
-        except Exception:
-            logger.exception(
-                "Ошибка при сохранении симуляции в БД",
-                extra={'user': request.user.username}
-            )
-            # Не прерываем выполнение, если не удалось сохранить симуляцию
-            # Расчёт всё равно был успешным
-            logger.warning("Продолжаем выполнение без сохранения симуляции")
-
-        # Этап 6: Валидация и возврат ответа
-        try:
-            # Не выполняем строгую валидацию, т.к. calculate содержит кортежи
-            # и data_to_report имеет динамическую структуру
-            response_serializer = CalculationResponseSerializer(data=response)
-            if response_serializer.is_valid():
-                logger.info("Расчёт успешно завершён, данные отправлены клиенту")
-                return Response(response_serializer.validated_data, status=200)
-            else:
-                # Логируем ошибки валидации, но все равно возвращаем результат
-                logger.warning(
-                    f"Ошибка валидации ответа (возвращаем данные как есть): {response_serializer.errors}"
-                )
-                logger.info("Расчёт успешно завершён, данные отправлены клиенту")
-                return Response(response, status=200)
-                
-        except Exception:
-            logger.exception(
-                "Ошибка при финальной валидации ответа",
-                extra={'user': request.user.username}
-            )
-            # Всё равно возвращаем результат, т.к. расчёт выполнен успешно
-            logger.info("Расчёт успешно завершён, данные отправлены клиенту (без валидации)")
-            return Response(response, status=200)
-
+        logger.info(
+            f"Оценка нагрузки: маршрутов={len(estimate['routes'])}, "
+            f"перегружено={estimate['totals']['overloaded_routes_count']}, время={estimate['estimate_time_ms']} мс"
+        )
+        return Response({'error': 0, **estimate}, status=200)
 
 @extend_schema_view(
     list=extend_schema(
@@ -1015,3 +1035,93 @@ class SimulationViewSet(viewsets.ReadOnlyModelViewSet):
     # Поля для сортировки
     ordering_fields = ['created_at', 'id']
     ordering = ['-created_at']  # Сортировка по умолчанию (новые сверху)
+
+
+@extend_schema_view(
+    list=extend_schema(
+        summary="Получить список задач расчёта",
+        description="Возвращает задачи асинхронного расчёта пользователя (администратору - все задачи)",
+        tags=['Расчёты']
+    ),
+    retrieve=extend_schema(
+        summary="Получить статус задачи расчёта",
+        description="Возвращает статус, этап и долю выполнения задачи асинхронного расчёта",
+        tags=['Расчёты']
+    )
+)
+class CalculationJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet для задач асинхронного расчёта (только чтение).
+
+    Задачи создаются запросом расчёта с run_async и выполняются командой run_calculation_worker.
+    Результат выполненной задачи - ответ расчёта или перенаправление (303) на сохранённую симуляцию
+    """
+    serializer_class = CalculationJobSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = ValidatedPageNumberPagination
+
+    def get_queryset(self):
+        queryset = CalculationJob.objects.select_related('user')
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    @extend_schema(
+        summary="Получить результат задачи расчёта",
+        description="Для выполненной задачи возвращает ответ расчёта (если запрошена временная шкала) или "
+                    "перенаправляет (303) на сохранённую симуляцию с отчётом (410, если симуляция удалена). "
+                    "Для задачи с ошибкой - ответ с ошибкой и статусом расчёта, для задачи в очереди или в работе - "
+                    "202 со статусом задачи",
+        responses={
+            200: CalculationResponseSerializer,
+            202: CalculationJobSerializer,
+            303: 'Перенаправление на симуляцию с результатом расчёта',
+            410: 'Симуляция с результатом расчёта удалена'
+        },
+        tags=['Расчёты']
+    )
+    @action(detail=True, methods=['get'])
+    def result(self, request, pk=None):
+        """Результат задачи расчёта"""
+        job = self.get_object()
+        if job.status in (CalculationJob.STATUS_QUEUED, CalculationJob.STATUS_RUNNING):
+            return Response(self.get_serializer(job).data, status=202)
+        if job.status == CalculationJob.STATUS_CANCELLED and job.result is None:
+            # Задача отменена в очереди, до начала расчёта
+            return Response(get_cancelled_response(job.stage), status=409)
+        if job.result is not None:
+            return Response(job.result, status=job.response_status or 200)
+        if job.simulation_id is None:
+            # Отчёт хранился в симуляции, которую удалили после выполнения задачи
+            return Response({
+                'error': 1,
+                'error_message': 'Результат задачи больше недоступен: симуляция с отчётом удалена',
+                'status': job.status
+            }, status=410)
+        location = reverse('PetriNET:simulation-detail', args=[job.simulation_id], request=request)
+        return Response({'error': 0, 'simulation_id': job.simulation_id}, status=303, headers={'Location': location})
+
+    @extend_schema(
+        summary="Отменить задачу расчёта",
+        description="Задача в очереди отменяется сразу. У выполняющейся задачи запрашивается отмена: "
+                    "обработчик останавливает расчёт в течение нескольких секунд и сохраняет задачу отменённой",
+        request=None,
+        responses={
+            200: CalculationJobSerializer,
+            409: 'Задача уже завершена'
+        },
+        tags=['Расчёты']
+    )
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Отмена задачи расчёта"""
+        job = self.get_object()
+        if not CancelCalculationJob(job):
+            return Response({
+                'error': 1,
+                'error_message': 'Задача уже завершена',
+                'status': job.status
+            }, status=409)
+        logger.info(f"Запрошена отмена задачи расчёта {job.pk}", extra={'user': request.user.username})
+        job.refresh_from_db()
+        return Response(self.get_serializer(job).data, status=200)
@@ -84,6 +84,44 @@ DATABASES = {
     },
 }
 
+# Кэш отчётов расчёта (ключ - хэш входных данных, см. GetCalculationHash) и небольших временных шкал.
+# Локальный кэш у каждого процесса свой и ограничен CACHE_MAX_ENTRIES записями, между процессами результат
+# берётся из сохранённой симуляции. Для общего кэша процессов - CACHE_BACKEND Redis или memcached
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', 'optimove'),
+    },
+}
+if CACHE_BACKEND == 'django.core.cache.backends.locmem.LocMemCache':
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100))}
+# Время хранения результата расчёта в кэше, секунд
+CALCULATION_CACHE_TIMEOUT = int(os.getenv('CALCULATION_CACHE_TIMEOUT', 60 * 60))
+# Наибольший размер временной шкалы в кэше (байт, 0 - шкала не кэшируется): повторный запрос с get_timeline
+# получает отчёт и шкалу из кэша, шкала большего размера строится повторным расчётом
+CALCULATION_CACHE_MAX_TIMELINE_SIZE = int(os.getenv('CALCULATION_CACHE_MAX_TIMELINE_SIZE', 1024 * 1024))
+# Количество процессов для параллельных расчётов (перебор, репликации, независимые части сети) в командах
+# и обработчике асинхронных задач, 0 - по количеству ядер. Запросы API используют CALCULATION_POOL_INNER_WORKERS
+CALCULATION_MAX_WORKERS = int(os.getenv('CALCULATION_MAX_WORKERS', 0))
+# Асинхронные задачи расчёта (run_calculation_worker): пауза при пустой очереди, период отметки обработчика
+# и время без отметки, после которого задача остановившегося обработчика возвращается в очередь (секунд)
+CALCULATION_JOB_POLL_INTERVAL = float(os.getenv('CALCULATION_JOB_POLL_INTERVAL', 2))
+CALCULATION_JOB_HEARTBEAT_INTERVAL = float(os.getenv('CALCULATION_JOB_HEARTBEAT_INTERVAL', 30))
+CALCULATION_JOB_STALE_TIMEOUT = int(os.getenv('CALCULATION_JOB_STALE_TIMEOUT', 5 * 60))
+# Пул процессов синхронных расчётов: процессов расчётов, ожидающих в очереди и расчётов одного пользователя
+# (0 - без ограничения). Ограничения действуют на весь сервер, а не на процесс gunicorn: места хранятся в БД
+# (CalculationPoolSlot). Выполняющиеся и ожидающие расчёты занимают потоки gthread-обработчиков, поэтому их сумма
+# должна быть меньше workers * threads в gunicorn.conf.py, чтобы карта отвечала
+CALCULATION_POOL_MAX_CONCURRENCY = int(os.getenv('CALCULATION_POOL_MAX_CONCURRENCY', 1))
+CALCULATION_POOL_QUEUE_LENGTH = int(os.getenv('CALCULATION_POOL_QUEUE_LENGTH', 1))
+CALCULATION_POOL_USER_LIMIT = int(os.getenv('CALCULATION_POOL_USER_LIMIT', 1))
+# Процессов одного расчёта пула для независимых частей сети и репликаций (1 - в процессе пула). Учитывается
+# в CALCULATION_POOL_MAX_CONCURRENCY: одновременно выполняется MAX_CONCURRENCY // INNER_WORKERS расчётов
+CALCULATION_POOL_INNER_WORKERS = int(os.getenv('CALCULATION_POOL_INNER_WORKERS', 1))
+# Retry-After (секунд) до первого выполненного расчёта, затем - по средней длительности расчёта
+CALCULATION_POOL_RETRY_AFTER = int(os.getenv('CALCULATION_POOL_RETRY_AFTER', 30))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,